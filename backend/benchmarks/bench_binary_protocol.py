@@ -0,0 +1,140 @@
+"""
+Benchmark: canvas bandwidth and server CPU, JSON text frames vs the binary subprotocol.
+
+For a stream of draw segments in one room it measures, per segment:
+  - bytes on the wire per recipient (raw, and after permessage-deflate)
+  - server CPU to decode the inbound frame, encode the fan-out frame once and
+    compress it for every recipient (one deflate context per connection, as
+    permessage-deflate with context takeover does)
+
+Run from backend/:
+    python -m benchmarks.bench_binary_protocol
+"""
+
+import random
+import struct
+import time
+import zlib
+
+from services import binary_protocol, codec
+
+ROOM_SIZE = 15
+SEGMENTS = 5000
+COLORS = ["#ffffff", "#ef4444", "#f97316", "#eab308", "#22c55e", "#3b82f6", "#a855f7", "#ec4899"]
+USERS = [f"5d7a{i:04d}-3c1e-4b8f-9a2d-{i:012d}" for i in range(4)]
+
+
+def _make_strokes() -> list[tuple[str, dict]]:
+    rng = random.Random(7)
+    segments = []
+    x, y = 400.0, 300.0
+    for i in range(SEGMENTS):
+        prev_x, prev_y = x, y
+        x = max(0.0, min(1600.0, x + rng.uniform(-6, 6)))
+        y = max(0.0, min(900.0, y + rng.uniform(-6, 6)))
+        segments.append((
+            USERS[(i // 200) % len(USERS)],
+            {
+                "x": round(x, 2), "y": round(y, 2),
+                "prevX": round(prev_x, 2), "prevY": round(prev_y, 2),
+                "color": COLORS[(i // 500) % len(COLORS)],
+                "size": 3, "tool": "pen" if i % 900 else "eraser",
+            },
+        ))
+    return segments
+
+
+def _deflater():
+    return zlib.compressobj(wbits=-15)
+
+
+def _deflate(ctx, payload: bytes) -> bytes:
+    # permessage-deflate: compress, sync-flush, strip the 4-byte tail
+    return (ctx.compress(payload) + ctx.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+def bench_json(segments, deflate: bool) -> tuple[float, float]:
+    inbound = [codec.dumps({"type": "canvas-draw", "drawData": d}) for _, d in segments]
+    contexts = [_deflater() for _ in range(ROOM_SIZE - 1)]
+    wire = 0
+    start = time.process_time()
+    for (user_id, _), raw in zip(segments, inbound):
+        message = codec.loads(raw)
+        frame = codec.dumps({"type": "canvas-draw", "userId": user_id, "drawData": message["drawData"]}).encode()
+        if deflate:
+            for ctx in contexts:
+                wire += len(_deflate(ctx, frame))
+        else:
+            wire += len(frame) * len(contexts)
+    cpu = time.process_time() - start
+    return cpu / len(segments), wire / len(segments) / len(contexts)
+
+
+def bench_binary(segments, deflate: bool) -> tuple[float, float]:
+    # Each sender interns its colors once; inbound frames are single packed segments
+    inbound = []
+    seen_colors: dict[str, int] = {}
+    for _, d in segments:
+        if d["color"] not in seen_colors:
+            seen_colors[d["color"]] = len(seen_colors)
+            raw = d["color"].encode()
+            inbound.append(struct.pack("<BBHB", binary_protocol.OP_INTERN, binary_protocol.TABLE_COLOR,
+                                       seen_colors[d["color"]], len(raw)) + raw)
+        inbound.append(
+            struct.pack("<BH", binary_protocol.OP_DRAW, 1)
+            + binary_protocol._pack_segment(0, seen_colors[d["color"]], d)
+        )
+
+    decoder = binary_protocol.InboundDecoder()
+    room = binary_protocol.RoomCodec()
+    contexts = [_deflater() for _ in range(ROOM_SIZE - 1)]
+    senders = iter(segments)
+    wire = 0
+    start = time.process_time()
+    for raw in inbound:
+        message = decoder.decode(raw)
+        if message is None:
+            continue
+        user_id, _ = next(senders)
+        interns, frame = room.encode({"type": "canvas-draw", "userId": user_id, "drawData": message["drawData"]})
+        for payload in (interns, frame):
+            if payload is None:
+                continue
+            if deflate:
+                for ctx in contexts:
+                    wire += len(_deflate(ctx, payload))
+            else:
+                wire += len(payload) * len(contexts)
+    cpu = time.process_time() - start
+    return cpu / len(segments), wire / len(segments) / len(contexts)
+
+
+def main():
+    segments = _make_strokes()
+    print(f"codec: {codec.CODEC_NAME}, room of {ROOM_SIZE}, {SEGMENTS} segments\n")
+    print(f"{'mode':<22} {'bytes/segment/peer':>19} {'server CPU/segment (us)':>24}")
+    results = {}
+    for deflate in (False, True):
+        for name, fn in (("json", bench_json), ("binary", bench_binary)):
+            cpu, size = fn(segments, deflate)
+            label = f"{name}{' + deflate' if deflate else ''}"
+            results[label] = (cpu, size)
+            print(f"{label:<22} {size:>19.1f} {cpu * 1e6:>24.1f}")
+
+    def compare(label: str, before: str, after: str):
+        before_cpu, before_size = results[before]
+        after_cpu, after_size = results[after]
+        print(
+            f"{label:<44} {before_size / after_size:>5.1f}x less bandwidth, "
+            f"{before_cpu / after_cpu:>5.1f}x less CPU"
+        )
+
+    print()
+    compare("binary vs json (no compression)", "json", "binary")
+    compare("binary vs json (both deflated)", "json + deflate", "binary + deflate")
+    # uvicorn negotiates permessage-deflate by default, so deflated JSON is today's baseline;
+    # packed canvas frames gain little from deflate and are cheapest sent uncompressed.
+    compare("binary uncompressed vs json + deflate", "json + deflate", "binary")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark: per-message CPU cost of a room broadcast.
+
+Compares serializing once per recipient (what send_json per peer did) with the
+encode-once path through ConnectionManager.broadcast_to_room. Both paths feed
+the same per-connection queues; only the enqueue side is timed, the writer
+tasks drain outside the measurement.
+
+Run from backend/:
+    python -m benchmarks.bench_broadcast
+"""
+
+import asyncio
+import json
+import time
+
+from services import codec
+from services.websocket_manager import ConnectionManager
+
+ROOM_SIZES = [2, 5, 15, 30, 50]
+MESSAGES = 2000
+
+SAMPLE = {
+    "type": "canvas-draw",
+    "userId": "6f1c2a9e-4a53-4a8e-9d3b-3f0b8f7d2c11",
+    "drawData": {
+        "x": 412.5, "y": 233.25, "prevX": 410.0, "prevY": 230.75,
+        "color": "#f97316", "size": 4, "tool": "pen",
+    },
+}
+
+
+class FakeWebSocket:
+    """Accepts frames without doing any I/O."""
+
+    async def accept(self, subprotocol: str | None = None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def _stdlib_dumps(message: dict) -> str:
+    # Same serialization Starlette's WebSocket.send_json does
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+async def _drain(manager: ConnectionManager, room_id: str):
+    while any(c.queue or c.priority for c in manager.rooms[room_id].values()):
+        await asyncio.sleep(0)
+
+
+async def bench_room(size: int) -> tuple[float, float]:
+    manager = ConnectionManager()
+    for i in range(size):
+        await manager.connect("bench", f"user-{i}", f"User {i}", FakeWebSocket())
+    await _drain(manager, "bench")
+    conns = list(manager.rooms["bench"].values())
+
+    per_peer = 0.0
+    for _ in range(MESSAGES):
+        start = time.process_time()
+        for conn in conns:
+            conn.enqueue(SAMPLE["type"], _stdlib_dumps(SAMPLE))
+        per_peer += time.process_time() - start
+        await _drain(manager, "bench")
+
+    encode_once = 0.0
+    for _ in range(MESSAGES):
+        start = time.process_time()
+        await manager.broadcast_to_room("bench", SAMPLE)
+        encode_once += time.process_time() - start
+        await _drain(manager, "bench")
+
+    for i, conn in enumerate(conns):
+        manager.disconnect("bench", f"user-{i}", conn)
+    await asyncio.sleep(0)
+    return per_peer / MESSAGES, encode_once / MESSAGES
+
+
+async def main():
+    print(f"codec: {codec.CODEC_NAME}, {MESSAGES} messages per room size\n")
+    print(f"{'room':>5} {'encode per peer (us)':>21} {'encode once (us)':>17} {'speedup':>8}")
+    for size in ROOM_SIZES:
+        per_peer, encode_once = await bench_room(size)
+        print(
+            f"{size:>5} {per_peer * 1e6:>21.2f} {encode_once * 1e6:>17.2f} "
+            f"{per_peer / encode_once:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Benchmark: live rankings (services.leaderboard.MemoryRanks) vs scanning a dict of scores.
+
+Without an ordered index, "rank of user X" means counting everyone ahead of them
+and "top N" means a partial sort, both O(n) per request. MemoryRanks keeps
+(-xp, user_id) in a SortedList, so updates and lookups stay O(log n) as the
+user count grows. In Redis mode the same operations are ZADD, ZREVRANK (+ZSCORE,
+pipelined), ZRANGE REV: one round-trip each, two for neighbors.
+
+Run from backend/:
+    python -m benchmarks.bench_leaderboard_ranks [users]
+"""
+
+import heapq
+import random
+import statistics
+import sys
+import time
+
+from services.leaderboard import MemoryRanks
+
+SIZES = (1_000, 10_000, 100_000)
+OPERATIONS = 2_000
+RADIUS = 5
+
+
+def _us(fn, args: list) -> float:
+    """Median microseconds per call."""
+    samples = []
+    for a in args:
+        start = time.perf_counter()
+        fn(a)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+# --- Scanning a plain dict of scores ---
+
+def scan_rank(scores: dict, user_id: str) -> int:
+    xp = scores[user_id]
+    return sum(1 for uid, s in scores.items() if s > xp or (s == xp and uid < user_id))
+
+
+def scan_top(scores: dict, n: int) -> list:
+    return heapq.nsmallest(n, ((-s, uid) for uid, s in scores.items()))
+
+
+def run(users: int):
+    rng = random.Random(users)
+    ids = [f"user-{i:07d}" for i in range(users)]
+    scores = {uid: rng.randint(0, 50_000) for uid in ids}
+
+    start = time.perf_counter()
+    ranks = MemoryRanks()
+    for uid, xp in scores.items():
+        ranks.set(uid, xp)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    sample = [rng.choice(ids) for _ in range(OPERATIONS)]
+    scan_sample = sample[: max(20, OPERATIONS * 1_000 // users)]
+
+    def update(uid):
+        xp = ranks.scores[uid] + rng.randint(1, 100)
+        ranks.set(uid, xp)
+        scores[uid] = xp
+
+    def neighbors(uid):
+        position = ranks.rank(uid)
+        ranks.range(max(0, position - RADIUS), position + RADIUS + 1)
+
+    rows = [
+        ("xp update", _us(update, sample), None),
+        ("rank of user", _us(ranks.rank, sample), _us(lambda u: scan_rank(scores, u), scan_sample)),
+        ("top 10", _us(lambda _: ranks.range(0, 10), sample), _us(lambda _: scan_top(scores, 10), scan_sample)),
+        ("neighbors ±5", _us(neighbors, sample), None),
+    ]
+
+    # Sanity check against the scan
+    for uid in sample[:20]:
+        assert ranks.rank(uid) == scan_rank(scores, uid)
+
+    print(f"\n{users:,} users (index built in {build_ms:.0f} ms), median µs per call")
+    print(f"{'operation':<16} {'indexed':>10} {'scan':>12} {'speedup':>9}")
+    for label, indexed, scan in rows:
+        if scan is None:
+            print(f"{label:<16} {indexed:>10.1f} {'-':>12} {'-':>9}")
+        else:
+            print(f"{label:<16} {indexed:>10.1f} {scan:>12.1f} {scan / indexed:>8.0f}x")
+
+
+if __name__ == "__main__":
+    for size in ((int(sys.argv[1]),) if len(sys.argv) > 1 else SIZES):
+        run(size)
@@ -0,0 +1,100 @@
+"""
+Latency benchmark: the same service calls on each Redis backend.
+
+Runs presence, rate limiter and leaderboard calls through services.redis_client
+on the three backends in services.redis_backends:
+- upstash: Upstash REST stand-in (benchmarks.upstash_stub), HTTPS replaced by HTTP
+- resp:    native Redis stand-in (benchmarks.resp_stub) behind the pooled RESP client
+- memory:  the in-process store
+Both stand-ins serve from their own thread and share the in-process store's
+keyspace code, so the differences are protocol and client overhead plus
+latency_ms, which is added to every round-trip on both (0 by default; an
+in-region Redis is typically 0.2-0.5 ms, Upstash REST 1-2 ms).
+
+Run from backend/:
+    python -m benchmarks.bench_redis_backends [latency_ms]
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from benchmarks.resp_stub import RespStub
+from benchmarks.upstash_stub import UpstashStub
+from services import leaderboard_cache, presence, rate_limiter, redis_client
+from services.redis_backends import create_client
+
+ITERATIONS = 200
+BATCH_USERS = 500
+RATE_LIMIT_CLIENTS = 200
+CONCURRENT = 200
+ROOM_SIZE = 10
+
+
+async def _seed(redis):
+    await redis.zadd(leaderboard_cache.LEADERBOARD_KEY, {f"u{i}": i * 10 for i in range(50)})
+    await redis.hset(
+        leaderboard_cache.LEADERBOARD_DATA_KEY,
+        values={f"u{i}": json.dumps({"display_name": f"User {i}", "xp": i * 10}) for i in range(50)},
+    )
+
+
+async def _median_us(fn) -> float:
+    samples = []
+    for i in range(ITERATIONS):
+        start = time.perf_counter()
+        await fn(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+async def _rate_limit_sync(limiter: rate_limiter.RateLimiter, i: int):
+    for c in range(RATE_LIMIT_CLIENTS):
+        limiter.check(f"default:ip:{c}", 60, 60)
+    await limiter.sync()
+
+
+async def _run(backend: str, url: str) -> dict[str, float]:
+    redis = create_client(backend, url, "stub")
+    redis_client._redis = redis
+    await _seed(redis)
+    members = {(f"room-{i // ROOM_SIZE}", f"user-{i}"): f"User {i}" for i in range(BATCH_USERS)}
+    limiter = rate_limiter.RateLimiter(sync_ms=60_000)
+
+    cases = {
+        "get": lambda i: redis.get("rooms:directory:version"),
+        "join_room": lambda i: presence.join_room("bench", f"user-{i}", "Bench"),
+        f"presence_flush_{BATCH_USERS}": lambda i: presence.write_batch(members, {}),
+        f"rate_limit_sync_{RATE_LIMIT_CLIENTS}": lambda i: _rate_limit_sync(limiter, i),
+        "leaderboard_top10": lambda i: leaderboard_cache.get_cached_leaderboard(10),
+    }
+    results = {label: await _median_us(fn) for label, fn in cases.items()}
+
+    # Throughput with many callers at once: pool and connection reuse
+    start = time.perf_counter()
+    await asyncio.gather(*(redis.get(f"online:user-{i}") for i in range(CONCURRENT * 10)))
+    results[f"get_x{CONCURRENT * 10}_concurrent"] = (time.perf_counter() - start) * 1e6
+
+    await redis.close()
+    redis_client._redis = None
+    return results
+
+
+async def main(latency_ms: float):
+    upstash = UpstashStub(latency_ms=latency_ms)
+    resp = RespStub(latency_ms=latency_ms)
+    urls = {"upstash": upstash.start_in_thread(), "resp": resp.start_in_thread(), "memory": ""}
+
+    table = {backend: await _run(backend, url) for backend, url in urls.items()}
+
+    print(f"Median µs per call ({ITERATIONS} calls), {latency_ms:g} ms added per round-trip\n")
+    print(f"{'operation':<28}" + "".join(f"{b:>12}" for b in urls) + f"{'upstash/resp':>14}")
+    for label in table["upstash"]:
+        row = [table[b][label] for b in urls]
+        print(f"{label:<28}" + "".join(f"{v:>12.0f}" for v in row) + f"{row[0] / row[1]:>13.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 0))
@@ -0,0 +1,134 @@
+"""
+Latency benchmark: service calls while Redis degrades, and hedged reads.
+
+Part 1 drives a WebSocket join (presence.join_room), a room-list count lookup
+(presence.get_online_counts) and a leaderboard read through an Upstash stand-in
+that is healthy, then answers only after SLOW_SECONDS, then recovers. Each call
+is bounded by its deadline until the circuit breaker opens; from then on it
+takes the no-Redis fallback at once, and the breaker's probes close it again
+once the stand-in recovers.
+
+Part 2 gives a share of requests a long tail (TAIL_SHARE delayed by TAIL_MS)
+and compares read latency percentiles with and without hedging.
+
+Run from backend/:
+    python -m benchmarks.bench_redis_degraded
+"""
+
+import asyncio
+import random
+import statistics
+import time
+
+from benchmarks.upstash_stub import UpstashStub
+from services import leaderboard_cache, presence, redis_client
+from services.redis_backends import create_client
+
+LATENCY_MS = 2
+SLOW_SECONDS = 3.0
+CALLS_PER_PHASE = 30
+COOLDOWN = 1.0
+TAIL_SHARE = 0.05
+TAIL_MS = 100
+HEDGE_CALLS = 600
+
+
+class TailStub(UpstashStub):
+    """Delays a share of requests by an extra tail_ms."""
+
+    def __init__(self, latency_ms: float, tail_share: float = 0.0, tail_ms: float = 0.0):
+        super().__init__(latency_ms)
+        self.tail_share = tail_share
+        self.tail = tail_ms / 1000
+
+    async def respond(self, method, path, headers, body):
+        if self.tail_share and random.random() < self.tail_share:
+            await asyncio.sleep(self.tail)
+        return await super().respond(method, path, headers, body)
+
+
+def _connect(url: str, hedge: bool):
+    redis = create_client("upstash", url, "stub")
+    redis._http = redis_client._GuardedHttp(redis._http, hedge=hedge)
+    redis_client._redis = redis
+    return redis
+
+
+async def _call(i: int):
+    await presence.join_room("bench", f"user-{i}", "Bench")
+    await presence.get_online_counts(["bench", "other"])
+    await leaderboard_cache.get_cached_leaderboard(10)
+
+
+async def _phase(label: str):
+    samples, opened_at = [], None
+    was_closed = redis_client.breaker.closed
+    for i in range(CALLS_PER_PHASE):
+        start = time.perf_counter()
+        await _call(i)
+        samples.append((time.perf_counter() - start) * 1000)
+        if was_closed and opened_at is None and not redis_client.breaker.closed:
+            opened_at = i + 1
+    state = redis_client.breaker.state
+    opened = f"opened after call {opened_at}" if opened_at else ""
+    print(
+        f"{label:<12} {statistics.median(samples):>9.1f} {max(samples):>9.1f} "
+        f"{sum(samples):>10.0f}   {state:<10} {opened}"
+    )
+
+
+async def degradation():
+    stub = UpstashStub(latency_ms=LATENCY_MS)
+    url = stub.start_in_thread()
+    _connect(url, hedge=False)
+    redis_client.breaker.cooldown = COOLDOWN
+
+    print(
+        f"{CALLS_PER_PHASE} calls per phase (join + counts + leaderboard), deadline "
+        f"{redis_client.REDIS_DEADLINE_MS:g} ms, stand-in {LATENCY_MS} ms -> {SLOW_SECONDS:g} s -> {LATENCY_MS} ms\n"
+    )
+    print(f"{'phase':<12} {'median ms':>9} {'max ms':>9} {'total ms':>10}   {'breaker':<10}")
+    await _phase("healthy")
+    stub.latency = SLOW_SECONDS
+    await _phase("slow")
+    await _phase("still slow")
+    stub.latency = LATENCY_MS / 1000
+    # Cooldown, then the probes
+    while not redis_client.breaker.closed:
+        await asyncio.sleep(0.1)
+    await _phase("recovered")
+    print(f"\nhealth: {redis_client.health()}")
+    await redis_client.close_redis()
+
+
+async def _read_latencies(redis) -> list[float]:
+    samples = []
+    for i in range(HEDGE_CALLS):
+        start = time.perf_counter()
+        await redis.hgetall("presence:bench")
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)
+
+
+async def hedging():
+    stub = TailStub(LATENCY_MS, TAIL_SHARE, TAIL_MS)
+    url = stub.start_in_thread()
+    print(f"\n{HEDGE_CALLS} HGETALLs, {TAIL_SHARE:.0%} of requests delayed {TAIL_MS} ms\n")
+    print(f"{'':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'requests':>9}")
+    for hedge in (False, True):
+        redis = _connect(url, hedge=hedge)
+        before = stub.requests
+        samples = await _read_latencies(redis)
+        p = lambda q: samples[int(len(samples) * q)]
+        label = "hedged" if hedge else "unhedged"
+        print(f"{label:<12} {p(0.5):>8.1f} {p(0.95):>8.1f} {p(0.99):>8.1f} {stub.requests - before:>9}")
+        await redis_client.close_redis()
+
+
+async def main():
+    await degradation()
+    await hedging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+"""
+Latency benchmark: sequential Redis calls vs one pipelined round-trip.
+
+Runs the presence, rate limiter and leaderboard call patterns against a local
+Upstash REST stand-in (benchmarks.upstash_stub) that adds a fixed delay per HTTP
+request. "sequential" replays the previous one-command-per-request code, "pipelined"
+calls the current services. The rate limiter now decides locally and syncs in the
+background, so its row shows the per-request cost of a decision.
+
+A second table compares one heartbeat interval's worth of writes for a worker:
+a pipeline per heartbeat vs the single batch services.presence_writer flushes.
+
+Run from backend/:
+    python -m benchmarks.bench_redis_pipeline [latency_ms]
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from upstash_redis.asyncio import Redis as AsyncRedis
+
+from benchmarks.upstash_stub import UpstashStub
+from services import leaderboard_cache, presence, rate_limiter, redis_client
+
+ITERATIONS = 30
+BATCH_USERS = (50, 500)
+ROOM_SIZE = 10
+TTL = presence.HEARTBEAT_TTL
+
+
+# --- Previous call patterns, one await per command ---
+
+async def join_sequential(redis, room_id, user_id, name):
+    await redis.hset(f"presence:{room_id}", user_id, name)
+    await redis.expire(f"presence:{room_id}", TTL)
+    await redis.sadd(f"user_rooms:{user_id}", room_id)
+    await redis.set(f"online:{user_id}", "1", ex=TTL)
+    users = await redis.hgetall(f"presence:{room_id}")
+    return list(users.keys())
+
+
+async def leave_sequential(redis, room_id, user_id):
+    await redis.hdel(f"presence:{room_id}", user_id)
+    await redis.srem(f"user_rooms:{user_id}", room_id)
+    if await redis.scard(f"user_rooms:{user_id}") == 0:
+        await redis.delete(f"online:{user_id}")
+    users = await redis.hgetall(f"presence:{room_id}")
+    return list(users.keys())
+
+
+async def heartbeat_sequential(redis, room_id, user_id):
+    await redis.expire(f"presence:{room_id}", TTL)
+    await redis.expire(f"online:{user_id}", TTL)
+
+
+# --- One pipeline per heartbeat, what each heartbeat wrote before presence_writer ---
+
+async def heartbeat_pipelined(room_id, user_id, name):
+    pipe = redis_client.pipeline()
+    pipe.zadd(presence.LAST_SEEN_KEY, {f"{room_id}|{user_id}": time.time()})
+    pipe.hset(f"presence:{room_id}", user_id, name)
+    pipe.sadd(f"user_rooms:{user_id}", room_id)
+    pipe.expire(f"presence:{room_id}", TTL)
+    pipe.expire(f"user_rooms:{user_id}", TTL)
+    pipe.expire(f"online:{user_id}", TTL)
+    await pipe.exec()
+
+
+async def rate_limit_sequential(redis, key, now, window):
+    await redis.zremrangebyscore(key, 0, now - window)
+    count = await redis.zcard(key)
+    await redis.zadd(key, {str(now): now})
+    await redis.expire(key, window)
+    return count
+
+
+async def leaderboard_read_sequential(redis, limit):
+    if not await redis.exists(leaderboard_cache.LEADERBOARD_KEY):
+        return None
+    ids = await redis.zrange(leaderboard_cache.LEADERBOARD_KEY, 0, limit - 1, rev=True)
+    rows = []
+    for uid in ids:
+        rows.append(await redis.hget(leaderboard_cache.LEADERBOARD_DATA_KEY, uid))
+    return rows
+
+
+async def _local_decision(result):
+    return result
+
+
+# --- Harness ---
+
+async def _time(fn) -> list[float]:
+    samples = []
+    for i in range(ITERATIONS):
+        start = time.perf_counter()
+        await fn(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _row(label: str, before: list[float], after: list[float], trips: tuple):
+    b, a = statistics.median(before), statistics.median(after)
+    speedup = f"{b / a:>8.1f}x" if a >= 0.1 else f"{'local':>9}"
+    print(f"{label:<20} {b:>10.1f} {a:>10.1f} {speedup} {trips[0]:>6} -> {trips[1]}")
+
+
+async def main(latency_ms: float):
+    stub = UpstashStub(latency_ms=latency_ms)
+    url = await stub.start()
+    redis = AsyncRedis(url=url, token="stub")
+    redis_client._redis = redis
+
+    # Seed a leaderboard of 50 users
+    await redis.zadd(leaderboard_cache.LEADERBOARD_KEY, {f"u{i}": i * 10 for i in range(50)})
+    await redis.hset(
+        leaderboard_cache.LEADERBOARD_DATA_KEY,
+        values={f"u{i}": json.dumps({"display_name": f"User {i}", "xp": i * 10}) for i in range(50)},
+    )
+
+    async def trips(fn) -> int:
+        before = stub.requests
+        await fn(0)
+        return stub.requests - before
+
+    cases = [
+        (
+            "join_room",
+            lambda i: join_sequential(redis, "bench", f"user-{i}", "Bench"),
+            lambda i: presence.join_room("bench", f"user-{i}", "Bench"),
+        ),
+        (
+            "leave_room",
+            lambda i: leave_sequential(redis, "bench", f"user-{i}"),
+            lambda i: presence.leave_room("bench", f"user-{i}"),
+        ),
+        (
+            "heartbeat",
+            lambda i: heartbeat_sequential(redis, "bench", f"user-{i}"),
+            lambda i: heartbeat_pipelined("bench", f"user-{i}", f"User {i}"),
+        ),
+        (
+            "rate_limit_check",
+            lambda i: rate_limit_sequential(redis, "rate:default:ip:bench", time.time(), 60),
+            lambda i: _local_decision(rate_limiter.limiter.check("default:ip:bench", 60, 60)),
+        ),
+        (
+            "leaderboard_top10",
+            lambda i: leaderboard_read_sequential(redis, 10),
+            lambda i: leaderboard_cache.get_cached_leaderboard(10),
+        ),
+    ]
+
+    print(f"Upstash stand-in with {latency_ms:g} ms per request, median of {ITERATIONS} calls (ms)\n")
+    print(f"{'operation':<20} {'sequential':>10} {'pipelined':>10} {'speedup':>9} {'round-trips':>12}")
+    for label, sequential, pipelined in cases:
+        before = await _time(sequential)
+        after = await _time(pipelined)
+        _row(label, before, after, (await trips(sequential), await trips(pipelined)))
+
+    print(f"\n{'heartbeats':<20} {'per-beat':>10} {'batched':>10} {'speedup':>9} {'round-trips':>12}")
+    for users in BATCH_USERS:
+        members = {(f"room-{i // ROOM_SIZE}", f"user-{i}"): f"User {i}" for i in range(users)}
+
+        start = time.perf_counter()
+        await asyncio.gather(*(heartbeat_pipelined(r, u, name) for (r, u), name in members.items()))
+        per_beat = (time.perf_counter() - start) * 1000
+
+        before = stub.requests
+        start = time.perf_counter()
+        commands = await presence.write_batch(members, {})
+        batched = (time.perf_counter() - start) * 1000
+        _row(f"{users} users", [per_beat], [batched], (users, stub.requests - before))
+        print(f"{'':<20} {'commands':>10} {commands:>10}  (per-beat: {users * 6})")
+
+    await redis.close()
+    await stub.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 20))
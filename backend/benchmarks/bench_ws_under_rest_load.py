@@ -0,0 +1,129 @@
+"""
+Benchmark: WebSocket round-trip latency while the REST API is under load.
+
+Serves the app with uvicorn against a local Supabase stand-in
+(benchmarks.supabase_stub). One WebSocket client sends get-peers and times each
+peers-list reply, while concurrent clients call GET /api/users/me on the same worker.
+
+Phases:
+- idle: no REST traffic
+- rest-load: REST load through the shared async Supabase clients (services.db)
+
+With the original synchronous calls made directly in the handlers, the same load
+pushed the get-peers p50 to ~2.9 s; it should stay near the idle numbers.
+
+Run from backend/:
+    python -m benchmarks.bench_ws_under_rest_load [supabase_latency_ms]
+"""
+
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+from benchmarks.supabase_stub import SupabaseStub, make_token
+
+PHASE_SECONDS = 3
+REST_CONCURRENCY = 32
+PING_INTERVAL = 0.02
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _pinger(url: str, stop: asyncio.Event) -> list[float]:
+    import websockets
+
+    samples = []
+    async with websockets.connect(url) as ws:
+        while not stop.is_set():
+            start = time.perf_counter()
+            await ws.send('{"type":"get-peers"}')
+            while True:
+                reply = await ws.recv()
+                if '"peers-list"' in reply:
+                    break
+            samples.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(PING_INTERVAL)
+    return samples
+
+
+async def _rest_load(base: str, stop: asyncio.Event) -> int:
+    import httpx
+
+    done = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal done
+        while not stop.is_set():
+            r = await client.get(f"{base}/api/users/me", headers={"Authorization": f"Bearer {make_token()}"})
+            r.raise_for_status()
+            done += 1
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(REST_CONCURRENCY)))
+    return done
+
+
+async def _phase(label: str, base: str, ws_url: str, load: bool):
+    stop = asyncio.Event()
+    pinger = asyncio.create_task(_pinger(ws_url, stop))
+    rest = asyncio.create_task(_rest_load(base, stop)) if load else None
+    await asyncio.sleep(PHASE_SECONDS)
+    stop.set()
+    samples = await pinger
+    requests = await rest if rest else 0
+
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(
+        f"{label:<10} {statistics.median(samples):>8.2f} {p99:>8.2f} {samples[-1]:>8.2f}"
+        f" {len(samples):>7} {requests / PHASE_SECONDS:>9.1f}"
+    )
+
+
+def main(latency_ms: float):
+    stub = SupabaseStub(latency_ms=latency_ms)
+    os.environ["VITE_SUPABASE_URL"] = stub.start_in_thread()
+    os.environ["VITE_SUPABASE_ANON_KEY"] = make_token("anon")
+    # Stub tokens are unsigned, so they are verified through the stub's /auth/v1/user
+    os.environ["SUPABASE_JWT_SECRET"] = ""
+    # get-peers is the probe; keep the inbound limiter out of the measurement
+    os.environ["WS_LIMIT_PRESENCE"] = "10000,10000,drop"
+
+    import uvicorn
+
+    import main as app_main
+    from services import db
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app_main.app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base = f"http://127.0.0.1:{port}"
+    ws_url = f"ws://127.0.0.1:{port}/ws/room/bench?user_id=probe&display_name=Probe&token={make_token('probe')}"
+
+    async def run():
+        print(
+            f"Supabase stand-in at {latency_ms:g} ms, {REST_CONCURRENCY} concurrent REST clients,"
+            f" {PHASE_SECONDS}s per phase\n"
+        )
+        print(f"{'phase':<10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'pings':>7} {'REST/s':>9}")
+        await _phase("idle", base, ws_url, load=False)
+        await _phase("rest-load", base, ws_url, load=True)
+        print(f"\nSupabase pool: {db.stats()}")
+
+    asyncio.run(run())
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 30)
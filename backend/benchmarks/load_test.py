@@ -0,0 +1,563 @@
+"""
+Load test: thousands of room WebSocket clients plus REST traffic against one app worker.
+
+Serves the app with uvicorn in a subprocess, pointed at local stand-ins for
+Supabase (benchmarks.supabase_stub) and Upstash (benchmarks.upstash_stub) that
+run on threads in this process. Clients spread over the rooms and follow a
+seeded mix modelled on the frontend hooks:
+- canvas: every room sees a drawing burst (60 segments at 60 Hz) every DRAW_GAP seconds
+- signaling: a joining client sends an offer and an ICE trickle to an earlier peer,
+  which answers with its own trickle
+- presence: a heartbeat every 30 s, typing-start/typing-stop every TYPING_GAP seconds
+- REST: closed-loop workers on the room directory, room detail, profiles, /me and
+  the leaderboard, with the clients' tokens
+Canvas segments carry their send time, so sampled receivers measure fan-out
+latency end to end (client -> server -> peers).
+
+Reports throughput, fan-out latency, server memory per connection (RSS from
+/proc), Redis commands per second (counted by the stand-in) and event-loop lag
+(from the server's /metrics). --save writes the results to load_baseline.json
+next to this file. Every run compares against that file when it exists, and
+repeats its configuration unless options override it. The committed baseline
+was recorded on a small machine; re-record it (--save) on the machine you
+compare on.
+
+Run from backend/:
+    python -m benchmarks.load_test [--clients 2000] [--rooms 200] [--duration 30] [--save]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import websockets
+
+from benchmarks.supabase_stub import SupabaseStub, make_token
+from benchmarks.upstash_stub import UpstashStub
+
+BASELINE = Path(__file__).with_name("load_baseline.json")
+BACKEND = Path(__file__).resolve().parent.parent
+
+HEARTBEAT_INTERVAL = 30.0  # seconds, as in usePresence.ts
+TYPING_GAP = 20.0  # mean seconds between one client's typing bursts
+DRAW_GAP = 5.0  # mean seconds between drawing bursts in one room
+DRAW_SEGMENTS = 60
+DRAW_HZ = 60
+ICE_CANDIDATES = 8
+SAMPLE_EVERY = 4  # every Nth client records fan-out latency
+CONNECT_CONCURRENCY = 50
+WARMUP = 2.0  # seconds between the last connect and the measured window
+REGRESSION_THRESHOLD = 0.10
+
+# Run size when there is no baseline to repeat
+DEFAULTS = {
+    "clients": 2000,
+    "rooms": 200,
+    "duration": 30.0,
+    "rest_concurrency": 16,
+    "redis_latency": 10.0,
+    "supabase_latency": 30.0,
+    "seed": 1,
+}
+
+REST_MIX = (
+    ("rooms", 4),
+    ("room", 2),
+    ("profile", 2),
+    ("me", 1),
+    ("leaderboard", 1),
+)
+
+# Result key -> True if a larger value is better
+HIGHER_IS_BETTER = {
+    "ws_connected": True,
+    "connect_p50_ms": False,
+    "connect_p99_ms": False,
+    "ws_sent_per_s": True,
+    "ws_received_per_s": True,
+    "fanout_p50_ms": False,
+    "fanout_p99_ms": False,
+    "rest_rps": True,
+    "rest_p50_ms": False,
+    "rest_p99_ms": False,
+    "rest_errors": False,
+    "server_rss_mb": False,
+    "rss_per_connection_kb": False,
+    "redis_ops_per_s": False,
+    "redis_round_trips_per_s": False,
+    "loop_lag_p99_ms": False,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pct(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def _rss_kb(pid: int) -> int | None:
+    """Resident set size of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _histogram_quantile(metrics_text: str, name: str, q: float) -> float | None:
+    """Upper bound of the bucket holding quantile q, from Prometheus text output."""
+    buckets = []
+    for line in metrics_text.splitlines():
+        if line.startswith(f"{name}_bucket{{"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets.append((float("inf") if le == "+Inf" else float(le), float(line.rsplit(" ", 1)[1])))
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    target = buckets[-1][1] * q
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return None
+
+
+class Stats:
+    """Counters for the measured window; everything before it is ignored."""
+
+    def __init__(self):
+        self.measuring = False
+        self.connect_ms: list[float] = []
+        self.connected = 0
+        self.failed = 0
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.received = 0
+        self.fanout_ms: list[float] = []
+        self.rest_ms: list[float] = []
+        self.rest_status: dict[int, int] = {}
+        self.client_lag_ms: list[float] = []
+
+
+async def _client_lag(stats: Stats, stop: asyncio.Event):
+    """Event-loop lag of this process: if it is high, the clients, not the server, are the bottleneck."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.1)
+        if stats.measuring:
+            stats.client_lag_ms.append(max(0.0, (time.perf_counter() - start - 0.1) * 1000))
+
+
+# --- WebSocket clients ---
+
+def _segment(rng: random.Random, x: float, y: float) -> tuple[dict, float, float]:
+    nx, ny = x + rng.uniform(-4, 4), y + rng.uniform(-4, 4)
+    draw = {
+        "x": round(nx, 1),
+        "y": round(ny, 1),
+        "prevX": round(x, 1),
+        "prevY": round(y, 1),
+        "color": "#a78bfa",
+        "size": 3,
+        "tool": "pen",
+        "t": time.time(),
+    }
+    return draw, nx, ny
+
+
+async def _send(ws, stats: Stats, message: dict):
+    await ws.send(json.dumps(message))
+    if stats.measuring:
+        stats.sent += 1
+
+
+async def _trickle(ws, stats: Stats, rng: random.Random, msg_type: str, target: str):
+    await _send(ws, stats, {"type": msg_type, "targetUserId": target, "sdp": {"type": msg_type[7:], "sdp": "v=0"}})
+    for i in range(ICE_CANDIDATES):
+        await asyncio.sleep(rng.uniform(0.005, 0.03))
+        candidate = {"candidate": f"candidate:{i} 1 udp 2122260223 10.0.0.{i} 5{i}000 typ host", "sdpMLineIndex": 0}
+        await _send(ws, stats, {"type": "webrtc-ice", "targetUserId": target, "candidate": candidate})
+
+
+async def _reader(ws, stats: Stats, rng: random.Random, record: bool, tasks: set):
+    async for frame in ws:
+        if '"webrtc-offer"' in frame:
+            offer = json.loads(frame)
+            task = asyncio.create_task(_trickle(ws, stats, rng, "webrtc-answer", offer["userId"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if not stats.measuring:
+            continue
+        stats.received += 1
+        if record and '"t":' in frame:
+            message = json.loads(frame)
+            now = time.time()
+            if message.get("type") == "canvas-draw":
+                stats.fanout_ms.append((now - message["drawData"]["t"]) * 1000)
+            elif message.get("type") == "canvas-batch":
+                for segment in message["segments"]:
+                    stats.fanout_ms.append((now - segment["drawData"]["t"]) * 1000)
+
+
+async def _heartbeats(ws, stats: Stats, rng: random.Random):
+    await asyncio.sleep(rng.uniform(0, HEARTBEAT_INTERVAL))
+    while True:
+        await _send(ws, stats, {"type": "heartbeat"})
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def _typing(ws, stats: Stats, rng: random.Random):
+    while True:
+        await asyncio.sleep(rng.expovariate(1 / TYPING_GAP))
+        await _send(ws, stats, {"type": "typing-start"})
+        await asyncio.sleep(rng.uniform(1, 4))
+        await _send(ws, stats, {"type": "typing-stop"})
+
+
+async def _drawing(ws, stats: Stats, rng: random.Random, room_size: int):
+    while True:
+        # Each member draws 1/room_size of the room's bursts
+        await asyncio.sleep(rng.expovariate(1 / (DRAW_GAP * room_size)))
+        x, y = rng.uniform(50, 750), rng.uniform(50, 550)
+        for _ in range(DRAW_SEGMENTS):
+            draw, x, y = _segment(rng, x, y)
+            await _send(ws, stats, {"type": "canvas-draw", "drawData": draw})
+            await asyncio.sleep(1 / DRAW_HZ)
+
+
+async def _client(
+    base_ws: str,
+    index: int,
+    room_id: str,
+    user_id: str,
+    earlier_peer: str | None,
+    room_size: int,
+    seed: int,
+    stats: Stats,
+    gate: asyncio.Semaphore,
+    started: asyncio.Event,
+    stop: asyncio.Event,
+):
+    rng = random.Random(seed * 1_000_003 + index)
+    url = f"{base_ws}/ws/room/{room_id}?user_id={user_id}&display_name=Load{index}&token={make_token(user_id)}"
+    async with gate:
+        start = time.perf_counter()
+        try:
+            ws = await websockets.connect(url, open_timeout=60, max_queue=None)
+        except Exception:
+            stats.failed += 1
+            return
+        stats.connect_ms.append((time.perf_counter() - start) * 1000)
+        stats.connected += 1
+
+    tasks: set[asyncio.Task] = set()
+    reader = asyncio.create_task(_reader(ws, stats, rng, index % SAMPLE_EVERY == 0, tasks))
+    # Everyone connects first, so connect times are not measured under load
+    await started.wait()
+    workers = [
+        reader,
+        asyncio.create_task(_heartbeats(ws, stats, rng)),
+        asyncio.create_task(_typing(ws, stats, rng)),
+        asyncio.create_task(_drawing(ws, stats, rng, room_size)),
+    ]
+    if earlier_peer:
+        workers.append(asyncio.create_task(_trickle(ws, stats, rng, "webrtc-offer", earlier_peer)))
+    try:
+        await stop.wait()
+    finally:
+        for task in workers + list(tasks):
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        try:
+            await asyncio.wait_for(ws.close(), 5)
+        except Exception:
+            pass
+
+
+# --- REST traffic ---
+
+async def _rest_worker(client: httpx.AsyncClient, base: str, tokens: list[str], seed: int, stats: Stats, stop: asyncio.Event):
+    rng = random.Random(seed)
+    routes, weights = zip(*REST_MIX)
+    while not stop.is_set():
+        route = rng.choices(routes, weights)[0]
+        headers = {"Authorization": f"Bearer {rng.choice(tokens)}"}
+        if route == "rooms":
+            path = "/api/rooms?limit=20"
+        elif route == "room":
+            path = f"/api/rooms/{rng.randrange(1 << 64):032x}"
+        elif route == "profile":
+            path = f"/api/users/{rng.randrange(1 << 64):032x}"
+        elif route == "me":
+            path = "/api/users/me"
+        else:
+            path = "/api/users/leaderboard/xp?limit=10"
+
+        start = time.perf_counter()
+        try:
+            status = (await client.get(f"{base}{path}", headers=headers)).status_code
+        except httpx.HTTPError:
+            status = 0
+        if stats.measuring:
+            stats.rest_ms.append((time.perf_counter() - start) * 1000)
+            stats.rest_status[status] = stats.rest_status.get(status, 0) + 1
+
+
+# --- Server ---
+
+def _start_server(port: int, env: dict, log) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def _wait_ready(base: str, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            try:
+                if (await client.get(f"{base}/api/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def run(args) -> dict:
+    supabase = SupabaseStub(latency_ms=args.supabase_latency)
+    upstash = UpstashStub(latency_ms=args.redis_latency)
+    env = {
+        **os.environ,
+        "VITE_SUPABASE_URL": supabase.start_in_thread(),
+        "VITE_SUPABASE_ANON_KEY": make_token("anon"),
+        # Stub tokens are unsigned, so they are verified through the stub's /auth/v1/user
+        "SUPABASE_JWT_SECRET": "",
+        "UPSTASH_REDIS_REST_URL": upstash.start_in_thread(),
+        "UPSTASH_REDIS_REST_TOKEN": "stub",
+        "METRICS_TOKEN": "load-test",
+        "PYTHONUNBUFFERED": "1",
+    }
+    port = _free_port()
+    base, base_ws = f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+
+    log = tempfile.NamedTemporaryFile("w", prefix="bondbox-load-", suffix=".log", delete=False)
+    server = _start_server(port, env, log)
+    stats = Stats()
+    started = asyncio.Event()
+    stop = asyncio.Event()
+    try:
+        await _wait_ready(base, server)
+        print(f"Server pid {server.pid}, log at {log.name}")
+        await asyncio.sleep(1)
+        rss_idle = _rss_kb(server.pid)
+
+        gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+        room_ids = [f"load-room-{r}" for r in range(args.rooms)]
+        members: dict[str, list[str]] = {room_id: [] for room_id in room_ids}
+        clients = []
+        for i in range(args.clients):
+            room_id = room_ids[i % args.rooms]
+            user_id = f"load-user-{i}"
+            room = members[room_id]
+            earlier = room[-1] if room else None
+            room.append(user_id)
+            size = (args.clients + args.rooms - 1 - (i % args.rooms)) // args.rooms
+            clients.append(
+                asyncio.create_task(
+                    _client(base_ws, i, room_id, user_id, earlier, size, args.seed, stats, gate, started, stop)
+                )
+            )
+
+        ramp_start = time.perf_counter()
+        while stats.connected + stats.failed < args.clients:
+            await asyncio.sleep(0.1)
+        ramp_s = time.perf_counter() - ramp_start
+        started.set()
+        print(f"Connected {stats.connected}/{args.clients} clients in {ramp_s:.1f}s ({stats.failed} failed)")
+
+        tokens = [make_token(f"load-user-{i}") for i in range(min(args.clients, 500))]
+        rest_client = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=args.rest_concurrency))
+        rest = [
+            asyncio.create_task(_rest_worker(rest_client, base, tokens, args.seed + w, stats, stop))
+            for w in range(args.rest_concurrency)
+        ]
+
+        lag_probe = asyncio.create_task(_client_lag(stats, stop))
+        await asyncio.sleep(WARMUP)
+        rss_loaded = _rss_kb(server.pid)
+        redis_commands, redis_requests = upstash.keyspace.commands, upstash.requests
+        stats.reset()
+        stats.measuring = True
+        window_start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stats.measuring = False
+        window = time.perf_counter() - window_start
+        redis_commands = upstash.keyspace.commands - redis_commands
+        redis_requests = upstash.requests - redis_requests
+
+        async with httpx.AsyncClient() as client:
+            metrics_text = (
+                await client.get(f"{base}/metrics", headers={"Authorization": "Bearer load-test"})
+            ).text
+
+        stop.set()
+        await asyncio.gather(lag_probe, *rest, return_exceptions=True)
+        await rest_client.aclose()
+        await asyncio.gather(*clients, return_exceptions=True)
+    finally:
+        stop.set()
+        server.terminate()
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+
+    lag = _histogram_quantile(metrics_text, "event_loop_lag_seconds", 0.99)
+    rest_errors = sum(n for status, n in stats.rest_status.items() if status == 0 or status >= 500)
+    per_conn = None
+    if rss_idle and rss_loaded and stats.connected:
+        per_conn = round((rss_loaded - rss_idle) / stats.connected, 1)
+    return {
+        "ws_connected": stats.connected,
+        "connect_p50_ms": round(_pct(stats.connect_ms, 0.5), 1),
+        "connect_p99_ms": round(_pct(stats.connect_ms, 0.99), 1),
+        "ws_sent_per_s": round(stats.sent / window, 1),
+        "ws_received_per_s": round(stats.received / window, 1),
+        "fanout_p50_ms": round(_pct(stats.fanout_ms, 0.5), 2),
+        "fanout_p99_ms": round(_pct(stats.fanout_ms, 0.99), 2),
+        "rest_rps": round(len(stats.rest_ms) / window, 1),
+        "rest_p50_ms": round(_pct(stats.rest_ms, 0.5), 1),
+        "rest_p99_ms": round(_pct(stats.rest_ms, 0.99), 1),
+        "rest_errors": rest_errors,
+        "rest_rate_limited": stats.rest_status.get(429, 0),
+        "server_rss_mb": round(rss_loaded / 1024, 1) if rss_loaded else None,
+        "rss_per_connection_kb": per_conn,
+        "redis_ops_per_s": round(redis_commands / window, 1),
+        "redis_round_trips_per_s": round(redis_requests / window, 1),
+        "loop_lag_p99_ms": round(lag * 1000, 1) if lag is not None and lag != float("inf") else None,
+        "fanout_samples": len(stats.fanout_ms),
+        "client_loop_lag_p99_ms": round(_pct(stats.client_lag_ms, 0.99), 1),
+    }
+
+
+# --- Baseline ---
+
+def _config(args) -> dict:
+    return {
+        "clients": args.clients,
+        "rooms": args.rooms,
+        "duration": args.duration,
+        "rest_concurrency": args.rest_concurrency,
+        "redis_latency": args.redis_latency,
+        "supabase_latency": args.supabase_latency,
+        "seed": args.seed,
+    }
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(baseline: dict, config: dict, results: dict) -> int:
+    """Print current vs baseline; returns how many metrics regressed past the threshold."""
+    if baseline.get("config") != config:
+        print(f"\n⚠️  Baseline was recorded with a different config: {baseline.get('config')}")
+    print(f"\nvs baseline {baseline.get('commit') or '?'} ({baseline.get('machine', '?')})")
+    print(f"{'metric':<26} {'baseline':>12} {'current':>12} {'change':>9}")
+    regressions = 0
+    for key, higher_is_better in HIGHER_IS_BETTER.items():
+        old, new = baseline["results"].get(key), results.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = change < -REGRESSION_THRESHOLD if higher_is_better else change > REGRESSION_THRESHOLD
+        # Small absolute latencies swing by more than the threshold between runs
+        if key.endswith("_ms") and abs(new - old) < 1:
+            worse = False
+        regressions += worse
+        flag = "  ⚠️ regression" if worse else ""
+        print(f"{key:<26} {old:>12} {new:>12} {change:>+8.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int)
+    parser.add_argument("--rooms", type=int)
+    parser.add_argument("--duration", type=float, help="measured seconds")
+    parser.add_argument("--rest-concurrency", type=int)
+    parser.add_argument("--redis-latency", type=float, help="ms per Upstash request")
+    parser.add_argument("--supabase-latency", type=float, help="ms per Supabase request")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--save", action="store_true", help=f"write the results to {BASELINE.name}")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    # Unset options repeat the baseline's run, so the comparison is like for like
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else None
+    defaults = {**DEFAULTS, **(baseline["config"] if baseline else {})}
+    for key, value in defaults.items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    config = _config(args)
+    print(f"Load test: {json.dumps(config)}")
+    results = asyncio.run(run(args))
+
+    print(f"\n{'metric':<26} {'value':>12}")
+    for key, value in results.items():
+        print(f"{key:<26} {value if value is not None else '-':>12}")
+
+    if results["client_loop_lag_p99_ms"] > 50:
+        print("\n⚠️  The load generator itself was lagging; run it on a separate machine or with fewer clients")
+
+    regressions = 0
+    if baseline:
+        regressions = _compare(baseline, config, results)
+    if args.save:
+        BASELINE.write_text(json.dumps({
+            "commit": _commit(),
+            "machine": f"{platform.machine()} {os.cpu_count()} CPU, Python {platform.python_version()}",
+            "config": config,
+            "results": results,
+        }, indent=2) + "\n")
+        print(f"\nSaved baseline to {BASELINE}")
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Local stand-in for a native Redis server, for benchmarks.
+
+Speaks RESP2 over TCP (what redis-py sends: arrays of bulk strings, MULTI/EXEC,
+CLIENT SETINFO on connect) against the in-process backend's keyspace
+(services.redis_backends.MemoryKeyspace). Everything a client has written by the
+time the server reads is answered after one fixed delay, so a pipeline costs one
+modelled round-trip, like a real server. Commands are parsed with hiredis when it
+is installed, so the stand-in's own parsing costs about what Upstash's JSON does.
+
+    server = RespStub(latency_ms=0.3)
+    url = server.start_in_thread()    # redis://127.0.0.1:<port>
+"""
+
+import asyncio
+
+try:
+    import hiredis
+except ImportError:  # pure-Python parsing below
+    hiredis = None
+
+from benchmarks.stub_server import StubServer
+from services.redis_backends import MemoryKeyspace
+
+
+def _parse(buf: bytearray, pos: int) -> tuple[list | None, int]:
+    """One command from buf at pos and where the next one starts, or (None, pos) if incomplete."""
+    start = pos
+    end = buf.find(b"\r\n", pos)
+    if end < 0:
+        return None, start
+    if buf[pos:pos + 1] != b"*":
+        raise ValueError("ERR inline commands are not supported")
+    args = []
+    pos = end + 2
+    for _ in range(int(buf[start + 1:end])):
+        end = buf.find(b"\r\n", pos)
+        if end < 0:
+            return None, start
+        size = int(buf[pos + 1:end])
+        pos = end + 2
+        if len(buf) < pos + size + 2:
+            return None, start
+        args.append(buf[pos:pos + size].decode())
+        pos += size + 2
+    return args, pos
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(_encode(v) for v in value)
+    raw = str(value).encode()
+    return f"${len(raw)}\r\n".encode() + raw + b"\r\n"
+
+
+class RespStub(StubServer):
+    """Answers RESP2 commands from a MemoryKeyspace. requests counts round-trips."""
+
+    def __init__(self, latency_ms: float = 0.3, keyspace: MemoryKeyspace | None = None):
+        super().__init__(latency_ms)
+        self.keyspace = keyspace or MemoryKeyspace()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        url = await super().start(host, port)
+        return url.replace("http://", "redis://", 1)
+
+    def _run(self, command: list):
+        if command[0].upper() in ("CLIENT", "SELECT"):
+            return "OK"
+        try:
+            return self.keyspace.execute(command)
+        except Exception as e:
+            return e
+
+    def _commands(self, parser, data: bytes) -> list[list]:
+        """Complete commands received so far; parser is a hiredis Reader or a byte buffer."""
+        if hiredis is not None:
+            parser.feed(data)
+            commands = []
+            while (command := parser.gets()) is not False:
+                commands.append(command)
+            return commands
+        parser += data
+        commands, pos = [], 0
+        while True:
+            command, pos = _parse(parser, pos)
+            if command is None:
+                break
+            commands.append(command)
+        del parser[:pos]
+        return commands
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        parser = hiredis.Reader(encoding="utf-8") if hiredis is not None else bytearray()
+        # Commands held back between MULTI and EXEC
+        queued: list | None = None
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                commands = self._commands(parser, data)
+                if not commands:
+                    continue
+
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                out = []
+                for command in commands:
+                    name = command[0].upper()
+                    if name == "MULTI":
+                        queued = []
+                        out.append(b"+OK\r\n")
+                    elif name == "EXEC" and queued is not None:
+                        out.append(_encode([self._run(c) for c in queued]))
+                        queued = None
+                    elif queued is not None:
+                        queued.append(command)
+                        out.append(b"+QUEUED\r\n")
+                    else:
+                        out.append(_encode(self._run(command)))
+                writer.write(b"".join(out))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
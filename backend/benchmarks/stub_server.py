@@ -0,0 +1,82 @@
+"""
+Minimal asyncio HTTP/1.1 server for the local service stand-ins used by benchmarks.
+Subclasses implement respond(); every request waits latency_ms first, to model the
+network round-trip to the real service.
+"""
+
+import asyncio
+import json
+import threading
+from http import HTTPStatus
+
+
+class StubServer:
+    """Keep-alive JSON HTTP server. Runs on the caller's loop, or on its own thread."""
+
+    def __init__(self, latency_ms: float = 20):
+        self.latency = latency_ms / 1000
+        self.requests = 0
+        self._server: asyncio.Server | None = None
+
+    async def respond(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, object]:
+        raise NotImplementedError
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        bound_port = self._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    def start_in_thread(self) -> str:
+        """
+        Serve from a background thread with its own event loop, so the server keeps
+        answering even while the benchmarked code blocks the main loop.
+        """
+        ready = threading.Event()
+        result = {}
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            result["url"] = loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return result["url"]
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                status, response = await self.respond(method, path, headers, body)
+
+                raw = json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: application/json\r\n".encode()
+                    + f"Content-Length: {len(raw)}\r\n\r\n".encode()
+                    + raw
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
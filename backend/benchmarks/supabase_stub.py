@@ -0,0 +1,92 @@
+"""
+Local stand-in for the Supabase REST (PostgREST) and Auth APIs, for benchmarks.
+
+Answers GET /auth/v1/user for any bearer token, and every /rest/v1/<table> request
+with canned rows, after the simulated round-trip delay. make_token() builds an
+unsigned JWT that supabase-py accepts for set_session().
+"""
+
+import base64
+import json
+import time
+import uuid
+
+from benchmarks.stub_server import StubServer
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+def make_token(user_id: str | None = None, ttl: int = 3600) -> str:
+    """A JWT with a distinct signature each call (so rate limiting sees distinct clients)."""
+    header = _b64({"alg": "HS256", "typ": "JWT"})
+    payload = _b64({
+        "sub": user_id or str(uuid.uuid4()),
+        "role": "authenticated",
+        "aud": "authenticated",
+        "exp": int(time.time()) + ttl,
+    })
+    signature = base64.urlsafe_b64encode(uuid.uuid4().bytes).rstrip(b"=").decode()
+    return f"{header}.{payload}.{signature}"
+
+
+def _claims(headers: dict) -> dict:
+    token = headers.get("authorization", "").removeprefix("Bearer ")
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return {}
+
+
+def _profile(user_id: str, xp: int = 1200) -> dict:
+    return {
+        "id": user_id,
+        "display_name": f"User {user_id[:6]}",
+        "avatar_url": "",
+        "bio": "",
+        "current_mood": "focused",
+        "xp": xp,
+        "teaching_xp": xp // 4,
+        "room_coins": xp // 10,
+        "subject_expertise": [],
+        "is_online": False,
+    }
+
+
+class SupabaseStub(StubServer):
+    """Canned Supabase responses: every token is a valid user, every table has rows."""
+
+    def __init__(self, latency_ms: float = 30, rows: int = 20):
+        super().__init__(latency_ms)
+        self.rows = rows
+
+    async def respond(self, method: str, path: str, headers: dict, body: bytes):
+        if path.startswith("/auth/v1/user"):
+            claims = _claims(headers)
+            if not claims.get("sub"):
+                return 401, {"msg": "invalid JWT"}
+            return 200, {
+                "id": claims["sub"],
+                "aud": "authenticated",
+                "role": "authenticated",
+                "email": f"{claims['sub'][:8]}@example.com",
+                "app_metadata": {},
+                "user_metadata": {},
+                "created_at": "2024-01-01T00:00:00Z",
+            }
+
+        if path.startswith("/rest/v1/"):
+            if method in ("POST", "PATCH"):
+                row = json.loads(body) if body else {}
+                row = row[0] if isinstance(row, list) and row else row
+                return 201, [{"id": str(uuid.uuid4()), **row}]
+            if method == "DELETE":
+                return 200, []
+            rows = [_profile(str(uuid.uuid4()), xp=10_000 - i * 100) for i in range(self.rows)]
+            if "vnd.pgrst.object" in headers.get("accept", ""):
+                return 200, rows[0]
+            return 200, rows
+
+        return 404, {"message": "not found"}
@@ -0,0 +1,58 @@
+"""
+Local stand-in for the Upstash Redis REST API, for benchmarks.
+
+Speaks the same HTTP protocol as Upstash (POST / for one command, POST /pipeline
+and POST /multi-exec for a batch, optional base64 result encoding) against an
+in-memory keyspace, and adds a fixed delay per request to model the network
+round-trip. The keyspace is the in-process Redis backend's
+(services.redis_backends.MemoryKeyspace), so only the commands BondBox uses exist.
+
+    server = UpstashStub(latency_ms=20)
+    url = await server.start()
+    redis = AsyncRedis(url=url, token="stub")
+"""
+
+import base64
+import json
+
+from benchmarks.stub_server import StubServer
+from services.redis_backends import MemoryKeyspace
+
+
+def _encode(result):
+    """Upstash base64 result encoding: every string except OK."""
+    if isinstance(result, str):
+        return result if result == "OK" else base64.b64encode(result.encode()).decode()
+    if isinstance(result, list):
+        return [_encode(r) for r in result]
+    return result
+
+
+class UpstashStub(StubServer):
+    """Answers Upstash REST requests from a MemoryKeyspace."""
+
+    def __init__(self, latency_ms: float = 20, keyspace: MemoryKeyspace | None = None):
+        super().__init__(latency_ms)
+        self.keyspace = keyspace or MemoryKeyspace()
+
+    def _run(self, command: list) -> dict:
+        try:
+            return {"result": self.keyspace.execute(command)}
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def respond(self, method: str, path: str, headers: dict, body: bytes):
+        payload = json.loads(body) if body else []
+        if path.rstrip("/") in ("/pipeline", "/multi-exec"):
+            response = [self._run(cmd) for cmd in payload]
+        else:
+            response = self._run(payload)
+
+        if headers.get("upstash-encoding") == "base64":
+            if isinstance(response, list):
+                for r in response:
+                    if "result" in r:
+                        r["result"] = _encode(r["result"])
+            elif "result" in response:
+                response["result"] = _encode(response["result"])
+        return 200, response
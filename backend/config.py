@@ -31,3 +31,139 @@ if not SUPABASE_URL:
     print("⚠️  SUPABASE_URL is not set. Check your .env file.")
 if not UPSTASH_REDIS_REST_URL:
     print("⚠️  UPSTASH_REDIS_REST_URL is not set. Check your .env file.")
+
+# WebSocket outbound queues (one bounded queue + writer task per connection)
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # seconds per frame
+# "drop_oldest": shed the oldest queued canvas frames first, disconnect if nothing can be shed
+# "disconnect": close the connection as soon as its queue is full
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+# JSON codec for WebSocket frames: "auto" picks orjson, then msgspec, then stdlib json
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+
+# Canvas draw coalescing: gather canvas-draw segments per room for this many
+# milliseconds and send them as one canvas-batch frame (0 disables batching)
+CANVAS_BATCH_TICK_MS = int(os.getenv("CANVAS_BATCH_TICK_MS", "0"))
+
+# Canvas snapshots for late joiners (per-worker, in memory)
+CANVAS_STATE_MAX_POINTS = int(os.getenv("CANVAS_STATE_MAX_POINTS", "10000"))  # per room
+CANVAS_STATE_MAX_ROOMS = int(os.getenv("CANVAS_STATE_MAX_ROOMS", "5000"))
+CANVAS_STATE_IDLE_TTL = int(os.getenv("CANVAS_STATE_IDLE_TTL", "1800"))  # seconds
+
+# Accept the compact binary canvas subprotocol (bondbox.bin.v1) when clients offer it
+WS_BINARY_PROTOCOL = os.getenv("WS_BINARY_PROTOCOL", "true").lower() == "true"
+
+# Cross-worker room fan-out: "none" (single worker), "memory" (in-process broker) or "redis"
+BACKPLANE = os.getenv("BACKPLANE", "none")
+BACKPLANE_FLUSH_MS = int(os.getenv("BACKPLANE_FLUSH_MS", "5"))
+# Native Redis (TCP) connection URL, used by the redis backplane and the resp Redis backend
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+# API rate limiting: decisions are made in-process (GCRA); usage is pushed to
+# Redis in batches this often so limits hold across workers
+RATE_LIMIT_SYNC_MS = int(os.getenv("RATE_LIMIT_SYNC_MS", "1000"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # tracked clients per worker
+
+# Per-connection inbound WebSocket budgets, as "rate_per_second,burst,action".
+# action: "drop" the excess, "coalesce" it into the latest pending message of its
+# type (sent when budget frees up), or "close" the connection with code 1008.
+# Signaling only accepts close (a lost offer/answer/ICE candidate silently breaks the
+# mesh); its burst covers a join into a full 15-member room: 14 peers x (offer or
+# answer + ~30 ICE candidates)
+WS_LIMIT_SIGNALING = os.getenv("WS_LIMIT_SIGNALING", "60,480,close")
+WS_LIMIT_CANVAS = os.getenv("WS_LIMIT_CANVAS", "120,240,coalesce")
+WS_LIMIT_PRESENCE = os.getenv("WS_LIMIT_PRESENCE", "2,10,coalesce")
+WS_LIMIT_DEFAULT = os.getenv("WS_LIMIT_DEFAULT", "10,20,drop")
+
+# Threads for synchronous Supabase calls (db.run_blocking), kept off the event loop.
+# Calls beyond this wait in line. supabase-py's sync client is CPU-heavy and holds
+# the GIL, so more threads mostly steal time from the loop
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "4"))
+
+# Shared Supabase HTTP pool (one per worker, reused by every request)
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))  # max open connections
+SUPABASE_POOL_KEEPALIVE = int(os.getenv("SUPABASE_POOL_KEEPALIVE", "10"))  # idle connections kept
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))  # seconds
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))  # seconds per request
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+
+# Auth: verify Supabase access tokens locally. HS256 projects need the JWT secret
+# (Dashboard > Settings > API); asymmetric signing keys are read from the project's
+# JWKS. Without either, tokens are checked with Supabase Auth (one round-trip each)
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+AUTH_JWKS_TTL = int(os.getenv("AUTH_JWKS_TTL", "600"))  # seconds
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))  # verified tokens kept
+# Require a valid token (?token=...) whose subject matches user_id to join a room socket
+WS_REQUIRE_AUTH = os.getenv("WS_REQUIRE_AUTH", "true").lower() == "true"
+
+# Leaderboard cache: how many top users each rebuild stores, and the most
+# /api/users/leaderboard/xp returns (larger limits are capped to it)
+LEADERBOARD_DEPTH = int(os.getenv("LEADERBOARD_DEPTH", "50"))
+# Per-worker in-memory copy of the leaderboard, in front of Redis (seconds)
+LEADERBOARD_L1_TTL = float(os.getenv("LEADERBOARD_L1_TTL", "5"))
+
+# Supabase Database Webhook (profiles INSERT/UPDATE/DELETE) that feeds XP changes to
+# the live rankings. Sent by Supabase in the X-Webhook-Secret header; unset disables it
+LEADERBOARD_WEBHOOK_SECRET = os.getenv("LEADERBOARD_WEBHOOK_SECRET", "")
+
+# Room directory (GET /api/rooms): page size and how long each worker caches pages.
+# Room create/join/leave invalidates the cache on every worker
+ROOM_DIRECTORY_PAGE_SIZE = int(os.getenv("ROOM_DIRECTORY_PAGE_SIZE", "20"))
+ROOM_DIRECTORY_MAX_PAGE_SIZE = int(os.getenv("ROOM_DIRECTORY_MAX_PAGE_SIZE", "100"))
+ROOM_DIRECTORY_TTL = float(os.getenv("ROOM_DIRECTORY_TTL", "30"))  # seconds
+
+# Response cache for read endpoints (ETag/304, invalidated by writes).
+# "auto" (and "redis") share entries and invalidations across workers through Redis
+# whenever a shared Redis is up (one round-trip per lookup), and fall back to a
+# per-worker cache otherwise; "memory" is always per worker, for single-worker runs
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "auto")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Per-route TTLs in seconds; 0 turns caching off for that route
+RESPONSE_CACHE_ROOM_TTL = float(os.getenv("RESPONSE_CACHE_ROOM_TTL", "30"))
+RESPONSE_CACHE_PROFILE_TTL = float(os.getenv("RESPONSE_CACHE_PROFILE_TTL", "10"))  # includes is_online
+
+# Presence sweeper: how often stale room members are evicted (seconds), and how
+# many are handled per Redis round-trip
+PRESENCE_SWEEP_INTERVAL = float(os.getenv("PRESENCE_SWEEP_INTERVAL", "15"))
+PRESENCE_SWEEP_BATCH = int(os.getenv("PRESENCE_SWEEP_BATCH", "500"))
+
+# Heartbeats and typing flags are written to Redis in one batch per worker every
+# PRESENCE_FLUSH_INTERVAL seconds. A repeated typing-start is re-broadcast at most
+# once per TYPING_DEBOUNCE seconds (keep it under the client's 4 s display timeout)
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1"))
+TYPING_DEBOUNCE = float(os.getenv("TYPING_DEBOUNCE", "2"))
+
+# GET /metrics (Prometheus text format), per worker. Scrapers send
+# "Authorization: Bearer <METRICS_TOKEN>"; without a token the endpoint is refused,
+# unless METRICS_OPEN=true (e.g. bound to an internal-only port)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_OPEN = os.getenv("METRICS_OPEN", "false").lower() == "true"
+# How often the event loop is probed for lag (seconds)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+# Redis backend behind presence, rate limiting and the leaderboard cache:
+# "upstash" (REST over HTTPS), "resp" (native Redis over TCP at REDIS_URL) or
+# "memory" (in-process, so only for a single worker or development).
+# Unset picks upstash if its credentials are set, then resp if REDIS_URL is, then memory
+# (with a startup warning; /api/health reports "shared": false for memory)
+REDIS_BACKEND = os.getenv("REDIS_BACKEND", "")
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "20"))  # resp: max connections per worker
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "5"))  # resp: seconds to connect, read, or wait for a connection
+
+# Redis deadlines and circuit breaker. A call that misses its deadline fails and the
+# caller falls back. The breaker opens when half of the last REDIS_BREAKER_WINDOW
+# calls failed or took over REDIS_BREAKER_SLOW_MS; while it is open Redis counts as
+# unavailable (features degrade as without Redis), and every REDIS_BREAKER_COOLDOWN
+# seconds REDIS_BREAKER_PROBES PINGs in a row decide whether it closes again
+REDIS_DEADLINE_MS = float(os.getenv("REDIS_DEADLINE_MS", "500"))  # single commands
+REDIS_BATCH_DEADLINE_MS = float(os.getenv("REDIS_BATCH_DEADLINE_MS", "1000"))  # pipelines and transactions
+REDIS_BREAKER_WINDOW = int(os.getenv("REDIS_BREAKER_WINDOW", "10"))
+REDIS_BREAKER_SLOW_MS = float(os.getenv("REDIS_BREAKER_SLOW_MS", "250"))
+REDIS_BREAKER_COOLDOWN = float(os.getenv("REDIS_BREAKER_COOLDOWN", "5"))  # seconds
+REDIS_BREAKER_PROBES = int(os.getenv("REDIS_BREAKER_PROBES", "3"))
+# Hedged reads: a read-only command or pipeline still unanswered after the recent p95
+# read latency (but at least REDIS_HEDGE_MIN_MS) is sent a second time; the first answer wins
+REDIS_HEDGE_READS = os.getenv("REDIS_HEDGE_READS", "true").lower() == "true"
+REDIS_HEDGE_MIN_MS = float(os.getenv("REDIS_HEDGE_MIN_MS", "2"))
@@ -4,18 +4,41 @@ Main application entry point with REST APIs, WebSocket signaling, and Redis inte
 """
 
 import asyncio
+import hmac
+import math
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
+from typing import Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-import json
+from fastapi.responses import PlainTextResponse
 
-from config import CORS_ORIGINS
+from config import (
+    CORS_ORIGINS,
+    EVENT_LOOP_LAG_INTERVAL,
+    METRICS_OPEN,
+    METRICS_TOKEN,
+    PRESENCE_SWEEP_INTERVAL,
+    WS_BINARY_PROTOCOL,
+    WS_REQUIRE_AUTH,
+)
 from routers import rooms, users
 from services.websocket_manager import manager
-from services.redis_client import init_redis, close_redis, is_redis_available
+from services import auth, binary_protocol, codec, db, inbound_limiter, metrics
+from services.auth import AuthUser
+from services.canvas_batcher import canvas_batcher
+from services.canvas_state import MAX_COLOR_LENGTH, canvas_state
+from services.backplane import create_backplane
+from services.redis_client import init_redis, close_redis
+from services import redis_client
 from services import presence as presence_service
+from services.presence_writer import presence_writer
+from services.ws_router import NUMBER, Schema, message_router, optional, required
 from services import leaderboard_cache
-from services.rate_limiter import RateLimitMiddleware
+from services.leaderboard import leaderboard
+from services.rate_limiter import RateLimitMiddleware, limiter as rate_limiter
+from services import response_cache
+from services.response_cache import ResponseCacheMiddleware
 
 
 # ========================================
@@ -25,23 +48,45 @@ from services.rate_limiter import RateLimitMiddleware
 async def lifespan(app: FastAPI):
     """Manage Redis connection and background tasks."""
     # Startup
-    await init_redis()
+    redis = await init_redis()
+
+    # Cross-worker fan-out
+    backplane = create_backplane()
+    if backplane:
+        await manager.attach_backplane(backplane)
 
     # Start background leaderboard refresh task
     refresh_task = None
-    if is_redis_available():
+    sweep_task = None
+    if redis is not None:
         refresh_task = asyncio.create_task(_leaderboard_refresh_loop())
+        sweep_task = asyncio.create_task(_presence_sweep_loop())
+
+    # Seed the live rankings in the background; webhook events apply meanwhile
+    rankings_task = asyncio.create_task(leaderboard.load())
+    lag_task = asyncio.create_task(_event_loop_lag_loop())
 
     yield
 
     # Shutdown
-    if refresh_task:
-        refresh_task.cancel()
-        try:
-            await refresh_task
-        except asyncio.CancelledError:
-            pass
+    for task in (refresh_task, sweep_task, lag_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    rankings_task.cancel()
+    try:
+        await rankings_task
+    except asyncio.CancelledError:
+        pass
+    if backplane:
+        await backplane.close()
+    await presence_writer.flush()
+    await rate_limiter.sync()
     await close_redis()
+    await db.close()
 
 
 async def _leaderboard_refresh_loop():
@@ -54,6 +99,75 @@ async def _leaderboard_refresh_loop():
         await asyncio.sleep(60)
 
 
+async def _presence_sweep_loop():
+    """Evict room members who stopped sending heartbeats, and tell their rooms."""
+    while True:
+        await asyncio.sleep(PRESENCE_SWEEP_INTERVAL)
+        try:
+            evicted = await presence_service.sweep()
+            for room_id, user_ids in evicted.items():
+                await manager.expire_peers(room_id, user_ids)
+        except Exception as e:
+            print(f"Presence sweep error: {e}")
+
+
+loop_lag = metrics.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke a timer (time it spent busy with other work)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+loop_lag_last = metrics.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+
+async def _event_loop_lag_loop():
+    """Sample event loop lag: how much later than requested a short sleep returns."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.perf_counter() - start - EVENT_LOOP_LAG_INTERVAL)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+# Keep this worker's canvas snapshots in step with strokes drawn on other workers
+manager.remote_listeners.append(canvas_state.apply_broadcast)
+
+
+async def _send_canvas(room_id: str, user_id: str):
+    """Send the local canvas snapshot, then ask other workers for an older, fuller log."""
+    snapshot = canvas_state.snapshot_frame(room_id)
+    if snapshot:
+        await manager.send_frame_to_user(room_id, user_id, "canvas-snapshot", snapshot)
+    if manager.backplane:
+        manager.backplane.publish(room_id, {
+            "kind": "canvas-request",
+            "target": user_id,
+            "since": canvas_state.started_at(room_id),
+        })
+
+
+async def _on_canvas_request(room_id: str, envelope: dict):
+    """Another worker's client needs the canvas: reply if our log began before theirs."""
+    since = envelope.get("since")
+    exported = canvas_state.export(room_id)
+    if exported and (since is None or exported["startedAt"] < since):
+        manager.backplane.publish(room_id, {"kind": "canvas-reply", "target": envelope.get("target"), **exported})
+
+
+async def _on_canvas_reply(room_id: str, envelope: dict):
+    """Adopt a fuller log from another worker and resend the snapshot to whoever asked."""
+    if not canvas_state.adopt(room_id, envelope.get("startedAt"), envelope.get("strokes")):
+        return
+    target = envelope.get("target")
+    snapshot = canvas_state.snapshot_frame(room_id)
+    if snapshot and target in manager.rooms.get(room_id, {}):
+        await manager.send_frame_to_user(room_id, target, "canvas-snapshot", snapshot)
+
+
+manager.envelope_handlers["canvas-request"] = _on_canvas_request
+manager.envelope_handlers["canvas-reply"] = _on_canvas_reply
+
+
 app = FastAPI(
     title="BondBox API",
     description="Backend for BondBox collaborative study platform",
@@ -61,6 +175,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Response cache for read endpoints (inside the rate limiter, so hits still count)
+app.add_middleware(ResponseCacheMiddleware)
+
 # Rate limiting middleware (must be added before CORS)
 app.add_middleware(RateLimitMiddleware)
 
@@ -73,20 +190,174 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# REST routers
-app.include_router(rooms.router)
-app.include_router(users.router)
+# REST routers (Supabase calls are timed per endpoint)
+app.include_router(rooms.router, dependencies=[Depends(db.track_endpoint)])
+app.include_router(users.router, dependencies=[Depends(db.track_endpoint)])
 
 
 @app.get("/api/health")
 async def health_check():
+    redis_health = redis_client.health()
     return {
-        "status": "ok",
+        # Degraded: Redis is configured but its breaker is not closed
+        "status": "degraded" if redis_health["backend"] and not redis_health["available"] else "ok",
         "service": "bondbox-api",
-        "redis": is_redis_available(),
+        # Only a Redis every worker shares counts; the in-process store is per worker
+        "redis": redis_health["shared"],
+        "redis_health": redis_health,
+        "supabase_pool": db.stats(),
+        "auth": auth.stats(),
+        "rankings": leaderboard.stats(),
+        "response_cache": response_cache.stats(),
+        "presence_writes": presence_writer.stats(),
+        "ws_queues": manager.queue_summary(),
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(authorization: Optional[str] = Header(None)):
+    """
+    This worker's metrics in the Prometheus text format. Each worker only reports
+    its own counters, so with several workers scrape each one (or aggregate them).
+    Requires METRICS_TOKEN, or METRICS_OPEN=true to serve it without one.
+    """
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    elif not METRICS_OPEN:
+        raise HTTPException(status_code=403, detail="Metrics disabled: set METRICS_TOKEN (or METRICS_OPEN=true)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# ========================================
+# WebSocket message handlers (see services/ws_router.py)
+# ========================================
+# --- WebRTC Signaling ---
+@message_router.route("webrtc-offer", "webrtc-answer", schema=Schema(targetUserId=str, sdp=dict))
+@message_router.route("webrtc-ice", schema=Schema(targetUserId=str, candidate=dict))
+async def _webrtc_signal(room_id: str, user_id: str, display_name: str, message: dict):
+    await manager.send_to_user(
+        room_id,
+        message["targetUserId"],
+        {
+            "type": message["type"],
+            "userId": user_id,
+            "displayName": display_name,
+            "sdp": message.get("sdp"),
+            "candidate": message.get("candidate"),
+        },
+    )
+
+
+# --- Screen Share Notifications ---
+@message_router.route("screen-share-start", "screen-share-stop")
+async def _screen_share(room_id: str, user_id: str, display_name: str, message: dict):
+    await manager.broadcast_to_room(
+        room_id,
+        {"type": message["type"], "userId": user_id},
+        exclude=user_id,
+    )
+
+
+# --- Canvas Events ---
+DRAW_SCHEMA = Schema(
+    drawData=Schema(
+        # JSON decoders accept 1e999 (and stdlib json NaN/Infinity); those cannot be drawn
+        x=required(*NUMBER, check=math.isfinite),
+        y=required(*NUMBER, check=math.isfinite),
+        prevX=required(*NUMBER, check=math.isfinite),
+        prevY=required(*NUMBER, check=math.isfinite),
+        color=optional(str, check=lambda color: len(color) <= MAX_COLOR_LENGTH),
+        size=optional(*NUMBER, check=math.isfinite),
+        tool=optional(str, check=binary_protocol.TOOLS.__contains__),
+    )
+)
+
+
+@message_router.route("canvas-draw", schema=DRAW_SCHEMA)
+async def _canvas_draw(room_id: str, user_id: str, display_name: str, message: dict):
+    if not canvas_state.record_draw(room_id, user_id, message["drawData"]):
+        # Not something peers could draw either
+        return
+    if canvas_batcher.enabled:
+        canvas_batcher.add(room_id, user_id, message["drawData"])
+    else:
+        await manager.broadcast_to_room(
+            room_id,
+            {
+                "type": "canvas-draw",
+                "userId": user_id,
+                "drawData": message["drawData"],
+            },
+            exclude=user_id,
+        )
+
+
+@message_router.route("canvas-clear")
+async def _canvas_clear(room_id: str, user_id: str, display_name: str, message: dict):
+    # Strokes buffered before the clear must reach peers first
+    await canvas_batcher.flush(room_id)
+    canvas_state.clear(room_id)
+    await manager.broadcast_to_room(
+        room_id,
+        {"type": "canvas-clear", "userId": user_id},
+        exclude=user_id,
+    )
+
+
+@message_router.route("canvas-sync")
+async def _canvas_sync(room_id: str, user_id: str, display_name: str, message: dict):
+    await _send_canvas(room_id, user_id)
+
+
+# --- Presence Heartbeat ---
+@message_router.route("heartbeat")
+async def _heartbeat(room_id: str, user_id: str, display_name: str, message: dict):
+    presence_writer.heartbeat(room_id, user_id, display_name)
+
+
+# --- Typing Indicators ---
+@message_router.route("typing-start")
+async def _typing_start(room_id: str, user_id: str, display_name: str, message: dict):
+    if presence_writer.typing(room_id, user_id, display_name, True):
+        await manager.broadcast_to_room(
+            room_id,
+            {
+                "type": "typing-start",
+                "userId": user_id,
+                "displayName": display_name,
+            },
+            exclude=user_id,
+        )
+
+
+@message_router.route("typing-stop")
+async def _typing_stop(room_id: str, user_id: str, display_name: str, message: dict):
+    if presence_writer.typing(room_id, user_id, display_name, False):
+        await manager.broadcast_to_room(
+            room_id,
+            {"type": "typing-stop", "userId": user_id},
+            exclude=user_id,
+        )
+
+
+# --- Get current peers (with display names) ---
+@message_router.route("presence-sync")
+async def _presence_sync(room_id: str, user_id: str, display_name: str, message: dict):
+    # The client saw a gap in presence-delta versions
+    manager.send_presence_snapshot(room_id, user_id)
+
+
+@message_router.route("get-peers")
+async def _get_peers(room_id: str, user_id: str, display_name: str, message: dict):
+    peers = manager.get_peers_with_names(room_id)
+    await manager.send_to_user(
+        room_id,
+        user_id,
+        {"type": "peers-list", "peers": peers},
+    )
+
+
 # ========================================
 # WebSocket endpoint for room signaling
 # ========================================
@@ -96,6 +367,8 @@ async def room_websocket(
     room_id: str,
     user_id: str = Query(...),
     display_name: str = Query("Anonymous"),
+    token: str | None = Query(None),
+    ws_user: AuthUser | None = Depends(auth.websocket_user),
 ):
     """
     WebSocket endpoint for a study room.
@@ -104,117 +377,81 @@ async def room_websocket(
     - Canvas drawing sync
     - Presence (join/leave/heartbeat)
     - Typing indicators
+
+    Clients offering the "bondbox.bin.v1" subprotocol exchange canvas frames in
+    the packed binary format; all other frames stay JSON text.
+
+    The Supabase access token goes in ?token= (browsers cannot set headers on
+    WebSockets) and must belong to user_id.
     """
-    await manager.connect(room_id, user_id, display_name, websocket)
+    if (WS_REQUIRE_AUTH or token) and (ws_user is None or ws_user.id != user_id):
+        await websocket.close(code=inbound_limiter.POLICY_CLOSE_CODE)
+        return
 
-    # Register presence in Redis
-    online_users = await presence_service.join_room(room_id, user_id, display_name)
-    await manager.broadcast_to_room(
-        room_id,
-        {"type": "presence-update", "online": online_users},
-    )
+    subprotocol = None
+    if WS_BINARY_PROTOCOL and binary_protocol.SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        subprotocol = binary_protocol.SUBPROTOCOL
+    inbound = binary_protocol.InboundDecoder()
+
+    async def release(message: dict):
+        # Coalesced messages are handled once the connection has budget again
+        try:
+            await message_router.dispatch(room_id, user_id, display_name, message)
+        except Exception as e:
+            print(f"Deferred message error for {user_id}: {e}")
+
+    limiter = inbound_limiter.InboundLimiter(release)
+
+    conn = await manager.connect(room_id, user_id, display_name, websocket, subprotocol=subprotocol)
+
+    # Late joiners get the current canvas in one frame (from another worker if it has more)
+    await _send_canvas(room_id, user_id)
+
+    # Register presence in Redis (for REST); room members get presence-delta from the roster
+    await presence_service.join_room(room_id, user_id, display_name)
 
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            msg_type = message.get("type", "")
-
-            # --- WebRTC Signaling ---
-            if msg_type in ("webrtc-offer", "webrtc-answer", "webrtc-ice"):
-                target_id = message.get("targetUserId")
-                if target_id:
-                    await manager.send_to_user(
-                        room_id,
-                        target_id,
-                        {
-                            "type": msg_type,
-                            "userId": user_id,
-                            "displayName": display_name,
-                            "sdp": message.get("sdp"),
-                            "candidate": message.get("candidate"),
-                        },
-                    )
-
-            # --- Screen Share Notifications ---
-            elif msg_type in ("screen-share-start", "screen-share-stop"):
-                await manager.broadcast_to_room(
-                    room_id,
-                    {"type": msg_type, "userId": user_id},
-                    exclude=user_id,
-                )
-
-            # --- Canvas Events ---
-            elif msg_type == "canvas-draw":
-                await manager.broadcast_to_room(
-                    room_id,
-                    {
-                        "type": "canvas-draw",
-                        "userId": user_id,
-                        "drawData": message.get("drawData"),
-                    },
-                    exclude=user_id,
-                )
-
-            elif msg_type == "canvas-clear":
-                await manager.broadcast_to_room(
-                    room_id,
-                    {"type": "canvas-clear", "userId": user_id},
-                    exclude=user_id,
-                )
-
-            # --- Presence Heartbeat ---
-            elif msg_type == "heartbeat":
-                await presence_service.heartbeat(room_id, user_id)
-
-            # --- Typing Indicators ---
-            elif msg_type == "typing-start":
-                # Set typing key in Redis with 3s TTL
-                if is_redis_available():
-                    from services.redis_client import get_redis
-                    redis = await get_redis()
-                    await redis.set(f"typing:{room_id}:{user_id}", display_name, ex=3)
-                await manager.broadcast_to_room(
-                    room_id,
-                    {
-                        "type": "typing-start",
-                        "userId": user_id,
-                        "displayName": display_name,
-                    },
-                    exclude=user_id,
-                )
-
-            elif msg_type == "typing-stop":
-                if is_redis_available():
-                    from services.redis_client import get_redis
-                    redis = await get_redis()
-                    await redis.delete(f"typing:{room_id}:{user_id}")
-                await manager.broadcast_to_room(
-                    room_id,
-                    {"type": "typing-stop", "userId": user_id},
-                    exclude=user_id,
-                )
-
-            # --- Get current peers (with display names) ---
-            elif msg_type == "get-peers":
-                peers = manager.get_peers_with_names(room_id)
-                await manager.send_to_user(
-                    room_id,
-                    user_id,
-                    {"type": "peers-list", "peers": peers},
-                )
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            if frame.get("bytes") is not None:
+                size = len(frame["bytes"])
+                # Intern-table updates spend canvas budget like the draws that use them
+                if binary_protocol.is_intern(frame["bytes"]) and not limiter.charge("canvas"):
+                    continue
+                message = inbound.decode(frame["bytes"])
+                if message is None:
+                    continue
+            else:
+                size = len(frame["text"])
+                message = codec.loads(frame["text"])
+                if not isinstance(message, dict):
+                    continue
+
+            verdict = limiter.admit(message)
+            if verdict == inbound_limiter.ALLOW:
+                await message_router.dispatch(room_id, user_id, display_name, message, size)
+            elif verdict == inbound_limiter.CLOSE:
+                print(f"⛔ Closing {user_id} in room {room_id}: inbound message flood")
+                try:
+                    await websocket.close(code=inbound_limiter.POLICY_CLOSE_CODE)
+                except RuntimeError:
+                    pass
+                raise WebSocketDisconnect(inbound_limiter.POLICY_CLOSE_CODE)
 
     except WebSocketDisconnect:
-        manager.disconnect(room_id, user_id)
-        await manager.notify_disconnect(room_id, user_id)
-        # Update Redis presence
-        online_users = await presence_service.leave_room(room_id, user_id)
-        await manager.broadcast_to_room(
-            room_id,
-            {"type": "presence-update", "online": online_users},
-        )
+        limiter.close()
+        # A socket replaced by a reconnect leaves the room (and presence) to its successor
+        if manager.disconnect(room_id, user_id, conn):
+            await manager.notify_disconnect(room_id, user_id)
+            # Update Redis presence
+            presence_writer.forget(room_id, user_id)
+            await presence_service.leave_room(room_id, user_id)
     except Exception as e:
-        manager.disconnect(room_id, user_id)
-        await manager.notify_disconnect(room_id, user_id)
-        await presence_service.leave_room(room_id, user_id)
+        limiter.close()
+        if manager.disconnect(room_id, user_id, conn):
+            await manager.notify_disconnect(room_id, user_id)
+            presence_writer.forget(room_id, user_id)
+            await presence_service.leave_room(room_id, user_id)
         print(f"WebSocket error for user {user_id} in room {room_id}: {e}")
@@ -2,26 +2,17 @@
 Room endpoints for BondBox.
 """
 
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header
 from pydantic import BaseModel
 from typing import Optional
-from supabase import create_client
-from config import SUPABASE_URL, SUPABASE_ANON_KEY
+from config import ROOM_DIRECTORY_MAX_PAGE_SIZE, ROOM_DIRECTORY_PAGE_SIZE
+from services import db, response_cache, room_directory
+from services.auth import AuthUser, require_user
 from services import presence as presence_service
 
 router = APIRouter(prefix="/api/rooms", tags=["rooms"])
 
 
-def get_supabase(authorization: str | None = None):
-    """Create a Supabase client, optionally with user's JWT for RLS."""
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization.split(" ")[1]
-        client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-        client.auth.set_session(token, token)
-        return client
-    return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-
-
 class CreateRoomRequest(BaseModel):
     name: str
     room_type: str = "doubt_solving"
@@ -39,28 +30,29 @@ class JoinRoomRequest(BaseModel):
 @router.get("/")
 async def list_rooms(
     room_type: Optional[str] = None,
+    subject: Optional[str] = None,
     is_active: bool = True,
+    limit: int = ROOM_DIRECTORY_PAGE_SIZE,
+    cursor: Optional[str] = None,
     authorization: Optional[str] = Header(None),
 ):
-    """List all study rooms, optionally filtered by type."""
-    supabase = get_supabase(authorization)
-    query = supabase.table("study_rooms").select(
-        "*, host:profiles!study_rooms_host_id_fkey(id, display_name, avatar_url), "
-        "member_count:room_members(count)"
-    ).eq("is_active", is_active)
-
-    if room_type:
-        query = query.eq("room_type", room_type)
-
-    result = query.order("created_at", desc=True).execute()
-    return {"rooms": result.data}
+    """
+    List study rooms, newest first, optionally filtered by type and subject.
+    Pass the returned next_cursor to get the following page.
+    """
+    supabase = await db.get_client(authorization)
+    limit = max(1, min(limit, ROOM_DIRECTORY_MAX_PAGE_SIZE))
+    try:
+        return await room_directory.get_page(supabase, room_type, subject, is_active, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/{room_id}")
 async def get_room(room_id: str, authorization: Optional[str] = Header(None)):
     """Get a single room with its members."""
-    supabase = get_supabase(authorization)
-    room = (
+    supabase = await db.get_client(authorization)
+    room = await db.execute(
         supabase.table("study_rooms")
         .select(
             "*, host:profiles!study_rooms_host_id_fkey(id, display_name, avatar_url), "
@@ -68,7 +60,6 @@ async def get_room(room_id: str, authorization: Optional[str] = Header(None)):
         )
         .eq("id", room_id)
         .single()
-        .execute()
     )
     return {"room": room.data}
 
@@ -89,15 +80,14 @@ async def get_room_presence(room_id: str):
 
 @router.post("/")
 async def create_room(
-    body: CreateRoomRequest, authorization: Optional[str] = Header(None)
+    body: CreateRoomRequest,
+    authorization: Optional[str] = Header(None),
+    user: AuthUser = Depends(require_user),
 ):
     """Create a new study room."""
-    supabase = get_supabase(authorization)
-    user = supabase.auth.get_user()
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    supabase = await db.get_client(authorization)
 
-    result = (
+    result = await db.execute(
         supabase.table("study_rooms")
         .insert(
             {
@@ -105,83 +95,91 @@ async def create_room(
                 "room_type": body.room_type,
                 "subject": body.subject,
                 "topic": body.topic,
-                "host_id": user.user.id,
+                "host_id": user.id,
                 "max_members": body.max_members,
                 "timer_duration": body.timer_duration,
                 "break_duration": body.break_duration,
             }
         )
-        .execute()
     )
 
     # Auto-join the host as a member
     room = result.data[0]
-    supabase.table("room_members").insert(
-        {"room_id": room["id"], "user_id": user.user.id, "role": "host"}
-    ).execute()
+    await db.execute(
+        supabase.table("room_members").insert(
+            {"room_id": room["id"], "user_id": user.id, "role": "host"}
+        )
+    )
+    await room_directory.invalidate()
 
     return {"room": room}
 
 
 @router.post("/{room_id}/join")
-async def join_room(room_id: str, authorization: Optional[str] = Header(None)):
+async def join_room(
+    room_id: str,
+    authorization: Optional[str] = Header(None),
+    user: AuthUser = Depends(require_user),
+):
     """Join an existing room."""
-    supabase = get_supabase(authorization)
-    user = supabase.auth.get_user()
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    supabase = await db.get_client(authorization)
 
-    result = (
+    result = await db.execute(
         supabase.table("room_members")
-        .insert({"room_id": room_id, "user_id": user.user.id, "role": "member"})
-        .execute()
+        .insert({"room_id": room_id, "user_id": user.id, "role": "member"})
     )
+    await room_directory.invalidate()
+    await response_cache.invalidate(f"room:{room_id}")
     return {"member": result.data[0] if result.data else None}
 
 
 @router.post("/join-by-code")
 async def join_by_code(
-    body: JoinRoomRequest, authorization: Optional[str] = Header(None)
+    body: JoinRoomRequest,
+    authorization: Optional[str] = Header(None),
+    user: AuthUser = Depends(require_user),
 ):
     """Join a room using its invite code."""
-    supabase = get_supabase(authorization)
-    user = supabase.auth.get_user()
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    supabase = await db.get_client(authorization)
 
     # Find the room by code
-    room = (
+    room = await db.execute(
         supabase.table("study_rooms")
         .select("*")
         .eq("room_code", body.room_code.upper())
         .eq("is_active", True)
         .single()
-        .execute()
     )
 
     if not room.data:
         raise HTTPException(status_code=404, detail="Room not found")
 
     # Join it
-    result = (
+    result = await db.execute(
         supabase.table("room_members")
         .insert(
-            {"room_id": room.data["id"], "user_id": user.user.id, "role": "member"}
+            {"room_id": room.data["id"], "user_id": user.id, "role": "member"}
         )
-        .execute()
     )
+    await room_directory.invalidate()
+    await response_cache.invalidate(f"room:{room.data['id']}")
     return {"room": room.data, "member": result.data[0] if result.data else None}
 
 
 @router.post("/{room_id}/leave")
-async def leave_room(room_id: str, authorization: Optional[str] = Header(None)):
+async def leave_room(
+    room_id: str,
+    authorization: Optional[str] = Header(None),
+    user: AuthUser = Depends(require_user),
+):
     """Leave a room."""
-    supabase = get_supabase(authorization)
-    user = supabase.auth.get_user()
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    supabase.table("room_members").delete().eq("room_id", room_id).eq(
-        "user_id", user.user.id
-    ).execute()
+    supabase = await db.get_client(authorization)
+
+    await db.execute(
+        supabase.table("room_members").delete().eq("room_id", room_id).eq(
+            "user_id", user.id
+        )
+    )
+    await room_directory.invalidate()
+    await response_cache.invalidate(f"room:{room_id}")
     return {"success": True}
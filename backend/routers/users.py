@@ -2,24 +2,26 @@
 User/Profile endpoints for BondBox.
 """
 
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from pydantic import BaseModel
 from typing import Optional, List
-from supabase import create_client
-from config import SUPABASE_URL, SUPABASE_ANON_KEY
-from services import leaderboard_cache
+import hmac
+from config import LEADERBOARD_WEBHOOK_SECRET
+from services import db
+from services.auth import AuthUser, require_user
+from services import leaderboard_cache, response_cache
+from services.leaderboard import RankingsUnavailable, leaderboard
 from services import presence as presence_service
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 
-def get_supabase(authorization: str | None = None):
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization.split(" ")[1]
-        client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-        client.auth.set_session(token, token)
-        return client
-    return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+class ProfileChangeEvent(BaseModel):
+    """Supabase Database Webhook payload for the profiles table."""
+    type: str
+    table: str
+    record: Optional[dict] = None
+    old_record: Optional[dict] = None
 
 
 class UpdateProfileRequest(BaseModel):
@@ -33,56 +35,53 @@ class UpdateProfileRequest(BaseModel):
 
 
 @router.get("/me")
-async def get_my_profile(authorization: Optional[str] = Header(None)):
+async def get_my_profile(
+    authorization: Optional[str] = Header(None),
+    user: AuthUser = Depends(require_user),
+):
     """Get the authenticated user's profile."""
-    supabase = get_supabase(authorization)
-    user = supabase.auth.get_user()
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    supabase = await db.get_client(authorization)
 
-    result = (
+    result = await db.execute(
         supabase.table("profiles")
         .select("*")
-        .eq("id", user.user.id)
+        .eq("id", user.id)
         .single()
-        .execute()
     )
     return {"profile": result.data}
 
 
 @router.put("/me")
 async def update_my_profile(
-    body: UpdateProfileRequest, authorization: Optional[str] = Header(None)
+    body: UpdateProfileRequest,
+    authorization: Optional[str] = Header(None),
+    user: AuthUser = Depends(require_user),
 ):
     """Update the authenticated user's profile."""
-    supabase = get_supabase(authorization)
-    user = supabase.auth.get_user()
-    if not user or not user.user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    supabase = await db.get_client(authorization)
 
     updates = body.model_dump(exclude_none=True)
     if not updates:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    result = (
+    result = await db.execute(
         supabase.table("profiles")
         .update(updates)
-        .eq("id", user.user.id)
-        .execute()
+        .eq("id", user.id)
     )
+    await response_cache.invalidate(f"user:{user.id}")
     return {"profile": result.data[0] if result.data else None}
 
 
 @router.get("/{user_id}")
 async def get_profile(user_id: str, authorization: Optional[str] = Header(None)):
     """Get a user's public profile."""
-    supabase = get_supabase(authorization)
-    result = (
+    supabase = await db.get_client(authorization)
+    result = await db.execute(
         supabase.table("profiles")
         .select("id, display_name, avatar_url, bio, current_mood, xp, teaching_xp, room_coins, subject_expertise, is_online")
         .eq("id", user_id)
         .single()
-        .execute()
     )
 
     # Enrich with live online status from Redis
@@ -96,21 +95,51 @@ async def get_profile(user_id: str, authorization: Optional[str] = Header(None))
 
 @router.get("/leaderboard/xp")
 async def get_leaderboard(
-    limit: int = 10, authorization: Optional[str] = Header(None)
+    limit: int = Query(10, ge=1), authorization: Optional[str] = Header(None)
 ):
-    """Get top users by XP. Served from Redis cache when available."""
-    # Try Redis cache first
-    cached = await leaderboard_cache.get_cached_leaderboard(limit)
-    if cached:
-        return {"leaderboard": cached, "source": "cache"}
-
-    # Fall back to Supabase
-    supabase = get_supabase(authorization)
-    result = (
-        supabase.table("profiles")
-        .select("id, display_name, avatar_url, xp, teaching_xp, room_coins")
-        .order("xp", desc=True)
-        .limit(limit)
-        .execute()
-    )
-    return {"leaderboard": result.data, "source": "database"}
+    """Get top users by XP (at most LEADERBOARD_DEPTH). Served from memory or Redis when cached."""
+    leaderboard, source = await leaderboard_cache.get_leaderboard(limit, authorization)
+    return {"leaderboard": leaderboard, "source": source}
+
+
+@router.get("/leaderboard/xp/{user_id}")
+async def get_leaderboard_rank(user_id: str, radius: int = 5):
+    """A user's rank and the users ranked around them."""
+    try:
+        rank = await leaderboard.rank(user_id)
+        if rank is None:
+            raise HTTPException(status_code=404, detail="User not ranked")
+        neighbors = await leaderboard.neighbors(user_id, max(0, min(radius, 50)))
+    except RankingsUnavailable:
+        raise HTTPException(status_code=503, detail="Rankings temporarily unavailable")
+    return {"rank": rank, "neighbors": neighbors}
+
+
+@router.post("/xp-events")
+async def profile_xp_event(
+    event: ProfileChangeEvent, x_webhook_secret: Optional[str] = Header(None)
+):
+    """Apply a profile change from the Supabase webhook to the live rankings and caches."""
+    if not LEADERBOARD_WEBHOOK_SECRET or not hmac.compare_digest(
+        x_webhook_secret or "", LEADERBOARD_WEBHOOK_SECRET
+    ):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    if event.type == "DELETE":
+        if event.old_record:
+            await leaderboard.remove(event.old_record["id"])
+            await response_cache.invalidate(f"user:{event.old_record['id']}")
+        return {"success": True}
+
+    record = event.record or {}
+    if not record.get("id"):
+        return {"success": True}
+    await response_cache.invalidate(f"user:{record['id']}")
+
+    old_xp = (event.old_record or {}).get("xp")
+    new_xp = record.get("xp") or 0
+    if new_xp != old_xp:
+        # Absolute XP, not the delta: webhook retries stay idempotent
+        await leaderboard.set_xp(record["id"], new_xp)
+        await leaderboard_cache.invalidate_user_xp(record["id"], new_xp)
+    return {"success": True}
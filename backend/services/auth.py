@@ -0,0 +1,191 @@
+"""
+Authentication for REST endpoints and room WebSockets.
+
+Supabase access tokens are JWTs, so the caller can usually be identified without
+asking Supabase Auth: HS256 tokens are checked against the project's JWT secret,
+asymmetric ones against the project's JWKS (fetched, then cached for AUTH_JWKS_TTL).
+Signature, expiry and audience are all verified. Only when neither key is available
+does a token go to Supabase Auth (get_user). Verified tokens are kept in a bounded
+LRU until they expire, so repeat requests cost a dict lookup.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+import jwt
+from fastapi import Header, HTTPException, Query
+
+from config import (
+    AUTH_JWKS_TTL,
+    AUTH_TOKEN_CACHE_SIZE,
+    SUPABASE_ANON_KEY,
+    SUPABASE_JWT_AUDIENCE,
+    SUPABASE_JWT_SECRET,
+    SUPABASE_URL,
+)
+from services import db, metrics
+
+# Remote-verified tokens without a readable exp are trusted for this long
+_REMOTE_CACHE_SECONDS = 60
+# An unknown kid refetches the JWKS (key rotation), but not more often than this
+_JWKS_MIN_REFETCH = 30
+
+verifications = metrics.counter(
+    "auth_token_verifications_total",
+    "Access token checks by how they were answered",
+    ("method", "result"),
+)
+
+
+class AuthUser:
+    """The caller behind a verified access token."""
+
+    __slots__ = ("id", "email", "role", "expires_at")
+
+    def __init__(self, id: str, email: str | None, role: str | None, expires_at: float):
+        self.id = id
+        self.email = email
+        self.role = role
+        self.expires_at = expires_at
+
+
+# token -> AuthUser, least recently used first
+_cache: OrderedDict[str, AuthUser] = OrderedDict()
+# kid -> signing key from the project's JWKS
+_jwks: dict[str, jwt.PyJWK] = {}
+_jwks_fetched_at = 0.0
+
+
+async def _refresh_jwks():
+    global _jwks, _jwks_fetched_at
+    _jwks_fetched_at = time.monotonic()
+    async with httpx.AsyncClient(timeout=5) as client:
+        response = await client.get(
+            f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json",
+            headers={"apikey": SUPABASE_ANON_KEY},
+        )
+        response.raise_for_status()
+    keys = {}
+    for data in response.json().get("keys", []):
+        try:
+            key = jwt.PyJWK(data)
+        except jwt.PyJWKError:
+            continue
+        keys[data.get("kid", "")] = key
+    _jwks = keys
+
+
+async def _signing_key(kid: str | None) -> jwt.PyJWK | None:
+    """JWKS key for a kid, refetching the set when it is stale or the kid is new."""
+    key = _jwks.get(kid or "")
+    age = time.monotonic() - _jwks_fetched_at
+    if age > AUTH_JWKS_TTL or (key is None and age > _JWKS_MIN_REFETCH):
+        try:
+            await _refresh_jwks()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"JWKS fetch error: {e}")
+        key = _jwks.get(kid or "")
+    return key
+
+
+async def _verify_locally(token: str) -> dict | None:
+    """
+    Verified claims, or None if this worker has no key for the token's algorithm.
+    Raises jwt.InvalidTokenError for bad signatures, expired tokens or the wrong audience.
+    """
+    header = jwt.get_unverified_header(token)
+    options = {"require": ["exp", "sub"]}
+    if header.get("alg") == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            return None
+        return jwt.decode(
+            token, SUPABASE_JWT_SECRET, algorithms=["HS256"],
+            audience=SUPABASE_JWT_AUDIENCE, options=options,
+        )
+
+    if not jwt.algorithms.has_crypto:
+        return None
+    key = await _signing_key(header.get("kid"))
+    if key is None:
+        return None
+    return jwt.decode(
+        token, key.key, algorithms=[key.algorithm_name],
+        audience=SUPABASE_JWT_AUDIENCE, options=options,
+    )
+
+
+async def _verify_remotely(token: str) -> AuthUser | None:
+    """Ask Supabase Auth who the token belongs to."""
+    try:
+        response = await db.SupabaseClient(token).get_user()
+    except Exception:
+        return None
+    if not response or not response.user:
+        return None
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        exp = None
+    user = response.user
+    expires_at = float(exp) if exp else time.time() + _REMOTE_CACHE_SECONDS
+    return AuthUser(user.id, user.email, user.role, expires_at)
+
+
+async def verify_token(token: str) -> AuthUser | None:
+    """The user a Supabase access token belongs to, or None if it is not valid."""
+    now = time.time()
+    user = _cache.get(token)
+    if user is not None:
+        if user.expires_at > now:
+            _cache.move_to_end(token)
+            verifications.labels("cache", "ok").inc()
+            return user
+        del _cache[token]
+
+    try:
+        claims = await _verify_locally(token)
+    except jwt.InvalidTokenError:
+        verifications.labels("local", "invalid").inc()
+        return None
+
+    if claims is not None:
+        method = "local"
+        user = AuthUser(claims["sub"], claims.get("email"), claims.get("role"), float(claims["exp"]))
+    else:
+        method = "remote"
+        user = await _verify_remotely(token)
+        if user is None:
+            verifications.labels(method, "invalid").inc()
+            return None
+
+    verifications.labels(method, "ok").inc()
+    _cache[token] = user
+    if len(_cache) > AUTH_TOKEN_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return user
+
+
+def _bearer(authorization: str | None) -> str | None:
+    if authorization and authorization.startswith("Bearer "):
+        return authorization.split(" ")[1]
+    return None
+
+
+async def require_user(authorization: Optional[str] = Header(None)) -> AuthUser:
+    """FastAPI dependency: the authenticated caller, or 401."""
+    token = _bearer(authorization)
+    user = await verify_token(token) if token else None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
+
+
+async def websocket_user(token: Optional[str] = Query(None)) -> AuthUser | None:
+    """FastAPI dependency for WebSockets (browsers cannot set headers): ?token=<access token>."""
+    return await verify_token(token) if token else None
+
+
+def stats() -> dict:
+    return {"cached_tokens": len(_cache), "jwks_keys": len(_jwks)}
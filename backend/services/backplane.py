@@ -0,0 +1,274 @@
+"""
+Cross-worker pub/sub backplane for room fan-out.
+
+ConnectionManager only knows the sockets connected to its own process. A backplane
+carries room traffic between workers: every broadcast, every send_to_user whose
+target lives elsewhere, and roster changes (join/leave) so peer lists span workers.
+
+Outbound envelopes are buffered per room and flushed together every
+BACKPLANE_FLUSH_MS, one publish per room per flush. Each worker subscribes to a
+room's channel only while it has at least one local connection in that room.
+subscribe() returns once the subscription is in place, so replies to whatever is
+published next (e.g. a roster request) are not missed; subscribe and unsubscribe
+calls for a room run one after another, in the order they were made.
+
+Implementations:
+- InProcessBackplane: workers attached to the same LocalBroker (tests, benchmarks, dev)
+- RedisBackplane: Redis pub/sub over TCP (REDIS_URL), for multiple uvicorn workers or pods
+"""
+
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict
+
+from config import BACKPLANE, BACKPLANE_FLUSH_MS, REDIS_URL
+from services import codec
+
+CHANNEL_PREFIX = "bondbox:room:"
+
+# (room_id, envelope) -> None
+DeliverFn = Callable[[str, dict], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """Base class: subscription bookkeeping and batched outbound publishes."""
+
+    def __init__(self, flush_ms: int = BACKPLANE_FLUSH_MS):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.flush_interval = flush_ms / 1000
+        self.rooms: set[str] = set()
+        self.deliver: DeliverFn | None = None
+
+        self._outbox: Dict[str, list[dict]] = {}
+        # room_id -> latest subscribe/unsubscribe still running; the next one waits for it
+        self._room_ops: Dict[str, asyncio.Task] = {}
+        self._flush_handle: asyncio.Handle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+        # Stats
+        self.published_envelopes = 0
+        self.published_batches = 0
+        self.received_envelopes = 0
+
+    async def start(self, deliver: DeliverFn):
+        self.deliver = deliver
+
+    async def close(self):
+        await self.flush()
+
+    # --- Subscriptions ---
+
+    async def subscribe(self, room_id: str):
+        """Start receiving a room's traffic (first local connection joined); returns once it is live."""
+        if room_id not in self.rooms:
+            self.rooms.add(room_id)
+            self._room_op(room_id, self._subscribe)
+        task = self._room_ops.get(room_id)
+        if task is not None:
+            # Shielded so a caller that goes away does not cancel the subscription
+            await asyncio.shield(task)
+
+    def unsubscribe(self, room_id: str):
+        """Stop receiving a room's traffic (last local connection left)."""
+        if room_id in self.rooms:
+            self.rooms.discard(room_id)
+            self._room_op(room_id, self._unsubscribe)
+
+    def _room_op(self, room_id: str, op: Callable[[str], Awaitable[None]]):
+        """Run a subscribe or unsubscribe once the room's previous one has finished."""
+        previous = self._room_ops.get(room_id)
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await op(room_id)
+            except Exception as e:
+                print(f"Backplane subscription error in room {room_id}: {e}")
+
+        def done(task: asyncio.Task):
+            self._tasks.discard(task)
+            if self._room_ops.get(room_id) is task:
+                del self._room_ops[room_id]
+
+        task = self._room_ops[room_id] = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(done)
+
+    @abstractmethod
+    async def _subscribe(self, room_id: str):
+        """Start delivering the room's channel to _receive."""
+
+    @abstractmethod
+    async def _unsubscribe(self, room_id: str):
+        """Stop delivering the room's channel."""
+
+    # --- Publishing ---
+
+    def publish(self, room_id: str, envelope: dict):
+        """Queue an envelope for other workers; sent with the next flush."""
+        envelope["origin"] = self.worker_id
+        self._outbox.setdefault(room_id, []).append(envelope)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._flush_due)
+
+    def _flush_due(self):
+        self._flush_handle = None
+        self._spawn(self.flush())
+
+    async def flush(self):
+        """Publish everything queued, one message per room."""
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._outbox:
+            return
+        batches, self._outbox = self._outbox, {}
+        self.published_batches += len(batches)
+        self.published_envelopes += sum(len(envs) for envs in batches.values())
+        try:
+            await self._send(batches)
+        except Exception as e:
+            print(f"Backplane publish error: {e}")
+
+    @abstractmethod
+    async def _send(self, batches: Dict[str, list[dict]]):
+        """Publish room_id -> envelopes, one message per room."""
+
+    # --- Receiving ---
+
+    async def _receive(self, room_id: str, envelopes: list[dict]):
+        """Hand other workers' envelopes for a subscribed room to the local manager."""
+        if room_id not in self.rooms or self.deliver is None:
+            return
+        for envelope in envelopes:
+            if envelope.get("origin") == self.worker_id:
+                continue
+            self.received_envelopes += 1
+            try:
+                await self.deliver(room_id, envelope)
+            except Exception as e:
+                print(f"Backplane delivery error in room {room_id}: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "subscribed_rooms": len(self.rooms),
+            "published_envelopes": self.published_envelopes,
+            "published_batches": self.published_batches,
+            "received_envelopes": self.received_envelopes,
+        }
+
+
+class LocalBroker:
+    """In-process stand-in for a pub/sub server. Each attached backplane acts as one worker."""
+
+    def __init__(self):
+        self.subscribers: Dict[str, set["InProcessBackplane"]] = {}
+        self.messages = 0
+
+    async def publish(self, room_id: str, payload: str):
+        self.messages += 1
+        for backplane in list(self.subscribers.get(room_id, ())):
+            # Decode per subscriber, as separate processes would
+            await backplane._receive(room_id, codec.loads(payload))
+
+
+class InProcessBackplane(Backplane):
+    """Backplane over a LocalBroker shared by several managers in one process."""
+
+    def __init__(self, broker: LocalBroker, flush_ms: int = BACKPLANE_FLUSH_MS):
+        super().__init__(flush_ms)
+        self.broker = broker
+
+    async def _subscribe(self, room_id: str):
+        self.broker.subscribers.setdefault(room_id, set()).add(self)
+
+    async def _unsubscribe(self, room_id: str):
+        subscribers = self.broker.subscribers.get(room_id)
+        if subscribers:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.broker.subscribers[room_id]
+
+    async def _send(self, batches: Dict[str, list[dict]]):
+        for room_id, envelopes in batches.items():
+            await self.broker.publish(room_id, codec.dumps(envelopes))
+
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis pub/sub, one channel per room."""
+
+    def __init__(self, url: str, flush_ms: int = BACKPLANE_FLUSH_MS):
+        super().__init__(flush_ms)
+        self.url = url
+        self._client = None
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+
+    async def start(self, deliver: DeliverFn):
+        import redis.asyncio as aioredis
+
+        await super().start(deliver)
+        self._client = aioredis.from_url(self.url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        await super().close()
+        if self._reader:
+            self._reader.cancel()
+        if self._pubsub:
+            await self._pubsub.aclose()
+        if self._client:
+            await self._client.aclose()
+
+    async def _subscribe(self, room_id: str):
+        await self._pubsub.subscribe(CHANNEL_PREFIX + room_id)
+
+    async def _unsubscribe(self, room_id: str):
+        await self._pubsub.unsubscribe(CHANNEL_PREFIX + room_id)
+
+    async def _send(self, batches: Dict[str, list[dict]]):
+        async with self._client.pipeline(transaction=False) as pipe:
+            for room_id, envelopes in batches.items():
+                pipe.publish(CHANNEL_PREFIX + room_id, codec.dumps(envelopes))
+            await pipe.execute()
+
+    async def _read_loop(self):
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(0.05)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                await self._receive(channel[len(CHANNEL_PREFIX):], codec.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane read error: {e}")
+                await asyncio.sleep(1)
+
+
+def create_backplane() -> Backplane | None:
+    """Build the backplane selected by the BACKPLANE setting ("none", "memory" or "redis")."""
+    if BACKPLANE == "memory":
+        return InProcessBackplane(LocalBroker())
+    if BACKPLANE == "redis":
+        if not REDIS_URL:
+            print("⚠️  BACKPLANE=redis but REDIS_URL is not set. Running single-worker.")
+            return None
+        return RedisBackplane(REDIS_URL)
+    return None
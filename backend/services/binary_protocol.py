@@ -0,0 +1,221 @@
+"""
+Compact binary WebSocket subprotocol for canvas frames.
+
+Clients opt in by offering the "bondbox.bin.v1" subprotocol. Canvas draw segments
+then travel as fixed-layout packed structs, with user IDs and colors interned to
+small integers per room. Everything else, and every client that does not opt in,
+stays on JSON text frames.
+
+Frame layout (little-endian, first byte is the opcode):
+    OP_INTERN  u8 op, then repeated entries: u8 table, u16 index, u8 length, utf-8 bytes
+    OP_DRAW    u8 op, u16 count, then count segments:
+               u16 user, i16 x, i16 y, i16 prevX, i16 prevY, u8 color, u8 size, u8 tool
+Coordinates are fixed-point with 1/COORD_SCALE px resolution.
+
+Interning is per direction: the server announces its room tables to binary clients
+before the first frame that uses a new index, and each client announces its own
+color table to the server (the user field is ignored inbound, the server knows the sender).
+A client's color table holds at most MAX_CLIENT_COLORS entries (segments carry a u8
+color index); intern frames naming a higher index are rejected whole.
+"""
+
+import struct
+from typing import Dict
+
+SUBPROTOCOL = "bondbox.bin.v1"
+
+OP_INTERN = 1
+OP_DRAW = 2
+
+TABLE_USER = 0
+TABLE_COLOR = 1
+
+TOOLS = ("pen", "eraser")
+COORD_SCALE = 2
+_COORD_LIMIT = 32767
+MAX_CLIENT_COLORS = 256
+
+# Message types that have a binary form
+BINARY_TYPES = {"canvas-draw", "canvas-batch"}
+
+_OP = struct.Struct("<B")
+_DRAW_HEADER = struct.Struct("<BH")
+_SEGMENT = struct.Struct("<HhhhhBBB")
+_INTERN_ENTRY = struct.Struct("<BHB")
+
+
+class InternTable:
+    """Append-only string -> small integer table."""
+
+    __slots__ = ("index", "values", "limit")
+
+    def __init__(self, limit: int):
+        self.index: Dict[str, int] = {}
+        self.values: list[str] = []
+        self.limit = limit
+
+    def intern(self, value: str, new_entries: list) -> int | None:
+        """Index for a value, adding it (and recording it in new_entries) if unseen. None if full."""
+        idx = self.index.get(value)
+        if idx is None:
+            if len(self.values) >= self.limit:
+                return None
+            idx = self.index[value] = len(self.values)
+            self.values.append(value)
+            new_entries.append((self, idx, value))
+        return idx
+
+
+class RoomCodec:
+    """Outbound intern tables for one room, shared by every binary connection in it."""
+
+    def __init__(self):
+        self.users = InternTable(limit=0xFFFF)
+        self.colors = InternTable(limit=0xFF)
+
+    def table_id(self, table: InternTable) -> int:
+        return TABLE_USER if table is self.users else TABLE_COLOR
+
+    def intern_frame(self, entries: list) -> bytes:
+        """OP_INTERN frame announcing the given (table, index, value) entries."""
+        parts = [_OP.pack(OP_INTERN)]
+        for table, idx, value in entries:
+            raw = value.encode()[:255]
+            parts.append(_INTERN_ENTRY.pack(self.table_id(table), idx, len(raw)))
+            parts.append(raw)
+        return b"".join(parts)
+
+    def full_table_frame(self) -> bytes | None:
+        """Everything interned so far, for a binary client that just joined."""
+        entries = [(self.users, i, v) for i, v in enumerate(self.users.values)]
+        entries += [(self.colors, i, v) for i, v in enumerate(self.colors.values)]
+        return self.intern_frame(entries) if entries else None
+
+    def encode(self, message: dict) -> tuple[bytes | None, bytes | None]:
+        """
+        Pack a canvas-draw or canvas-batch message.
+        Returns (intern_frame, draw_frame). intern_frame is set when the tables grew and
+        must reach every binary client first. draw_frame is None if the message cannot
+        be packed (malformed data, tables full) and should go out as JSON instead.
+        """
+        if message.get("type") == "canvas-batch":
+            segments = [(s.get("userId"), s.get("drawData")) for s in message.get("segments", [])]
+        else:
+            segments = [(message.get("userId"), message.get("drawData"))]
+
+        new_entries: list = []
+        packed = [_DRAW_HEADER.pack(OP_DRAW, len(segments))]
+        users, colors = self.users, self.colors
+        try:
+            for user_id, draw in segments:
+                color = draw.get("color", "")
+                user_idx = users.index.get(user_id)
+                if user_idx is None:
+                    user_idx = users.intern(str(user_id), new_entries)
+                color_idx = colors.index.get(color)
+                if color_idx is None:
+                    color_idx = colors.intern(str(color), new_entries)
+                if user_idx is None or color_idx is None:
+                    return self._interns(new_entries), None
+                packed.append(_pack_segment(user_idx, color_idx, draw))
+        except (AttributeError, OverflowError, TypeError, ValueError, struct.error):
+            # OverflowError: an infinite coordinate or size cannot be rounded
+            return self._interns(new_entries), None
+
+        return self._interns(new_entries), b"".join(packed)
+
+    def _interns(self, new_entries: list) -> bytes | None:
+        return self.intern_frame(new_entries) if new_entries else None
+
+
+def is_intern(data: bytes) -> bool:
+    """Whether a client frame is an OP_INTERN table update (charged to the canvas budget)."""
+    return data[:1] == bytes((OP_INTERN,))
+
+
+class InboundDecoder:
+    """Decodes binary frames from one client, tracking that client's color table."""
+
+    def __init__(self):
+        self.colors: Dict[int, str] = {}
+
+    def decode(self, data: bytes) -> dict | None:
+        """
+        Turn a client frame into the equivalent JSON-style message.
+        OP_INTERN frames only update the table and return None; so do malformed frames.
+        Clients send one segment per OP_DRAW frame.
+        """
+        try:
+            (op,) = _OP.unpack_from(data, 0)
+            if op == OP_INTERN:
+                offset = _OP.size
+                entries = {}
+                while offset < len(data):
+                    table, idx, length = _INTERN_ENTRY.unpack_from(data, offset)
+                    offset += _INTERN_ENTRY.size
+                    if table == TABLE_COLOR:
+                        if idx >= MAX_CLIENT_COLORS:
+                            return None
+                        entries[idx] = data[offset:offset + length].decode()
+                    offset += length
+                self.colors.update(entries)
+                return None
+
+            if op == OP_DRAW:
+                _, count = _DRAW_HEADER.unpack_from(data, 0)
+                if count < 1:
+                    return None
+                _, x, y, prev_x, prev_y, color, size, tool = _SEGMENT.unpack_from(
+                    data, _DRAW_HEADER.size
+                )
+                return {
+                    "type": "canvas-draw",
+                    "drawData": {
+                        "x": x / COORD_SCALE,
+                        "y": y / COORD_SCALE,
+                        "prevX": prev_x / COORD_SCALE,
+                        "prevY": prev_y / COORD_SCALE,
+                        "color": self.colors.get(color, "#ffffff"),
+                        "size": size,
+                        "tool": TOOLS[tool] if tool < len(TOOLS) else "pen",
+                    },
+                }
+        except (struct.error, UnicodeDecodeError):
+            return None
+        return None
+
+
+_TOOL_CODES = {tool: i for i, tool in enumerate(TOOLS)}
+
+
+def _coord(value) -> int:
+    scaled = round(float(value) * COORD_SCALE)
+    return max(-_COORD_LIMIT, min(_COORD_LIMIT, scaled))
+
+
+def _pack_segment(user_idx: int, color_idx: int, draw: dict) -> bytes:
+    tool = _TOOL_CODES.get(draw.get("tool"), 0)
+    size = draw.get("size", 1)
+    try:
+        # Fast path: everything already in range
+        return _SEGMENT.pack(
+            user_idx,
+            round(draw["x"] * COORD_SCALE),
+            round(draw["y"] * COORD_SCALE),
+            round(draw["prevX"] * COORD_SCALE),
+            round(draw["prevY"] * COORD_SCALE),
+            color_idx,
+            round(size),
+            tool,
+        )
+    except struct.error:
+        return _SEGMENT.pack(
+            user_idx,
+            _coord(draw["x"]),
+            _coord(draw["y"]),
+            _coord(draw["prevX"]),
+            _coord(draw["prevY"]),
+            color_idx,
+            max(0, min(255, round(float(size)))),
+            tool,
+        )
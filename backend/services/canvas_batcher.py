@@ -0,0 +1,105 @@
+"""
+Server-side canvas-draw coalescing.
+Gathers canvas-draw segments per room for one tick and fans them out as a single
+canvas-batch frame, instead of one WebSocket frame per mousemove segment.
+"""
+
+import asyncio
+import time
+from typing import Dict
+
+from config import CANVAS_BATCH_TICK_MS
+from services import metrics
+from services.websocket_manager import ConnectionManager, manager
+
+batches_sent = metrics.counter(
+    "canvas_batches_sent_total", "canvas-batch frames flushed (one per room tick)"
+)
+segments_batched = metrics.counter(
+    "canvas_segments_batched_total", "canvas-draw segments delivered through batches"
+)
+frames_saved = metrics.counter(
+    "canvas_frames_saved_total", "WebSocket frames avoided by coalescing canvas-draw segments"
+)
+added_latency = metrics.histogram(
+    "canvas_batch_added_latency_seconds",
+    "Time the oldest segment in a batch waited before being flushed",
+    buckets=(0.005, 0.01, 0.016, 0.025, 0.033, 0.05, 0.1, 0.25),
+)
+
+
+class CanvasBatcher:
+    """Per-room canvas-draw buffer flushed every tick."""
+
+    def __init__(self, connections: ConnectionManager, tick_ms: int = CANVAS_BATCH_TICK_MS):
+        self.connections = connections
+        self.tick = tick_ms / 1000
+        # room_id -> [(user_id, drawData)] in arrival order
+        self._pending: Dict[str, list[tuple[str, dict]]] = {}
+        self._first_at: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.tick > 0
+
+    def add(self, room_id: str, user_id: str, draw_data: dict):
+        """Buffer one segment; the first segment of a tick schedules the flush."""
+        pending = self._pending.get(room_id)
+        if pending is None:
+            pending = self._pending[room_id] = []
+            self._first_at[room_id] = time.monotonic()
+            self._timers[room_id] = asyncio.get_running_loop().call_later(
+                self.tick, self._flush_due, room_id
+            )
+        pending.append((user_id, draw_data))
+
+    def _flush_due(self, room_id: str):
+        task = asyncio.create_task(self.flush(room_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, room_id: str):
+        """
+        Send everything buffered for a room now.
+        Called on every tick, and before canvas-clear so the clear stays ordered after earlier strokes.
+        """
+        pending = self._pending.pop(room_id, None)
+        timer = self._timers.pop(room_id, None)
+        first_at = self._first_at.pop(room_id, None)
+        if timer:
+            timer.cancel()
+        if not pending:
+            return
+
+        added_latency.observe(time.monotonic() - first_at)
+        batches_sent.inc()
+        segments_batched.inc(len(pending))
+
+        # No local peers left still means peers on other workers: broadcast regardless
+        peers = self.connections.rooms.get(room_id) or {}
+        senders = {uid for uid, _ in pending}
+        segments = [{"userId": uid, "drawData": data} for uid, data in pending]
+        saved = 0
+
+        # Peers who did not draw this tick all get the same frame
+        await self.connections.broadcast_to_room(
+            room_id, {"type": "canvas-batch", "segments": segments}, exclude=senders
+        )
+        saved += (len(peers) - len(senders & peers.keys())) * (len(segments) - 1)
+
+        # Each sender gets the batch minus their own segments (they already drew them)
+        for sender in senders & peers.keys():
+            own_excluded = [s for s in segments if s["userId"] != sender]
+            if not own_excluded:
+                continue
+            await self.connections.send_to_user(
+                room_id, sender, {"type": "canvas-batch", "segments": own_excluded}
+            )
+            saved += len(own_excluded) - 1
+
+        frames_saved.inc(saved)
+
+
+canvas_batcher = CanvasBatcher(manager)
@@ -0,0 +1,249 @@
+"""
+Per-room canvas state for late joiners.
+Keeps a bounded vector log of each room's strokes since the last canvas-clear,
+so a new connection can be sent the whole canvas in one canvas-snapshot frame.
+
+Each worker only mirrors strokes drawn after it subscribed to a room, so its
+log may be missing the start of the canvas. Every log remembers when it began
+(wall-clock, shared by all workers); export/adopt let workers hand the oldest,
+most complete log to the one a late joiner connected to.
+
+Segments are compacted as they arrive: consecutive segments of the same stroke
+are merged into one polyline, zero-length and collinear points are dropped.
+"""
+
+import math
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Dict
+
+from config import (
+    CANVAS_STATE_IDLE_TTL,
+    CANVAS_STATE_MAX_POINTS,
+    CANVAS_STATE_MAX_ROOMS,
+)
+from services import codec
+from services.binary_protocol import TOOLS
+
+# Points closer than this (in canvas px) are treated as the same point
+_MIN_DISTANCE = 0.5
+# Cross-product tolerance for treating three points as collinear
+_COLLINEAR_EPSILON = 0.25
+# Longest color string kept ("#rrggbbaa", "rgba(...)", CSS names); the point cap
+# bounds a room's log only if every field of a stroke is small too
+MAX_COLOR_LENGTH = 32
+
+
+class Stroke:
+    """One polyline with a single color/size/tool, stored as flat float32 x, y pairs."""
+
+    __slots__ = ("user_id", "color", "size", "tool", "points")
+
+    def __init__(self, user_id: str, color: str, size: float, tool: str, x: float, y: float):
+        self.user_id = user_id
+        self.color = color
+        self.size = size
+        self.tool = tool
+        self.points = array("f", (x, y))
+
+    def matches(self, user_id: str, color: str, size: float, tool: str, x: float, y: float) -> bool:
+        """True if a segment starting at (x, y) continues this stroke."""
+        return (
+            self.user_id == user_id
+            and self.color == color
+            and self.size == size
+            and self.tool == tool
+            and abs(self.points[-2] - x) < _MIN_DISTANCE
+            and abs(self.points[-1] - y) < _MIN_DISTANCE
+        )
+
+    def extend(self, x: float, y: float) -> int:
+        """Append a point, merging it into the last one where possible. Returns points added."""
+        pts = self.points
+        last_x, last_y = pts[-2], pts[-1]
+        if abs(x - last_x) < _MIN_DISTANCE and abs(y - last_y) < _MIN_DISTANCE:
+            return 0
+
+        if len(pts) >= 4:
+            prev_x, prev_y = pts[-4], pts[-3]
+            dx1, dy1 = last_x - prev_x, last_y - prev_y
+            dx2, dy2 = x - last_x, y - last_y
+            # Same direction on the same line: move the end point instead of adding one
+            if abs(dx1 * dy2 - dy1 * dx2) < _COLLINEAR_EPSILON and dx1 * dx2 + dy1 * dy2 > 0:
+                pts[-2], pts[-1] = x, y
+                return 0
+
+        pts.append(x)
+        pts.append(y)
+        return 1
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Stroke":
+        """Rebuild a stroke exported by another worker (user_id is not carried over)."""
+        color, tool = data.get("color") or "", data.get("tool") or "pen"
+        points = [float(v) for v in data["points"]]
+        if not isinstance(color, str) or len(color) > MAX_COLOR_LENGTH or tool not in TOOLS:
+            raise ValueError("unsupported color or tool")
+        if len(points) < 2 or len(points) % 2:
+            raise ValueError("stroke needs x, y pairs")
+        stroke = cls("", color, float(data.get("size") or 1), tool, points[0], points[1])
+        stroke.points.extend(points[2:])
+        return stroke
+
+    def to_dict(self) -> dict:
+        return {
+            "color": self.color,
+            "size": self.size,
+            "tool": self.tool,
+            "points": [round(v, 1) for v in self.points],
+        }
+
+
+class RoomCanvas:
+    """Stroke log for one room."""
+
+    __slots__ = ("strokes", "open", "point_count", "started_at", "last_active", "_snapshot")
+
+    def __init__(self, started_at: float | None = None):
+        self.strokes: deque[Stroke] = deque()
+        # user_id -> the stroke that user is currently drawing
+        self.open: Dict[str, Stroke] = {}
+        self.point_count = 0
+        # Wall-clock start of this log; the earliest-started log across workers is the fullest
+        self.started_at = time.time() if started_at is None else started_at
+        self.last_active = time.monotonic()
+        self._snapshot: str | None = None
+
+    def add_segment(self, user_id: str, draw: dict):
+        x, y = float(draw["x"]), float(draw["y"])
+        prev_x, prev_y = float(draw["prevX"]), float(draw["prevY"])
+        color = draw.get("color") or ""
+        size = float(draw.get("size") or 1)
+        tool = draw.get("tool") or "pen"
+        if not all(map(math.isfinite, (x, y, prev_x, prev_y, size))):
+            raise ValueError("non-finite coordinate or size")
+        if not isinstance(color, str) or len(color) > MAX_COLOR_LENGTH or tool not in TOOLS:
+            raise ValueError("unsupported color or tool")
+
+        stroke = self.open.get(user_id)
+        if stroke is not None and stroke.matches(user_id, color, size, tool, prev_x, prev_y):
+            self.point_count += stroke.extend(x, y)
+        else:
+            stroke = Stroke(user_id, color, size, tool, prev_x, prev_y)
+            stroke.extend(x, y)
+            self.strokes.append(stroke)
+            self.open[user_id] = stroke
+            self.point_count += len(stroke.points) // 2
+
+        # Stay within the per-room budget by forgetting the oldest strokes
+        while self.point_count > CANVAS_STATE_MAX_POINTS and len(self.strokes) > 1:
+            oldest = self.strokes.popleft()
+            self.point_count -= len(oldest.points) // 2
+            if self.open.get(oldest.user_id) is oldest:
+                del self.open[oldest.user_id]
+
+        self.last_active = time.monotonic()
+        self._snapshot = None
+
+    def snapshot_frame(self) -> str:
+        """The encoded canvas-snapshot frame, rebuilt only after the canvas changes."""
+        if self._snapshot is None:
+            self._snapshot = codec.dumps({
+                "type": "canvas-snapshot",
+                "strokes": [s.to_dict() for s in self.strokes],
+            })
+        return self._snapshot
+
+
+class CanvasStateStore:
+    """All rooms' canvases, least recently active first, with idle and count-based eviction."""
+
+    def __init__(self):
+        self.rooms: OrderedDict[str, RoomCanvas] = OrderedDict()
+
+    def record_draw(self, room_id: str, user_id: str, draw_data: dict) -> bool:
+        """Add one canvas-draw segment to the room's log. False (and nothing kept) if it is malformed."""
+        canvas = self.rooms.get(room_id)
+        if canvas is None:
+            canvas = self.rooms[room_id] = RoomCanvas()
+        else:
+            self.rooms.move_to_end(room_id)
+
+        try:
+            canvas.add_segment(user_id, draw_data)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        self.evict_idle()
+        return True
+
+    def apply_broadcast(self, room_id: str, message: dict):
+        """Mirror canvas traffic that another worker broadcast into this worker's log."""
+        msg_type = message.get("type")
+        if msg_type == "canvas-draw":
+            self.record_draw(room_id, message.get("userId", ""), message.get("drawData"))
+        elif msg_type == "canvas-batch":
+            for segment in message.get("segments", []):
+                self.record_draw(room_id, segment.get("userId", ""), segment.get("drawData"))
+        elif msg_type == "canvas-clear":
+            self.clear(room_id)
+
+    def export(self, room_id: str) -> dict | None:
+        """A room's log for another worker ({"startedAt", "strokes"}), or None if blank."""
+        canvas = self.rooms.get(room_id)
+        if canvas is None or not canvas.strokes:
+            return None
+        return {"startedAt": canvas.started_at, "strokes": [s.to_dict() for s in canvas.strokes]}
+
+    def started_at(self, room_id: str) -> float | None:
+        """When this worker's log for a room began, or None if it has none."""
+        canvas = self.rooms.get(room_id)
+        return canvas.started_at if canvas is not None and canvas.strokes else None
+
+    def adopt(self, room_id: str, started_at: float, strokes: list) -> bool:
+        """Replace a room's log with an exported one if it began earlier. True if adopted."""
+        current = self.started_at(room_id)
+        if current is not None and current <= started_at:
+            return False
+        try:
+            canvas = RoomCanvas(float(started_at))
+            for data in strokes:
+                stroke = Stroke.from_dict(data)
+                canvas.strokes.append(stroke)
+                canvas.point_count += len(stroke.points) // 2
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        self.rooms[room_id] = canvas
+        self.rooms.move_to_end(room_id)
+        self.evict_idle()
+        return True
+
+    def clear(self, room_id: str):
+        """Forget a room's strokes (canvas-clear)."""
+        self.rooms.pop(room_id, None)
+
+    def snapshot_frame(self, room_id: str) -> str | None:
+        """Encoded canvas-snapshot for a room, or None if its canvas is blank."""
+        self.evict_idle()
+        canvas = self.rooms.get(room_id)
+        if canvas is None or not canvas.strokes:
+            return None
+        return canvas.snapshot_frame()
+
+    def evict_idle(self):
+        """Drop rooms idle past the TTL, and the least recently active beyond the room cap."""
+        cutoff = time.monotonic() - CANVAS_STATE_IDLE_TTL
+        while self.rooms:
+            room_id, canvas = next(iter(self.rooms.items()))
+            if canvas.last_active >= cutoff and len(self.rooms) <= CANVAS_STATE_MAX_ROOMS:
+                break
+            del self.rooms[room_id]
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "points": sum(c.point_count for c in self.rooms.values()),
+        }
+
+
+canvas_state = CanvasStateStore()
@@ -0,0 +1,180 @@
+"""
+Circuit breaker for a remote dependency (used for Redis by services.redis_client).
+
+closed:    calls go through. The outcome of each of the last `window` calls is kept
+           (ok, failed or slow), and once at least half a window has been seen the
+           breaker opens if the failure rate or the slow-call rate reaches `threshold`.
+open:      callers are told the dependency is unavailable and take their fallback.
+half_open: after `cooldown` seconds, `probe` (e.g. a PING) is sent `probes` times in
+           a row. All of them answering in time closes the breaker; anything else
+           re-opens it for another cooldown. Regular calls stay off meanwhile.
+
+Probing runs in a background task, so no caller's request is spent finding out
+whether the dependency is back. Callbacks in `listeners` are told every state
+change (e.g. to replay work that was queued while the breaker was open).
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from services import metrics
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Every breaker, for the state gauge
+_breakers: list["CircuitBreaker"] = []
+
+transitions = metrics.counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes, by breaker and new state", ("name", "state")
+)
+rejected = metrics.counter(
+    "circuit_breaker_rejected_total", "Calls refused because the breaker was not closed", ("name",)
+)
+metrics.gauge(
+    "circuit_breaker_state",
+    "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+    ("name",),
+    fn=lambda: {(b.name,): _STATE_VALUES[b.state] for b in _breakers},
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is not closed."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        probe: Callable[[], Awaitable],
+        window: int = 20,
+        threshold: float = 0.5,
+        slow_seconds: float = 0.25,
+        cooldown: float = 5.0,
+        probes: int = 3,
+    ):
+        self.name = name
+        self.probe = probe
+        self.threshold = threshold
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.probes = probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self.last_error = ""
+        self._min_calls = max(1, window // 2)
+        # (failed, slow) per call, with running totals
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window)
+        self._failures = 0
+        self._slow = 0
+        self._recovery: asyncio.Task | None = None
+        # Called with the new state on every transition
+        self.listeners: list[Callable[[str], None]] = []
+        _breakers.append(self)
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def reject(self) -> CircuitOpenError:
+        """Count a refused call and return the error to raise for it."""
+        rejected.labels(self.name).inc()
+        return CircuitOpenError(f"{self.name} circuit is {self.state}")
+
+    def record(self, seconds: float, error: Exception | None = None):
+        """The outcome of one call. error is None for a call that got its answer."""
+        if self.state != CLOSED:
+            # Answers to calls made before the breaker opened
+            return
+        failed = error is not None
+        slow = not failed and seconds >= self.slow_seconds
+        if len(self._outcomes) == self._outcomes.maxlen:
+            old_failed, old_slow = self._outcomes[0]
+            self._failures -= old_failed
+            self._slow -= old_slow
+        self._outcomes.append((failed, slow))
+        self._failures += failed
+        self._slow += slow
+        if failed:
+            self.last_error = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+        calls = len(self._outcomes)
+        if calls >= self._min_calls:
+            if self._failures >= self.threshold * calls:
+                self.trip(f"{self._failures}/{calls} calls failed, last: {self.last_error}")
+            elif self._slow >= self.threshold * calls:
+                self.trip(f"{self._slow}/{calls} calls slower than {self.slow_seconds * 1000:g} ms")
+
+    def trip(self, reason: str):
+        """Open the breaker now and start probing for recovery."""
+        if self.state == OPEN:
+            return
+        print(f"⚠️  {self.name} circuit open: {reason}. Probing again in {self.cooldown:g}s")
+        self._set(OPEN)
+        self.opened_total += 1
+        if self._recovery is None:
+            self._recovery = asyncio.create_task(self._recover())
+
+    def _set(self, state: str):
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._outcomes.clear()
+            self._failures = self._slow = 0
+        transitions.labels(self.name, state).inc()
+        for listener in self.listeners:
+            try:
+                listener(state)
+            except Exception as e:
+                print(f"{self.name} circuit listener error: {e}")
+
+    async def _probe_ok(self) -> bool:
+        start = time.perf_counter()
+        try:
+            await self.probe()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            return False
+        return time.perf_counter() - start < self.slow_seconds
+
+    async def _recover(self):
+        try:
+            while self.state != CLOSED:
+                await asyncio.sleep(self.cooldown)
+                self._set(HALF_OPEN)
+                for _ in range(self.probes):
+                    if not await self._probe_ok():
+                        self._set(OPEN)
+                        break
+                else:
+                    self._set(CLOSED)
+                    print(f"✅ {self.name} circuit closed after {self.probes} good probes")
+        finally:
+            self._recovery = None
+
+    async def stop(self):
+        """Stop probing (on shutdown)."""
+        if self._recovery:
+            self._recovery.cancel()
+            try:
+                await self._recovery
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        calls = len(self._outcomes)
+        retry_in = self.opened_at + self.cooldown - time.monotonic() if self.state == OPEN else 0.0
+        return {
+            "state": self.state,
+            "failure_rate": round(self._failures / calls, 3) if calls else 0.0,
+            "slow_rate": round(self._slow / calls, 3) if calls else 0.0,
+            "calls_in_window": calls,
+            "opened_total": self.opened_total,
+            "probe_in_seconds": round(max(0.0, retry_in), 2),
+            "last_error": self.last_error,
+        }
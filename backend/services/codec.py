@@ -0,0 +1,70 @@
+"""
+Pluggable JSON codec for WebSocket frames.
+Uses orjson or msgspec when installed, otherwise the stdlib json module.
+Frames are encoded once per message and the same payload is written to every socket.
+"""
+
+import json
+from typing import Any, Callable
+
+from config import JSON_CODEC
+
+
+def _stdlib_codec() -> tuple[Callable[[Any], str], Callable[[str | bytes], Any]]:
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+    return dumps, json.loads
+
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    return dumps, orjson.loads
+
+
+def _msgspec_codec():
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any) -> str:
+        return encoder.encode(obj).decode()
+
+    def loads(data: str | bytes) -> Any:
+        return decoder.decode(data.encode() if isinstance(data, str) else data)
+
+    return dumps, loads
+
+
+_CODECS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+
+def load_codec(name: str = "auto") -> tuple[str, Callable[[Any], str], Callable[[str | bytes], Any]]:
+    """
+    Resolve a codec by name. "auto" tries orjson, then msgspec, then stdlib json.
+    Returns (codec_name, dumps, loads).
+    """
+    candidates = ["orjson", "msgspec", "json"] if name == "auto" else [name, "json"]
+    for candidate in candidates:
+        factory = _CODECS.get(candidate)
+        if factory is None:
+            continue
+        try:
+            dumps_fn, loads_fn = factory()
+            return candidate, dumps_fn, loads_fn
+        except ImportError:
+            continue
+    dumps_fn, loads_fn = _stdlib_codec()
+    return "json", dumps_fn, loads_fn
+
+
+CODEC_NAME, dumps, loads = load_codec(JSON_CODEC)
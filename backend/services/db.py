@@ -0,0 +1,240 @@
+"""
+Async data access for Supabase.
+
+One process-wide set of clients shares a single keep-alive connection pool:
+the async PostgREST client for table queries and the async GoTrue client for auth.
+Each request gets a cheap SupabaseClient view that sends the caller's JWT as a
+per-request Authorization header (for RLS) instead of building a new client,
+HTTP session and TLS handshake every time.
+
+Anything still synchronous can go through run_blocking(), which uses a small
+bounded thread pool so blocking HTTP never runs on the event loop.
+
+Queries and auth calls are timed per API endpoint (supabase_request_seconds):
+the routers depend on track_endpoint, which names the endpoint for the rest of
+the request. Calls made outside a request are labelled "background".
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from fastapi import Request
+from gotrue import AsyncGoTrueClient
+from postgrest import AsyncPostgrestClient, AsyncRequestBuilder
+
+from config import (
+    DB_THREADPOOL_SIZE,
+    SUPABASE_ANON_KEY,
+    SUPABASE_CONNECT_TIMEOUT,
+    SUPABASE_KEEPALIVE_EXPIRY,
+    SUPABASE_POOL_KEEPALIVE,
+    SUPABASE_POOL_SIZE,
+    SUPABASE_SERVICE_ROLE_KEY,
+    SUPABASE_TIMEOUT,
+    SUPABASE_URL,
+)
+from services import metrics
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADPOOL_SIZE, thread_name_prefix="supabase")
+_in_flight = 0
+
+# Shared pool and clients, created on first use
+_transport: httpx.AsyncHTTPTransport | None = None
+_sessions: list[httpx.AsyncClient] = []
+_postgrest: AsyncPostgrestClient | None = None
+_auth: AsyncGoTrueClient | None = None
+_requests = 0
+
+request_seconds = metrics.histogram(
+    "supabase_request_seconds", "Supabase query and auth call time by API endpoint", ("endpoint",)
+)
+request_errors = metrics.counter(
+    "supabase_errors_total", "Supabase queries and auth calls that raised, by API endpoint", ("endpoint",)
+)
+# "METHOD /route/{template}" of the request being handled
+_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("supabase_endpoint", default="background")
+
+
+async def track_endpoint(request: Request):
+    """Router dependency: label this request's Supabase calls with its route template."""
+    route = request.scope.get("route")
+    _endpoint.set(f"{request.method} {getattr(route, 'path', 'unknown')}")
+
+
+async def _timed(call):
+    endpoint = _endpoint.get()
+    start = time.perf_counter()
+    try:
+        return await call
+    except Exception:
+        request_errors.labels(endpoint).inc()
+        raise
+    finally:
+        request_seconds.labels(endpoint).observe(time.perf_counter() - start)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the Supabase thread pool."""
+    global _in_flight
+    _in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+    finally:
+        _in_flight -= 1
+
+
+async def _count_request(request: httpx.Request):
+    global _requests
+    _requests += 1
+
+
+def _http_client(base_url: str = "") -> httpx.AsyncClient:
+    """An httpx client on the shared transport, so every client draws from one pool."""
+    session = httpx.AsyncClient(
+        base_url=base_url,
+        transport=_transport,
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        headers={"apikey": SUPABASE_ANON_KEY, "Authorization": f"Bearer {SUPABASE_ANON_KEY}"},
+        follow_redirects=True,
+        event_hooks={"request": [_count_request]},
+    )
+    _sessions.append(session)
+    return session
+
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """AsyncPostgrestClient whose session comes from the shared pool."""
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return _http_client(base_url)
+
+
+def _clients() -> tuple[AsyncPostgrestClient, AsyncGoTrueClient]:
+    global _transport, _postgrest, _auth
+    if _postgrest is None:
+        _transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _postgrest = _PooledPostgrestClient(f"{SUPABASE_URL}/rest/v1")
+        _auth = AsyncGoTrueClient(
+            url=f"{SUPABASE_URL}/auth/v1",
+            headers={"apikey": SUPABASE_ANON_KEY},
+            http_client=_http_client(),
+            auto_refresh_token=False,
+            persist_session=False,
+        )
+    return _postgrest, _auth
+
+
+class _UserRequestBuilder(AsyncRequestBuilder):
+    """Table builder that stamps the caller's JWT on every query it starts."""
+
+    def __init__(self, session: httpx.AsyncClient, path: str, token: str):
+        super().__init__(session, path)
+        self.token = token
+
+    def _authorize(self, query):
+        query.headers["Authorization"] = f"Bearer {self.token}"
+        return query
+
+    def select(self, *columns, **kwargs):
+        return self._authorize(super().select(*columns, **kwargs))
+
+    def insert(self, json, **kwargs):
+        return self._authorize(super().insert(json, **kwargs))
+
+    def upsert(self, json, **kwargs):
+        return self._authorize(super().upsert(json, **kwargs))
+
+    def update(self, json, **kwargs):
+        return self._authorize(super().update(json, **kwargs))
+
+    def delete(self, **kwargs):
+        return self._authorize(super().delete(**kwargs))
+
+
+class SupabaseClient:
+    """Per-request view over the shared clients, scoped to one user's JWT (or anon)."""
+
+    def __init__(self, token: str | None = None):
+        self.token = token
+        self._postgrest, self._auth = _clients()
+
+    def table(self, name: str) -> AsyncRequestBuilder:
+        if self.token:
+            return _UserRequestBuilder(self._postgrest.session, f"/{name}", self.token)
+        return self._postgrest.table(name)
+
+    async def get_user(self):
+        """The GoTrue user for this client's JWT, or None without one."""
+        if not self.token:
+            return None
+        return await _timed(self._auth.get_user(self.token))
+
+
+async def get_client(authorization: str | None = None) -> SupabaseClient:
+    """Supabase access for one request, optionally with the user's JWT for RLS."""
+    if authorization and authorization.startswith("Bearer "):
+        return SupabaseClient(authorization.split(" ")[1])
+    return SupabaseClient()
+
+
+def service_client() -> SupabaseClient | None:
+    """
+    Supabase access with the service-role key, for server-side reads that no caller
+    is authorized for (RLS only shows profiles to authenticated users). None when
+    SUPABASE_SERVICE_ROLE_KEY is not set.
+    """
+    if not SUPABASE_SERVICE_ROLE_KEY:
+        return None
+    return SupabaseClient(SUPABASE_SERVICE_ROLE_KEY)
+
+
+async def execute(query):
+    """Run a PostgREST query: awaited directly if async, on the thread pool if not."""
+    if inspect.iscoroutinefunction(query.execute):
+        return await _timed(query.execute())
+    return await _timed(run_blocking(query.execute))
+
+
+async def get_user(client: SupabaseClient):
+    """The authenticated user for a client, or None."""
+    return await client.get_user()
+
+
+async def close():
+    """Close the shared connection pool. Call during FastAPI shutdown."""
+    global _transport, _postgrest, _auth
+    for session in _sessions:
+        await session.aclose()
+    _sessions.clear()
+    if _transport is not None:
+        await _transport.aclose()
+    _transport = _postgrest = _auth = None
+
+
+def stats() -> dict:
+    """Connection pool and thread pool usage, for sizing workers."""
+    connections = getattr(getattr(_transport, "_pool", None), "connections", [])
+    idle = sum(1 for c in connections if c.is_idle())
+    return {
+        "pool_size": SUPABASE_POOL_SIZE,
+        "pool_keepalive": SUPABASE_POOL_KEEPALIVE,
+        "connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "requests_total": _requests,
+        "threads": DB_THREADPOOL_SIZE,
+        "blocking_in_flight": _in_flight,
+    }
@@ -0,0 +1,234 @@
+"""
+Per-connection inbound message limits for room WebSockets.
+RateLimitMiddleware does not see WebSocket traffic, so each connection gets its own
+token buckets, one per message class (signaling, canvas, presence), and every
+incoming message spends a token from its class before it is handled.
+
+What happens to a message over budget depends on its class's action:
+- drop: discard it
+- coalesce: queue it and handle it once a token frees up
+- close: disconnect the client with code 1008 (policy violation)
+
+Each class has one FIFO queue. While anything in a class is queued, later messages
+of that class queue behind it, and they are released in arrival order. Messages
+that only carry the sender's latest state (typing, heartbeat, sync requests; see
+LATEST_ONLY) replace their earlier queued copy instead of adding another. Canvas
+draws are never merged: every segment is kept, so peers and snapshots match what
+the sender drew; a canvas-clear discards the draws queued before it, which it
+would erase anyway. A queue longer than its class's burst closes the connection,
+since no well-behaved client falls that far behind.
+
+Signaling must always use close: a dropped or merged offer, answer or ICE candidate
+leaves two peers unconnected with no error on either side, whereas a closed client
+reconnects and renegotiates. Its budget is sized for a join into a full mesh.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict
+
+from config import WS_LIMIT_CANVAS, WS_LIMIT_DEFAULT, WS_LIMIT_PRESENCE, WS_LIMIT_SIGNALING
+from services import metrics
+
+POLICY_CLOSE_CODE = 1008
+
+# Verdicts returned by InboundLimiter.admit
+ALLOW = "allow"
+DROP = "drop"
+COALESCE = "coalesce"
+CLOSE = "close"
+
+MESSAGE_CLASSES = {
+    "webrtc-offer": "signaling",
+    "webrtc-answer": "signaling",
+    "webrtc-ice": "signaling",
+    "screen-share-start": "signaling",
+    "screen-share-stop": "signaling",
+    "canvas-draw": "canvas",
+    "canvas-clear": "canvas",
+    "canvas-sync": "canvas",
+    "heartbeat": "presence",
+    "typing-start": "presence",
+    "typing-stop": "presence",
+    "get-peers": "presence",
+    "presence-sync": "presence",
+}
+
+# Messages where only the latest queued one matters, by the state they carry
+LATEST_ONLY = {
+    "typing-start": "typing",
+    "typing-stop": "typing",
+    "heartbeat": "heartbeat",
+    "get-peers": "get-peers",
+    "presence-sync": "presence-sync",
+    "canvas-sync": "canvas-sync",
+}
+
+
+def _parse_limit(spec: str) -> tuple[float, float, str]:
+    rate, burst, action = (part.strip() for part in spec.split(","))
+    if action not in (DROP, COALESCE, CLOSE):
+        raise ValueError(f"Unknown WebSocket limit action: {action}")
+    return float(rate), float(burst), action
+
+
+def _signaling_limit(spec: str) -> tuple[float, float, str]:
+    limit = _parse_limit(spec)
+    if limit[2] != CLOSE:
+        raise ValueError("WS_LIMIT_SIGNALING must use the close action; signaling cannot be dropped or coalesced")
+    return limit
+
+
+# class -> (tokens per second, burst, action)
+LIMITS = {
+    "signaling": _signaling_limit(WS_LIMIT_SIGNALING),
+    "canvas": _parse_limit(WS_LIMIT_CANVAS),
+    "presence": _parse_limit(WS_LIMIT_PRESENCE),
+    "default": _parse_limit(WS_LIMIT_DEFAULT),
+}
+
+inbound_messages = metrics.counter(
+    "ws_inbound_messages_total",
+    "Inbound WebSocket messages by class and what the limiter did with them",
+    ("class", "result"),
+)
+# Children resolved once; admit() runs for every inbound message
+_results = {
+    (cls, result): inbound_messages.labels(cls, result)
+    for cls in LIMITS
+    for result in ("allowed", "dropped", "coalesced", "closed")
+}
+
+
+class _TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until the next token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class InboundLimiter:
+    """Token buckets for one connection. Coalesced messages are handed to on_release later."""
+
+    def __init__(self, on_release: Callable[[dict], Awaitable[None]], limits: dict = LIMITS):
+        self.on_release = on_release
+        self.limits = limits
+        self.buckets: Dict[str, _TokenBucket] = {
+            cls: _TokenBucket(rate, burst) for cls, (rate, burst, _) in limits.items()
+        }
+        # class -> messages waiting for a token, oldest first
+        self.pending: Dict[str, deque] = {}
+        # class -> timer releasing that class's oldest pending message
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def admit(self, message: dict) -> str:
+        """Spend a token for a message. Returns ALLOW, DROP, COALESCE or CLOSE."""
+        msg_type = message.get("type", "")
+        if not isinstance(msg_type, str):
+            # Not a message any handler accepts
+            _results["default", "dropped"].inc()
+            return DROP
+        cls = MESSAGE_CLASSES.get(msg_type, "default")
+
+        queue = self.pending.get(cls)
+        if queue:
+            return self._enqueue(cls, queue, message)
+
+        bucket = self.buckets[cls]
+        if bucket.take():
+            _results[cls, "allowed"].inc()
+            return ALLOW
+
+        action = self.limits[cls][2]
+        if action == COALESCE:
+            verdict = self._enqueue(cls, self.pending.setdefault(cls, deque()), message)
+            self._schedule(cls)
+            return verdict
+        if action == CLOSE:
+            _results[cls, "closed"].inc()
+            return CLOSE
+        _results[cls, "dropped"].inc()
+        return DROP
+
+    def _enqueue(self, cls: str, queue: deque, message: dict) -> str:
+        """Queue a message behind the class's pending ones, keeping arrival order."""
+        msg_type = message["type"]
+        state = LATEST_ONLY.get(msg_type)
+        if state is not None:
+            # A newer copy of the same state supersedes the queued one
+            for queued in queue:
+                if LATEST_ONLY.get(queued["type"]) == state:
+                    queue.remove(queued)
+                    break
+        elif msg_type == "canvas-clear":
+            # Draws queued before a clear would only be erased by it
+            kept = [queued for queued in queue if queued["type"] != "canvas-draw"]
+            queue.clear()
+            queue.extend(kept)
+        if len(queue) >= self.limits[cls][1]:
+            _results[cls, "closed"].inc()
+            return CLOSE
+        queue.append(message)
+        _results[cls, "coalesced"].inc()
+        return COALESCE
+
+    def charge(self, cls: str) -> bool:
+        """
+        Spend a token of a class for a frame that is not a message (binary intern-table
+        updates). Such frames cannot be coalesced, so one over budget is dropped.
+        """
+        if self.buckets[cls].take():
+            _results[cls, "allowed"].inc()
+            return True
+        _results[cls, "dropped"].inc()
+        return False
+
+    def _schedule(self, cls: str):
+        self._timers[cls] = asyncio.get_running_loop().call_later(
+            self.buckets[cls].wait_time(), self._release, cls
+        )
+
+    def _release(self, cls: str):
+        """Hand the class's oldest pending message on once a token is available."""
+        self._timers.pop(cls, None)
+        queue = self.pending.get(cls)
+        if not queue:
+            return
+        if not self.buckets[cls].take():
+            self._schedule(cls)
+            return
+        message = queue.popleft()
+        task = asyncio.create_task(self.on_release(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if queue:
+            self._schedule(cls)
+        else:
+            del self.pending[cls]
+
+    def close(self):
+        """Forget pending messages (the connection is gone)."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self.pending.clear()
@@ -0,0 +1,299 @@
+"""
+Live XP rankings for every user, kept up to date as XP changes.
+
+leaderboard_cache holds the top of the board with profile data, rebuilt from
+Supabase every minute. This holds every user's score, applied one change at a
+time (from the Supabase profiles webhook), so it can also answer "what is my
+rank" and "who is around me".
+
+Scores live in a Redis sorted set when a shared Redis (upstash or resp) is
+configured. Otherwise each worker keeps its own SortedList ordered by
+(-xp, user_id). Either way rank, top N and neighbors are O(log n) lookups.
+
+The choice is made once, in load(), not per call. Writes made while Redis is
+unreachable (breaker open, or a failed call) are queued, latest XP per user,
+and replayed when the breaker closes or with the next write that gets through.
+Reads never fall back to an index that was not seeded: until the rankings are
+loaded, or while their Redis is unreachable, they raise RankingsUnavailable.
+"""
+
+import asyncio
+from sortedcontainers import SortedList
+
+from services import db, metrics
+from services.circuit_breaker import CLOSED
+from services.redis_client import (
+    breaker,
+    get_redis,
+    is_redis_available,
+    pipeline,
+    shared_redis_configured,
+)
+
+RANKS_KEY = "leaderboard:xp:ranks"
+# Set once a full seed has been written (webhook writes alone also create RANKS_KEY)
+SEEDED_KEY = "leaderboard:xp:ranks:seeded"
+LOAD_PAGE_SIZE = 1000
+LOAD_RETRY_SECONDS = 30
+
+updates = metrics.counter(
+    "leaderboard_rank_updates_total", "XP changes applied to the live rankings", ("backend",)
+)
+
+
+class RankingsUnavailable(Exception):
+    """The rankings cannot be read right now: not loaded yet, or their Redis is unreachable."""
+
+
+def _entries(rows, start: int) -> list[dict]:
+    """(user_id, xp) pairs from position `start` as API rows with 1-based ranks."""
+    return [
+        {"id": user_id, "xp": int(xp), "rank": start + i + 1}
+        for i, (user_id, xp) in enumerate(rows)
+    ]
+
+
+class MemoryRanks:
+    """Order-statistics index over every user's XP, for running without Redis."""
+
+    def __init__(self):
+        self.scores: dict[str, float] = {}
+        # (-xp, user_id): ascending order is leaderboard order
+        self.order = SortedList()
+
+    def __len__(self):
+        return len(self.scores)
+
+    def set(self, user_id: str, xp: float):
+        old = self.scores.get(user_id)
+        if old is not None:
+            self.order.remove((-old, user_id))
+        self.scores[user_id] = xp
+        self.order.add((-xp, user_id))
+
+    def remove(self, user_id: str):
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            self.order.remove((-old, user_id))
+
+    def rank(self, user_id: str) -> int | None:
+        """0-based position, or None for an unknown user."""
+        xp = self.scores.get(user_id)
+        if xp is None:
+            return None
+        return self.order.index((-xp, user_id))
+
+    def range(self, start: int, stop: int) -> list[tuple[str, float]]:
+        """(user_id, xp) for positions start..stop-1."""
+        return [(user_id, -neg_xp) for neg_xp, user_id in self.order.islice(start, stop)]
+
+
+class Leaderboard:
+    """Every user's XP, in a shared Redis when one is configured, otherwise in this worker."""
+
+    def __init__(self):
+        self.memory = MemoryRanks()
+        # Where the rankings live, decided by load(): Redis (True) or self.memory
+        self.shared = False
+        # Seeded (or, in Redis, found seeded by another worker)
+        self.ready = False
+        # user_id -> xp (None: removed) for writes Redis has not acknowledged
+        self.pending: dict[str, float | None] = {}
+        # Users written while a seed is running; their seeded rows are older
+        self._touched: set[str] | None = None
+        self._replay: asyncio.Task | None = None
+        breaker.listeners.append(self._breaker_changed)
+
+    async def load(self):
+        """
+        Choose where the rankings live and seed them from Supabase (paged by id).
+        With Redis the seed is skipped if another worker, or an earlier run, has
+        already completed one. A failed seed is retried every LOAD_RETRY_SECONDS.
+        """
+        self.shared = shared_redis_configured()
+        while not self.ready:
+            try:
+                await self._seed()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Leaderboard load error: {e} (retrying in {LOAD_RETRY_SECONDS}s)")
+                await asyncio.sleep(LOAD_RETRY_SECONDS)
+
+    async def _seed(self):
+        if self.shared:
+            redis = await get_redis()
+            if await redis.exists(SEEDED_KEY):
+                self.ready = True
+                return
+
+        # Profiles are only readable by authenticated users (RLS)
+        supabase = db.service_client()
+        if supabase is None:
+            print("⚠️  SUPABASE_SERVICE_ROLE_KEY is not set; seeding rankings with the anon key")
+            supabase = await db.get_client()
+        self._touched = set()
+        try:
+            loaded, start = 0, 0
+            while True:
+                result = await db.execute(
+                    supabase.table("profiles")
+                    .select("id, xp")
+                    .order("id")
+                    .range(start, start + LOAD_PAGE_SIZE - 1)
+                )
+                rows = result.data or []
+                scores = {
+                    row["id"]: row.get("xp") or 0 for row in rows if row["id"] not in self._touched
+                }
+                if scores:
+                    if self.shared:
+                        await (await get_redis()).zadd(RANKS_KEY, scores)
+                    else:
+                        for user_id, xp in scores.items():
+                            self.memory.set(user_id, xp)
+                loaded += len(rows)
+                if len(rows) < LOAD_PAGE_SIZE:
+                    break
+                start += LOAD_PAGE_SIZE
+            if self.shared:
+                await (await get_redis()).set(SEEDED_KEY, "1")
+        finally:
+            self._touched = None
+
+        self.ready = True
+        if not loaded:
+            print("⚠️  Leaderboard rankings loaded 0 users; check the key's access to profiles")
+        else:
+            print(f"🏆 Leaderboard rankings loaded ({loaded} users)")
+
+    # --- Writes ---
+
+    async def set_xp(self, user_id: str, xp: float):
+        """Record a user's current XP."""
+        await self._write(user_id, xp)
+
+    async def remove(self, user_id: str):
+        await self._write(user_id, None)
+
+    async def _write(self, user_id: str, xp: float | None):
+        if self._touched is not None:
+            self._touched.add(user_id)
+        if not self.shared:
+            if xp is None:
+                self.memory.remove(user_id)
+            else:
+                self.memory.set(user_id, xp)
+            updates.labels("memory").inc()
+            return
+        # Absolute XP, so only the latest write per user needs to reach Redis
+        self.pending[user_id] = xp
+        updates.labels("redis").inc()
+        if is_redis_available():
+            await self._flush()
+
+    async def _flush(self):
+        """Send the queued writes in one round-trip. Kept for a later replay if it fails."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        scores = {user_id: xp for user_id, xp in batch.items() if xp is not None}
+        removed = [user_id for user_id, xp in batch.items() if xp is None]
+        try:
+            pipe = pipeline()
+            if scores:
+                pipe.zadd(RANKS_KEY, scores)
+            if removed:
+                pipe.zrem(RANKS_KEY, *removed)
+            await pipe.exec()
+        except Exception as e:
+            # Writes queued meanwhile are newer
+            self.pending = {**batch, **self.pending}
+            print(f"Leaderboard write error ({len(self.pending)} queued for replay): {e}")
+
+    def _breaker_changed(self, state: str):
+        if state == CLOSED and self.shared and self.pending and self._replay is None:
+            self._replay = asyncio.create_task(self._replay_pending())
+
+    async def _replay_pending(self):
+        try:
+            count = len(self.pending)
+            await self._flush()
+            if not self.pending:
+                print(f"🏆 Replayed {count} leaderboard writes queued while Redis was unavailable")
+        finally:
+            self._replay = None
+
+    # --- Reads ---
+
+    def _check_readable(self):
+        if not self.ready:
+            raise RankingsUnavailable("rankings are still loading")
+        if self.shared and not is_redis_available():
+            raise RankingsUnavailable("rankings store is unavailable")
+
+    async def top(self, n: int) -> list[dict]:
+        """The first n users."""
+        self._check_readable()
+        if n <= 0:
+            return []
+        if self.shared:
+            try:
+                redis = await get_redis()
+                rows = await redis.zrange(RANKS_KEY, 0, n - 1, rev=True, withscores=True)
+            except Exception as e:
+                raise RankingsUnavailable(str(e)) from e
+            return _entries(rows, 0)
+        return _entries(self.memory.range(0, n), 0)
+
+    async def rank(self, user_id: str) -> dict | None:
+        """A user's rank (1-based) and XP, or None if they are not ranked."""
+        self._check_readable()
+        if self.shared:
+            try:
+                pipe = pipeline()
+                pipe.zrevrank(RANKS_KEY, user_id)
+                pipe.zscore(RANKS_KEY, user_id)
+                position, xp = await pipe.exec()
+            except Exception as e:
+                raise RankingsUnavailable(str(e)) from e
+            if position is None:
+                return None
+            return {"id": user_id, "xp": int(xp), "rank": position + 1}
+
+        position = self.memory.rank(user_id)
+        if position is None:
+            return None
+        return {"id": user_id, "xp": int(self.memory.scores[user_id]), "rank": position + 1}
+
+    async def neighbors(self, user_id: str, radius: int = 5) -> list[dict] | None:
+        """Up to `radius` users either side of a user, the user included."""
+        self._check_readable()
+        if self.shared:
+            try:
+                redis = await get_redis()
+                position = await redis.zrevrank(RANKS_KEY, user_id)
+                if position is None:
+                    return None
+                start = max(0, position - radius)
+                rows = await redis.zrange(RANKS_KEY, start, position + radius, rev=True, withscores=True)
+            except Exception as e:
+                raise RankingsUnavailable(str(e)) from e
+            return _entries(rows, start)
+
+        position = self.memory.rank(user_id)
+        if position is None:
+            return None
+        start = max(0, position - radius)
+        return _entries(self.memory.range(start, position + radius + 1), start)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis" if self.shared else "memory",
+            "ready": self.ready,
+            "pending_writes": len(self.pending),
+            "memory_users": len(self.memory),
+        }
+
+
+leaderboard = Leaderboard()
@@ -1,17 +1,69 @@
 """
 Leaderboard cache using Upstash Redis Sorted Sets.
 Serves XP rankings from cache with periodic refresh from Supabase.
+
+A rebuild writes the new top-N into staging keys named after its content hash,
+then renames them over the live keys inside the same MULTI, so readers see either
+the old board or the new one, never an empty or half-written one. If the hash
+matches the version already live, only the TTLs are extended.
+
+get_leaderboard() puts a short-lived in-process copy (L1) in front of Redis, and
+lets concurrent misses share one load, so a cold cache costs one Redis read or
+one Supabase query per worker rather than one per request.
+
+Profiles are only readable by authenticated users (RLS), so Supabase reads use the
+service-role client, or the caller's token when no service-role key is configured.
+In that case L1 entries and shared loads are kept apart for signed-in and
+anonymous callers, so one never gets the other's view of the board.
 """
 
-from services.redis_client import get_redis, is_redis_available
-from supabase import create_client
-from config import SUPABASE_URL, SUPABASE_ANON_KEY
+from config import LEADERBOARD_DEPTH, LEADERBOARD_L1_TTL, SUPABASE_SERVICE_ROLE_KEY
+from services import auth, db, metrics
+from services.redis_client import get_redis, is_redis_available, pipeline
+import asyncio
+import hashlib
 import json
+import time
 
 LEADERBOARD_KEY = "leaderboard:xp"
 LEADERBOARD_DATA_KEY = "leaderboard:xp:data"
+LEADERBOARD_VERSION_KEY = "leaderboard:xp:version"
 CACHE_TTL = 120  # Cache lives for 2 minutes
 
+refreshes = metrics.counter(
+    "leaderboard_refreshes_total", "Leaderboard cache rebuilds", ("result",)
+)
+lookups = metrics.counter(
+    "leaderboard_cache_lookups_total", "Leaderboard reads by cache tier", ("tier", "result")
+)
+refresh_seconds = metrics.histogram(
+    "leaderboard_refresh_seconds", "Time to rebuild (or confirm unchanged) the leaderboard cache"
+)
+stampedes = metrics.counter(
+    "leaderboard_stampede_coalesced_total", "Leaderboard misses that waited on a load already in flight"
+)
+
+# (depth, audience) -> (expires_at, rows, source)
+_l1: dict[tuple[int, str], tuple[float, list[dict], str]] = {}
+# (depth, audience) -> load in flight
+_loads: dict[tuple[int, str], asyncio.Task] = {}
+
+
+def _entry(user: dict) -> dict:
+    return {
+        "display_name": user.get("display_name", ""),
+        "avatar_url": user.get("avatar_url", ""),
+        "xp": user.get("xp", 0),
+        "teaching_xp": user.get("teaching_xp", 0),
+        "room_coins": user.get("room_coins", 0),
+    }
+
+
+def _version(rows: list[dict]) -> str:
+    """Content hash of a top-N (order, ids, scores and profile data)."""
+    payload = json.dumps([[user["id"], _entry(user)] for user in rows], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
 
 async def refresh_leaderboard():
     """
@@ -21,75 +73,89 @@ async def refresh_leaderboard():
     if not is_redis_available():
         return
 
+    start = time.perf_counter()
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-        result = (
+        supabase = db.service_client() or await db.get_client()
+        result = await db.execute(
             supabase.table("profiles")
             .select("id, display_name, avatar_url, xp, teaching_xp, room_coins")
             .order("xp", desc=True)
-            .limit(50)
-            .execute()
+            .limit(LEADERBOARD_DEPTH)
         )
 
         if not result.data:
             return
 
-        redis = await get_redis()
+        version = _version(result.data)
 
-        # Clear old data
-        await redis.delete(LEADERBOARD_KEY)
-        await redis.delete(LEADERBOARD_DATA_KEY)
+        # Unchanged since the last rebuild: keep the live keys, just extend them
+        pipe = pipeline()
+        pipe.get(LEADERBOARD_VERSION_KEY)
+        pipe.expire(LEADERBOARD_KEY, CACHE_TTL)
+        pipe.expire(LEADERBOARD_DATA_KEY, CACHE_TTL)
+        pipe.expire(LEADERBOARD_VERSION_KEY, CACHE_TTL)
+        live_version, *extended = await pipe.exec()
+        if live_version == version and all(extended):
+            refreshes.labels("unchanged").inc()
+            return
+
+        staging_key = f"{LEADERBOARD_KEY}:{version}"
+        staging_data_key = f"{LEADERBOARD_DATA_KEY}:{version}"
+
+        # Stage the new board and swap it in, all in one atomic round-trip
+        pipe = pipeline(transaction=True)
+        pipe.delete(staging_key, staging_data_key)
 
         # Store in sorted set (score = XP) and hash (profile metadata)
-        for user in result.data:
-            await redis.zadd(LEADERBOARD_KEY, {user["id"]: user.get("xp", 0)})
-            await redis.hset(
-                LEADERBOARD_DATA_KEY,
-                user["id"],
-                json.dumps({
-                    "display_name": user.get("display_name", ""),
-                    "avatar_url": user.get("avatar_url", ""),
-                    "xp": user.get("xp", 0),
-                    "teaching_xp": user.get("teaching_xp", 0),
-                    "room_coins": user.get("room_coins", 0),
-                }),
-            )
-
-        # Set TTL
-        await redis.expire(LEADERBOARD_KEY, CACHE_TTL)
-        await redis.expire(LEADERBOARD_DATA_KEY, CACHE_TTL)
-
-        print("📊 Leaderboard cache refreshed")
+        pipe.zadd(staging_key, {user["id"]: user.get("xp", 0) for user in result.data})
+        pipe.hset(
+            staging_data_key,
+            values={user["id"]: json.dumps(_entry(user)) for user in result.data},
+        )
+
+        pipe.rename(staging_key, LEADERBOARD_KEY)
+        pipe.rename(staging_data_key, LEADERBOARD_DATA_KEY)
+        pipe.set(LEADERBOARD_VERSION_KEY, version, ex=CACHE_TTL)
+
+        # Set TTL (RENAME carries over the staging keys' lack of one)
+        pipe.expire(LEADERBOARD_KEY, CACHE_TTL)
+        pipe.expire(LEADERBOARD_DATA_KEY, CACHE_TTL)
+
+        await pipe.exec()
+
+        _l1.clear()
+        refreshes.labels("rebuilt").inc()
+        print(f"📊 Leaderboard cache refreshed ({len(result.data)} users, {version})")
     except Exception as e:
+        refreshes.labels("error").inc()
         print(f"Leaderboard refresh error: {e}")
+    finally:
+        refresh_seconds.observe(time.perf_counter() - start)
 
 
 async def get_cached_leaderboard(limit: int = 10) -> list[dict] | None:
     """
     Get leaderboard from Redis cache.
-    Returns None if cache miss (caller should fall back to Supabase).
+    Returns None if cache miss or limit is deeper than the cache (caller should
+    fall back to Supabase).
     """
-    if not is_redis_available():
+    if not is_redis_available() or limit > LEADERBOARD_DEPTH:
         return None
 
     try:
         redis = await get_redis()
 
-        # Check if cache exists
-        exists = await redis.exists(LEADERBOARD_KEY)
-        if not exists:
-            return None
-
-        # Get top user IDs by score (descending)
+        # Get top user IDs by score (descending); empty if the cache has expired
         top_ids = await redis.zrange(LEADERBOARD_KEY, 0, limit - 1, rev=True)
 
         if not top_ids:
             return None
 
-        # Fetch profile data for each
+        # Fetch profile data for all of them in one call
+        rows = await redis.hmget(LEADERBOARD_DATA_KEY, *top_ids)
+
         leaderboard = []
-        for user_id in top_ids:
-            raw = await redis.hget(LEADERBOARD_DATA_KEY, user_id)
+        for user_id, raw in zip(top_ids, rows):
             if raw:
                 data = json.loads(raw)
                 data["id"] = user_id
@@ -102,15 +168,93 @@ async def get_cached_leaderboard(limit: int = 10) -> list[dict] | None:
         return None
 
 
+async def _audience(authorization: str | None) -> tuple[str, str | None]:
+    """
+    Which view of the profiles a caller gets, and the authorization to load it with:
+    one for everyone with a service-role key, else "signed-in" (verified token) or "anonymous".
+    """
+    if SUPABASE_SERVICE_ROLE_KEY:
+        return "service", None
+    if authorization and authorization.startswith("Bearer "):
+        if await auth.verify_token(authorization.split(" ")[1]):
+            return "signed-in", authorization
+    return "anonymous", None
+
+
+async def _load(key: tuple[int, str], authorization: str | None) -> tuple[list[dict], str]:
+    """Top `depth` users from Redis, or from Supabase on a Redis miss."""
+    depth = key[0]
+    cached = await get_cached_leaderboard(depth)
+    if cached:
+        lookups.labels("redis", "hit").inc()
+        source = "cache"
+    else:
+        lookups.labels("redis", "miss").inc()
+        supabase = db.service_client() or await db.get_client(authorization)
+        result = await db.execute(
+            supabase.table("profiles")
+            .select("id, display_name, avatar_url, xp, teaching_xp, room_coins")
+            .order("xp", desc=True)
+            .limit(depth)
+        )
+        cached, source = result.data or [], "database"
+    if cached:
+        # An empty read (e.g. an anonymous caller under RLS) is not kept for others
+        _l1[key] = (time.monotonic() + LEADERBOARD_L1_TTL, cached, source)
+    return cached, source
+
+
+async def get_leaderboard(limit: int = 10, authorization: str | None = None) -> tuple[list[dict], str]:
+    """
+    Top users by XP and where they came from ("cache" or "database").
+    limit is capped at LEADERBOARD_DEPTH, and every limit is cut from one
+    full-depth copy, so they all share the same L1 entry and the same load.
+    authorization is the caller's header, used for Supabase only without a
+    service-role key; signed-in and anonymous callers then never share a load.
+    """
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    limit = min(limit, LEADERBOARD_DEPTH)
+    audience, authorization = await _audience(authorization)
+    key = (LEADERBOARD_DEPTH, audience)
+    entry = _l1.get(key)
+    if entry and entry[0] > time.monotonic():
+        lookups.labels("l1", "hit").inc()
+        return entry[1][:limit], entry[2]
+    lookups.labels("l1", "miss").inc()
+
+    task = _loads.get(key)
+    if task is None:
+        task = _loads[key] = asyncio.create_task(_load(key, authorization))
+        task.add_done_callback(lambda _: _loads.pop(key, None))
+    else:
+        stampedes.inc()
+    # Shielded so a caller that disconnects does not cancel the others' load
+    rows, source = await asyncio.shield(task)
+    return rows[:limit], source
+
+
 async def invalidate_user_xp(user_id: str, new_xp: int):
     """
-    Update a single user's XP in the cache without full refresh.
+    Update a cached user's XP (rank and profile data) without a full refresh.
+    Users not on the cached board are left out (it has no profile data for them).
+    The version key is dropped either way, so the next refresh rebuilds the board
+    rather than keeping it as unchanged, and picks up anyone who climbed into it.
     """
+    _l1.clear()
     if not is_redis_available():
         return
 
     try:
         redis = await get_redis()
-        await redis.zadd(LEADERBOARD_KEY, {user_id: new_xp})
-    except Exception:
-        pass
+        raw = await redis.hget(LEADERBOARD_DATA_KEY, user_id)
+        pipe = pipeline(transaction=True)
+        if raw:
+            data = json.loads(raw)
+            data["xp"] = new_xp
+            pipe.zadd(LEADERBOARD_KEY, {user_id: new_xp}, xx=True)
+            pipe.hset(LEADERBOARD_DATA_KEY, user_id, json.dumps(data))
+        pipe.delete(LEADERBOARD_VERSION_KEY)
+        await pipe.exec()
+    except Exception as e:
+        print(f"Leaderboard cache update error: {e}")
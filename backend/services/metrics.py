@@ -0,0 +1,222 @@
+"""
+Lightweight in-process metrics for BondBox.
+Counters and histograms are plain Python objects updated inline on hot paths,
+so recording a sample is a dict lookup and an addition. Gauges either hold a
+value that is set inline, or read it from a callback only when scraped.
+
+render() formats everything in the Prometheus text format for GET /metrics;
+all of the formatting cost is paid by the scrape, none by the hot paths.
+"""
+
+import bisect
+import math
+from typing import Dict
+
+# Default latency buckets in seconds (1 ms .. 5 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[tuple, object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Get (or create) the child for a label combination. Cache it on hot paths."""
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = self._new_child()
+        return child
+
+    def collect(self) -> Dict[tuple, object]:
+        """Current children by label values, read at scrape time."""
+        return self.children
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), fn=None):
+        """
+        fn, if given, is called on every scrape and returns the value, or for a
+        labelled gauge a {label values tuple: value} dict.
+        """
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def collect(self) -> Dict[tuple, object]:
+        if self.fn is not None:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+            self.children = {}
+            for key, value in values.items():
+                self.labels(*key).set(value)
+        return self.children
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+REGISTRY: Dict[str, _Metric] = {}
+
+
+def counter(name: str, help: str, labelnames: tuple = ()) -> Counter:
+    """Get or register a counter."""
+    if name not in REGISTRY:
+        REGISTRY[name] = Counter(name, help, labelnames)
+    return REGISTRY[name]
+
+
+def gauge(name: str, help: str, labelnames: tuple = (), fn=None) -> Gauge:
+    """Get or register a gauge, optionally computed by fn at scrape time."""
+    if name not in REGISTRY:
+        REGISTRY[name] = Gauge(name, help, labelnames, fn)
+    return REGISTRY[name]
+
+
+def histogram(name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    """Get or register a histogram."""
+    if name not in REGISTRY:
+        REGISTRY[name] = Histogram(name, help, labelnames, buckets)
+    return REGISTRY[name]
+
+
+def snapshot() -> dict:
+    """Current values of every registered metric, for debugging and tests."""
+    result = {}
+    for name, metric in REGISTRY.items():
+        series = {}
+        for key, child in metric.collect().items():
+            label = ",".join(f"{k}={v}" for k, v in zip(metric.labelnames, key))
+            if not isinstance(child, _HistogramChild):
+                series[label] = child.value
+            else:
+                series[label] = {"count": child.count, "sum": child.sum}
+        result[name] = series
+    return result
+
+
+def _format_value(value: float) -> str:
+    if math.isfinite(value) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for name, metric in REGISTRY.items():
+        try:
+            series = metric.collect()
+        except Exception as e:
+            print(f"Metric collection error ({name}): {e}")
+            continue
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, child in series.items():
+            labels = _labels(metric.labelnames, key)
+            if isinstance(child, _HistogramChild):
+                cumulative = 0
+                for bound, count in zip(child.buckets, child.counts):
+                    cumulative += count
+                    le = _labels(metric.labelnames, key, f'le="{_format_value(bound)}"')
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = _labels(metric.labelnames, key, 'le="+Inf"')
+                lines.append(f"{name}_bucket{le} {child.count}")
+                lines.append(f"{name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{name}_count{labels} {child.count}")
+            else:
+                lines.append(f"{name}{labels} {_format_value(child.value)}")
+    return "\n".join(lines) + "\n"
@@ -1,79 +1,198 @@
 """
 Presence tracking service using Upstash Redis REST API.
-Tracks which users are online in each room with heartbeat-based TTL.
+Tracks which users are online in each room with heartbeat-based expiry.
+
+Keys:
+- presence:{room_id}     hash user_id -> display_name, the room's online members
+- presence:last_seen     sorted set "{room_id}|{user_id}" -> last heartbeat (unix time)
+- user_rooms:{user_id}   set of rooms the user is in
+- online:{user_id}       global online flag, expires without heartbeats
+- typing:{room_id}:{user_id}  set while the user is typing, expires after TYPING_TTL
+
+Each member expires on their own: sweep() takes the members whose last
+heartbeat is older than HEARTBEAT_TTL from the front of presence:last_seen, so
+its cost grows with the number of expired members, not the number online. Key
+TTLs are kept as a safety net for when no worker is sweeping.
+
+Heartbeats and typing state reach Redis through services.presence_writer,
+which gathers them per worker and writes them with write_batch().
 """
 
-from services.redis_client import get_redis, is_redis_available
+import time
 
-HEARTBEAT_TTL = 90  # seconds — room presence expires if no heartbeat
+from config import PRESENCE_SWEEP_BATCH, PRESENCE_SWEEP_INTERVAL
+from services import metrics
+from services.redis_client import get_redis, is_redis_available, pipeline
 
+HEARTBEAT_TTL = 90  # seconds — a member expires if no heartbeat
+TYPING_TTL = 3  # seconds — a typing flag expires if no typing-stop arrives
+LAST_SEEN_KEY = "presence:last_seen"
+SWEEP_LOCK_KEY = "presence:sweep_lock"
 
-async def join_room(room_id: str, user_id: str, display_name: str) -> list[str]:
+swept = metrics.counter(
+    "presence_swept_members_total", "Room members evicted after missing heartbeats"
+)
+
+
+def _member(room_id: str, user_id: str) -> str:
+    return f"{room_id}|{user_id}"
+
+
+async def join_room(room_id: str, user_id: str, display_name: str):
     """
     Mark a user as online in a room.
-    Returns list of currently online user_ids.
+    Room members learn about it from the WebSocket roster, not from here.
     """
     if not is_redis_available():
-        return []
+        return
 
     try:
-        redis = await get_redis()
+        pipe = pipeline()
 
         # Add user to room presence hash
-        await redis.hset(f"presence:{room_id}", user_id, display_name)
-        await redis.expire(f"presence:{room_id}", HEARTBEAT_TTL)
+        pipe.hset(f"presence:{room_id}", user_id, display_name)
+        pipe.expire(f"presence:{room_id}", HEARTBEAT_TTL)
 
         # Track which rooms this user is in
-        await redis.sadd(f"user_rooms:{user_id}", room_id)
+        pipe.sadd(f"user_rooms:{user_id}", room_id)
+        pipe.expire(f"user_rooms:{user_id}", HEARTBEAT_TTL)
 
         # Mark user globally online
-        await redis.set(f"online:{user_id}", "1", ex=HEARTBEAT_TTL)
+        pipe.set(f"online:{user_id}", "1", ex=HEARTBEAT_TTL)
+        pipe.zadd(LAST_SEEN_KEY, {_member(room_id, user_id): time.time()})
 
-        # Return current online users
-        return await get_online_users(room_id)
+        await pipe.exec()
     except Exception as e:
         print(f"Presence join error: {e}")
-        return []
 
 
-async def leave_room(room_id: str, user_id: str) -> list[str]:
+async def leave_room(room_id: str, user_id: str):
     """
     Mark a user as offline in a room.
-    Returns remaining online user_ids.
     """
     if not is_redis_available():
-        return []
+        return
 
     try:
-        redis = await get_redis()
-
-        await redis.hdel(f"presence:{room_id}", user_id)
-        await redis.srem(f"user_rooms:{user_id}", room_id)
+        pipe = pipeline()
+        pipe.hdel(f"presence:{room_id}", user_id)
+        pipe.srem(f"user_rooms:{user_id}", room_id)
+        pipe.zrem(LAST_SEEN_KEY, _member(room_id, user_id))
 
         # Check if user is in any other rooms
-        remaining = await redis.scard(f"user_rooms:{user_id}")
+        pipe.scard(f"user_rooms:{user_id}")
+
+        *_, remaining = await pipe.exec()
         if remaining == 0:
+            redis = await get_redis()
             await redis.delete(f"online:{user_id}")
-
-        return await get_online_users(room_id)
     except Exception as e:
         print(f"Presence leave error: {e}")
-        return []
 
 
-async def heartbeat(room_id: str, user_id: str):
+async def write_batch(
+    heartbeats: dict[tuple[str, str], str], typing: dict[tuple[str, str], str | None]
+) -> int:
+    """
+    Write many heartbeats and typing changes in one round-trip.
+    heartbeats: (room_id, user_id) -> display_name
+    typing: (room_id, user_id) -> display_name while typing, None once stopped
+    Members in the same room share one HSET, and every key's TTL is refreshed
+    once however many heartbeats touched it. Returns the number of commands sent.
     """
-    Refresh presence TTL. Should be called every ~30 seconds by the client.
+    if not is_redis_available() or not (heartbeats or typing):
+        return 0
+
+    pipe = pipeline()
+    commands = 0
+    if heartbeats:
+        now = time.time()
+        rooms: dict[str, dict[str, str]] = {}
+        users: dict[str, list[str]] = {}
+        for (room_id, user_id), display_name in heartbeats.items():
+            rooms.setdefault(room_id, {})[user_id] = display_name
+            users.setdefault(user_id, []).append(room_id)
+
+        pipe.zadd(LAST_SEEN_KEY, {_member(room_id, user_id): now for room_id, user_id in heartbeats})
+        commands += 1
+        for room_id, names in rooms.items():
+            pipe.hset(f"presence:{room_id}", values=names)
+            pipe.expire(f"presence:{room_id}", HEARTBEAT_TTL)
+            commands += 2
+        for user_id, room_ids in users.items():
+            pipe.sadd(f"user_rooms:{user_id}", *room_ids)
+            pipe.expire(f"user_rooms:{user_id}", HEARTBEAT_TTL)
+            pipe.expire(f"online:{user_id}", HEARTBEAT_TTL)
+            commands += 3
+
+    stopped = []
+    for (room_id, user_id), display_name in typing.items():
+        if display_name is None:
+            stopped.append(f"typing:{room_id}:{user_id}")
+        else:
+            pipe.set(f"typing:{room_id}:{user_id}", display_name, ex=TYPING_TTL)
+            commands += 1
+    if stopped:
+        pipe.delete(*stopped)
+        commands += 1
+
+    await pipe.exec()
+    return commands
+
+
+async def sweep() -> dict[str, list[str]]:
+    """
+    Evict members whose last heartbeat is older than HEARTBEAT_TTL, in batches.
+    Only one worker sweeps per interval. Returns {room_id: evicted user_ids}, so the
+    caller can drop them from the WebSocket rosters.
     """
     if not is_redis_available():
-        return
+        return {}
 
-    try:
-        redis = await get_redis()
-        await redis.expire(f"presence:{room_id}", HEARTBEAT_TTL)
-        await redis.expire(f"online:{user_id}", HEARTBEAT_TTL)
-    except Exception as e:
-        print(f"Heartbeat error: {e}")
+    redis = await get_redis()
+    if not await redis.set(SWEEP_LOCK_KEY, "1", nx=True, ex=max(1, int(PRESENCE_SWEEP_INTERVAL))):
+        return {}
+
+    changed: dict[str, list[str]] = {}
+    cutoff = time.time() - HEARTBEAT_TTL
+    while True:
+        stale = await redis.zrange(
+            LAST_SEEN_KEY, "-inf", cutoff, sortby="BYSCORE", offset=0, count=PRESENCE_SWEEP_BATCH
+        )
+        if not stale:
+            break
+
+        rooms: dict[str, list[str]] = {}
+        users: dict[str, list[str]] = {}
+        for member in stale:
+            room_id, _, user_id = member.partition("|")
+            rooms.setdefault(room_id, []).append(user_id)
+            users.setdefault(user_id, []).append(room_id)
+
+        pipe = pipeline()
+        pipe.zrem(LAST_SEEN_KEY, *stale)
+        for room_id, user_ids in rooms.items():
+            pipe.hdel(f"presence:{room_id}", *user_ids)
+        for user_id, room_ids in users.items():
+            pipe.srem(f"user_rooms:{user_id}", *room_ids)
+        for user_id in users:
+            pipe.scard(f"user_rooms:{user_id}")
+        results = await pipe.exec()
+
+        remaining = results[len(results) - len(users):]
+        for room_id, user_ids in rooms.items():
+            changed.setdefault(room_id, []).extend(user_ids)
+
+        # Users left in no room at all are no longer online
+        offline = [user_id for user_id, count in zip(users, remaining) if count == 0]
+        if offline:
+            await redis.delete(*[f"online:{user_id}" for user_id in offline])
+
+        swept.inc(len(stale))
+        if len(stale) < PRESENCE_SWEEP_BATCH:
+            break
+
+    return changed
 
 
 async def get_online_users(room_id: str) -> list[str]:
@@ -89,6 +208,21 @@ async def get_online_users(room_id: str) -> list[str]:
         return []
 
 
+async def get_online_counts(room_ids: list[str]) -> dict[str, int]:
+    """Online user count per room, for many rooms in one round-trip."""
+    if not room_ids or not is_redis_available():
+        return {}
+
+    try:
+        pipe = pipeline()
+        for room_id in room_ids:
+            pipe.hlen(f"presence:{room_id}")
+        return dict(zip(room_ids, await pipe.exec()))
+    except Exception as e:
+        print(f"Presence count error: {e}")
+        return {}
+
+
 async def get_online_users_with_names(room_id: str) -> dict[str, str]:
     """Get dict of {user_id: display_name} for online users in a room."""
     if not is_redis_available():
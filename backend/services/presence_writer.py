@@ -0,0 +1,157 @@
+"""
+Coalesced presence writes.
+Heartbeats and typing-start/typing-stop mark a (room, user) dirty instead of
+writing to Redis straight away. Once per PRESENCE_FLUSH_INTERVAL everything
+dirty on this worker goes out in one pipeline (presence.write_batch), so a
+worker makes one Redis round-trip per interval however many users it holds.
+
+Typing broadcasts are debounced here too: a typing-start from someone already
+shown as typing is only re-broadcast once TYPING_DEBOUNCE has passed, and a
+typing-stop is only broadcast for someone shown as typing.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+from config import PRESENCE_FLUSH_INTERVAL, TYPING_DEBOUNCE
+from services import metrics
+from services import presence as presence_service
+from services.redis_client import is_redis_available
+from services.websocket_manager import ConnectionManager, manager
+
+OPS_WINDOW = 60.0  # seconds of flushes behind redis_ops_per_user_per_minute
+
+flushes = metrics.counter(
+    "presence_flushes_total", "Batched presence writes sent to Redis (one round-trip each)"
+)
+redis_commands = metrics.counter(
+    "presence_redis_commands_total", "Redis commands sent by batched presence writes"
+)
+updates = metrics.counter(
+    "presence_updates_total", "Heartbeats and typing changes received, by kind", ("kind",)
+)
+suppressed = metrics.counter(
+    "typing_broadcasts_suppressed_total", "typing-start/typing-stop broadcasts skipped by the debounce"
+)
+
+_heartbeat_updates = updates.labels("heartbeat")
+_typing_updates = updates.labels("typing")
+
+
+class PresenceWriter:
+    """Per-worker buffer of heartbeats and typing state, flushed on an interval."""
+
+    def __init__(self, connections: ConnectionManager, interval: float = PRESENCE_FLUSH_INTERVAL):
+        self.connections = connections
+        self.interval = interval
+        # (room_id, user_id) -> display_name
+        self._heartbeats: dict[tuple[str, str], str] = {}
+        # (room_id, user_id) -> display_name, or None to clear the typing flag
+        self._typing: dict[tuple[str, str], str | None] = {}
+        # (room_id, user_id) -> when typing-start was last broadcast
+        self._typing_since: dict[tuple[str, str], float] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        # (flushed_at, commands) for the last OPS_WINDOW seconds
+        self._recent: deque[tuple[float, int]] = deque()
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._flush_due)
+
+    def heartbeat(self, room_id: str, user_id: str, display_name: str):
+        """Record a heartbeat; it reaches Redis with the next flush."""
+        _heartbeat_updates.inc()
+        if is_redis_available():
+            self._heartbeats[(room_id, user_id)] = display_name
+            self._schedule()
+
+    def typing(self, room_id: str, user_id: str, display_name: str, active: bool) -> bool:
+        """
+        Record a typing-start (active) or typing-stop.
+        Returns whether it should be broadcast to the room.
+        """
+        _typing_updates.inc()
+        key = (room_id, user_id)
+        now = time.monotonic()
+
+        if active:
+            # A repeat still refreshes the typing flag's TTL, it just is not re-broadcast
+            since = self._typing_since.get(key)
+            broadcast = since is None or now - since >= TYPING_DEBOUNCE
+            if broadcast:
+                self._typing_since[key] = now
+        else:
+            broadcast = self._typing_since.pop(key, None) is not None
+            if not broadcast:
+                suppressed.inc()
+                return False
+
+        if not broadcast:
+            suppressed.inc()
+        if is_redis_available():
+            self._typing[key] = display_name if active else None
+            self._schedule()
+        return broadcast
+
+    def forget(self, room_id: str, user_id: str):
+        """
+        Drop anything pending for a member who left, so a late flush cannot
+        put them back after presence.leave_room.
+        """
+        key = (room_id, user_id)
+        self._heartbeats.pop(key, None)
+        was_typing = self._typing_since.pop(key, None) is not None
+        if was_typing and is_redis_available():
+            self._typing[key] = None
+            self._schedule()
+
+    def _flush_due(self):
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Write everything pending now (every interval, and on shutdown)."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        heartbeats, self._heartbeats = self._heartbeats, {}
+        typing, self._typing = self._typing, {}
+        if not heartbeats and not typing:
+            return
+
+        try:
+            commands = await presence_service.write_batch(heartbeats, typing)
+        except Exception as e:
+            # Presence keys outlive a missed flush (HEARTBEAT_TTL), typing flags expire on their own
+            print(f"Presence flush error: {e}")
+            return
+
+        if commands:
+            flushes.inc()
+            redis_commands.inc(commands)
+            self._recent.append((time.monotonic(), commands))
+            self._trim()
+
+    def _trim(self):
+        cutoff = time.monotonic() - OPS_WINDOW
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+
+    def stats(self) -> dict:
+        self._trim()
+        users = sum(len(peers) for peers in self.connections.rooms.values())
+        commands = sum(count for _, count in self._recent)
+        return {
+            "connected_users": users,
+            "flushes_per_minute": len(self._recent),
+            "redis_ops_per_minute": commands,
+            "redis_ops_per_user_per_minute": round(commands / users, 2) if users else 0.0,
+            "pending": len(self._heartbeats) + len(self._typing),
+        }
+
+
+presence_writer = PresenceWriter(manager)
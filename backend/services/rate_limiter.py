@@ -1,15 +1,23 @@
 """
-Rate limiter middleware using Upstash Redis REST API.
-Uses sliding window pattern with sorted sets.
-Gracefully degrades to no rate limiting if Redis is unavailable.
+Rate limiter middleware.
+Two tiers: every decision is made in-process with GCRA (generic cell rate algorithm,
+a token bucket tracked as one "theoretical arrival time" per client), and each
+worker pushes its usage to Upstash Redis in batches so the limit holds across
+workers. Without Redis the local tier still limits, per worker.
 """
 
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
+import asyncio
+import hashlib
+import math
 import time
+from typing import Dict
 
-from services.redis_client import get_redis, is_redis_available
+from config import RATE_LIMIT_MAX_KEYS, RATE_LIMIT_SYNC_MS
+from services import metrics
+from services.redis_client import is_redis_available, pipeline
 
 
 # Rate limit configs: (max_requests, window_seconds)
@@ -20,6 +28,16 @@ RATE_LIMITS = {
     "leaderboard": (30, 60),     # 30 req/min for leaderboard
 }
 
+# Health checks, and the Supabase webhook (one source IP, bursts on bulk updates)
+EXEMPT_PATHS = {"/api/health", "/api/users/xp-events", "/metrics"}
+
+decisions = metrics.counter(
+    "rate_limit_decisions_total", "Rate limiter decisions", ("class", "result")
+)
+syncs = metrics.counter(
+    "rate_limit_syncs_total", "Batched usage syncs to Redis", ("result",)
+)
+
 
 def _get_rate_limit_config(path: str, method: str) -> tuple[str, int, int]:
     """Determine rate limit config based on the request path."""
@@ -39,75 +57,183 @@ def _get_rate_limit_config(path: str, method: str) -> tuple[str, int, int]:
     return key_prefix, max_req, window
 
 
+def _client_id(request: Request) -> str:
+    """Identify the client. Stable across workers and restarts (unlike hash())."""
+    auth_header = request.headers.get("authorization", "")
+    if auth_header.startswith("Bearer "):
+        return f"user:{hashlib.sha256(auth_header.encode()).hexdigest()[:20]}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+class _Bucket:
+    """GCRA state for one client in one rate limit class."""
+
+    __slots__ = ("window", "interval", "tat", "pending", "seen", "window_id")
+
+    def __init__(self, max_requests: int, window: int):
+        self.window = window
+        # One request "costs" this much of the window
+        self.interval = window / max_requests
+        # Theoretical arrival time: when the bucket would be empty again
+        self.tat = 0.0
+        # Requests allowed here since the last sync
+        self.pending = 0
+        # Shared count last read from Redis, and the fixed window it belongs to
+        self.seen = 0
+        self.window_id = -1
+
+
+class RateLimiter:
+    """In-process GCRA buckets with periodic, batched usage sync through Redis."""
+
+    def __init__(self, sync_ms: int = RATE_LIMIT_SYNC_MS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.sync_interval = sync_ms / 1000
+        self.max_keys = max_keys
+        self.buckets: Dict[str, _Bucket] = {}
+        self._sync_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def check(self, key: str, max_requests: int, window: int, now: float | None = None) -> tuple[bool, int, float]:
+        """
+        Count one request against a bucket.
+        Returns (allowed, remaining, seconds): seconds is when the bucket resets if
+        allowed, or how long to wait if not. Rejected requests cost nothing.
+        """
+        now = time.time() if now is None else now
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._evict(now)
+            bucket = self.buckets[key] = _Bucket(max_requests, window)
+
+        new_tat = max(bucket.tat, now) + bucket.interval
+        if new_tat - now > window + 1e-9:
+            return False, 0, new_tat - window - now
+
+        bucket.tat = new_tat
+        bucket.pending += 1
+        self._schedule_sync()
+        remaining = int((window - (new_tat - now)) / bucket.interval + 1e-9)
+        return True, remaining, new_tat - now
+
+    def _evict(self, now: float):
+        """Forget buckets that have fully drained; if still over the cap, the oldest."""
+        for key in [k for k, b in self.buckets.items() if b.tat <= now and not b.pending]:
+            del self.buckets[key]
+        while len(self.buckets) >= self.max_keys:
+            del self.buckets[next(iter(self.buckets))]
+
+    def _schedule_sync(self):
+        if self._sync_handle is None:
+            loop = asyncio.get_running_loop()
+            self._sync_handle = loop.call_later(self.sync_interval, self._sync_due)
+
+    def _sync_due(self):
+        self._sync_handle = None
+        task = asyncio.create_task(self.sync())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def sync(self):
+        """
+        Push local usage to Redis and pull in what other workers used, in one round-trip.
+        Usage is kept as a fixed-window counter per bucket; whatever other workers
+        added since the last sync advances the local bucket by the same amount.
+        """
+        if self._sync_handle:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+
+        now = time.time()
+        if len(self.buckets) >= self.max_keys:
+            self._evict(now)
+        active = [(key, b, b.pending) for key, b in self.buckets.items() if b.pending or b.tat > now]
+        # Pending usage stays on the bucket until Redis has taken it
+        if not active or not is_redis_available():
+            return
+
+        # Buckets with new usage add it; draining ones only read what others added
+        pipe = pipeline()
+        for key, bucket, pending in active:
+            redis_key = f"rate:{key}:{int(now // bucket.window)}"
+            if pending:
+                pipe.incrby(redis_key, pending)
+                pipe.expire(redis_key, bucket.window + 1)
+            else:
+                pipe.get(redis_key)
+
+        try:
+            results = await pipe.exec()
+        except Exception as e:
+            syncs.labels("error").inc()
+            print(f"Rate limiter sync error: {e}")
+            return
+        syncs.labels("ok").inc()
+
+        i = 0
+        for _, bucket, pending in active:
+            total = int(results[i] or 0)
+            i += 2 if pending else 1
+            bucket.pending -= pending
+            window_id = int(now // bucket.window)
+            seen = bucket.seen if bucket.window_id == window_id else 0
+            others = total - seen - pending
+            bucket.seen, bucket.window_id = total, window_id
+            if others > 0:
+                bucket.tat = min(max(bucket.tat, now) + others * bucket.interval, now + bucket.window)
+
+    def stats(self) -> dict:
+        return {
+            "tracked_clients": len(self.buckets),
+            "pending": sum(b.pending for b in self.buckets.values()),
+        }
+
+
+limiter = RateLimiter()
+
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     """
-    Sliding window rate limiter using Upstash Redis sorted sets.
-    Falls back to no rate limiting if Redis is unavailable.
+    Local-first GCRA rate limiter.
+    Decisions never wait on Redis; usage is synced to it in the background.
     """
 
     async def dispatch(self, request: Request, call_next):
-        # Skip rate limiting for health checks and WebSocket upgrades
-        if request.url.path == "/api/health" or request.url.path.startswith("/ws/"):
-            return await call_next(request)
-
-        # Skip if Redis not available (graceful degradation)
-        if not is_redis_available():
+        # Skip rate limiting for health checks, webhooks and WebSocket upgrades
+        if request.url.path in EXEMPT_PATHS or request.url.path.startswith("/ws/"):
             return await call_next(request)
 
-        # Identify the client
-        auth_header = request.headers.get("authorization", "")
-        if auth_header.startswith("Bearer "):
-            client_id = f"user:{hash(auth_header) % 10**10}"
-        else:
-            client_id = f"ip:{request.client.host if request.client else 'unknown'}"
-
         key_prefix, max_requests, window = _get_rate_limit_config(
             request.url.path, request.method
         )
-        redis_key = f"rate:{key_prefix}:{client_id}"
-
-        try:
-            redis = await get_redis()
-            now = time.time()
-            window_start = now - window
-
-            # Remove expired entries
-            await redis.zremrangebyscore(redis_key, 0, window_start)
-            # Count current entries
-            current_count = await redis.zcard(redis_key)
-            # Add current request
-            await redis.zadd(redis_key, {str(now): now})
-            # Set key expiry
-            await redis.expire(redis_key, window)
-
-            if current_count >= max_requests:
-                retry_after = window
-
-                return JSONResponse(
-                    status_code=429,
-                    content={
-                        "detail": "Too many requests",
-                        "retry_after": retry_after,
-                    },
-                    headers={
-                        "Retry-After": str(retry_after),
-                        "X-RateLimit-Limit": str(max_requests),
-                        "X-RateLimit-Remaining": "0",
-                        "X-RateLimit-Reset": str(int(now + retry_after)),
-                    },
-                )
-
-            response = await call_next(request)
-
-            # Add rate limit headers to response
-            remaining = max(0, max_requests - current_count - 1)
-            response.headers["X-RateLimit-Limit"] = str(max_requests)
-            response.headers["X-RateLimit-Remaining"] = str(remaining)
-            response.headers["X-RateLimit-Reset"] = str(int(now + window))
-
-            return response
-
-        except Exception as e:
-            # If Redis fails mid-request, let it through
-            print(f"Rate limiter error: {e}")
-            return await call_next(request)
+        now = time.time()
+        allowed, remaining, seconds = limiter.check(
+            f"{key_prefix}:{_client_id(request)}", max_requests, window, now
+        )
+        decisions.labels(key_prefix, "allowed" if allowed else "limited").inc()
+
+        if not allowed:
+            retry_after = max(1, math.ceil(seconds))
+
+            return JSONResponse(
+                status_code=429,
+                content={
+                    "detail": "Too many requests",
+                    "retry_after": retry_after,
+                },
+                headers={
+                    "Retry-After": str(retry_after),
+                    "X-RateLimit-Limit": str(max_requests),
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": str(int(now + retry_after)),
+                },
+            )
+
+        response = await call_next(request)
+
+        # Add rate limit headers to response
+        response.headers["X-RateLimit-Limit"] = str(max_requests)
+        response.headers["X-RateLimit-Remaining"] = str(remaining)
+        response.headers["X-RateLimit-Reset"] = str(int(now + seconds))
+
+        return response
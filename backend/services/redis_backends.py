@@ -0,0 +1,547 @@
+"""
+Redis backends: where the commands sent through services.redis_client end up.
+
+Callers always get the same client, upstash_redis's async command API (typed
+methods, pipeline(), multi()), so presence, the rate limiter and the leaderboard
+cache are written once. What differs is the transport underneath it. A transport
+takes one command, or a list of commands for a pipeline, and returns raw Redis
+replies (strings, integers, lists, None). The client then formats those replies
+exactly as it formats Upstash's, so every backend returns the same Python values.
+
+- upstash: the client's own HTTPS transport, one request per command or batch
+- resp:    native Redis over TCP (REDIS_URL). A blocking pool of REDIS_POOL_SIZE
+           connections; a batch is written in one go, transactions use MULTI/EXEC
+- memory:  an in-process keyspace with expiry, for a single worker or development.
+           Nothing is shared between workers and nothing survives a restart
+
+As with Upstash, a batch runs to the end and then raises UpstashError for the
+first command that failed.
+"""
+
+import asyncio
+import fnmatch
+import inspect
+import itertools
+import json
+import math
+import time
+
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+from sortedcontainers import SortedList
+from upstash_redis.asyncio import Redis as AsyncRedis
+from upstash_redis.errors import UpstashError
+
+BACKENDS = ("upstash", "resp", "memory")
+
+
+def _raw(arg) -> bytes:
+    """A non-str command argument as Upstash sends it: numbers as-is, anything else as JSON."""
+    if isinstance(arg, (int, float)) and not isinstance(arg, bool):
+        return repr(arg).encode()
+    return json.dumps(arg).encode()
+
+
+def _raise_first_error(results: list) -> list:
+    for result in results:
+        if isinstance(result, Exception):
+            raise UpstashError(str(result))
+    return results
+
+
+def _score_bound(text: str, upper: bool) -> float:
+    """
+    A score bound ("5", "(5", "-inf", "+inf") as a cut point: the scores in range
+    are those >= the lower cut and < the upper cut.
+    """
+    exclusive = text.startswith("(")
+    text = text.lstrip("(")
+    value = {"-inf": -math.inf, "+inf": math.inf, "inf": math.inf}.get(text)
+    value = float(text) if value is None else value
+    return math.nextafter(value, math.inf) if exclusive != upper else value
+
+
+def _limit(opts: list[str]) -> tuple[int, int] | None:
+    """LIMIT offset count from upper-cased options, or None."""
+    if "LIMIT" not in opts:
+        return None
+    i = opts.index("LIMIT")
+    if len(opts) < i + 3:
+        raise ValueError("ERR syntax error")
+    return int(opts[i + 1]), int(opts[i + 2])
+
+
+class _ZSet:
+    """Sorted set: member -> score, plus members ordered by (score, member) for O(log n) ranks."""
+
+    __slots__ = ("scores", "order")
+
+    def __init__(self):
+        self.scores: dict[str, float] = {}
+        self.order = SortedList()
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self, member: str, score: float):
+        old = self.scores.get(member)
+        if old is not None:
+            self.order.remove((old, member))
+        self.scores[member] = score
+        self.order.add((score, member))
+
+    def remove(self, member: str) -> bool:
+        old = self.scores.pop(member, None)
+        if old is None:
+            return False
+        self.order.remove((old, member))
+        return True
+
+    def rank(self, member: str) -> int | None:
+        score = self.scores.get(member)
+        return None if score is None else self.order.index((score, member))
+
+    def score_slice(self, low: str, high: str) -> tuple[int, int]:
+        """Ascending positions [i, j) of the members with scores in low..high."""
+        i = self.order.bisect_left((_score_bound(low, upper=False),))
+        j = self.order.bisect_left((_score_bound(high, upper=True),))
+        return i, max(i, j)
+
+
+def _pack(commands: list[list]) -> bytes:
+    """RESP-encode a batch of commands into one buffer."""
+    out = []
+    append = out.append
+    for command in commands:
+        append(b"*%d\r\n" % len(command))
+        for arg in command:
+            raw = arg.encode() if type(arg) is str else _raw(arg)
+            append(b"$%d\r\n%s\r\n" % (len(raw), raw))
+    return b"".join(out)
+
+
+class RespTransport:
+    """
+    Commands over pooled native Redis connections. redis-py's pool connects,
+    authenticates and replaces stale connections; a round-trip then writes every
+    command of a batch in one buffer and reads the replies back under a single
+    deadline (REDIS_TIMEOUT), with the hiredis parser when it is installed.
+    """
+
+    def __init__(self, url: str, pool_size: int, timeout: float):
+        self.timeout = timeout
+        # A blocking pool makes callers wait for a free connection instead of failing
+        self.pool = aioredis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=pool_size,
+            timeout=timeout,
+            socket_connect_timeout=timeout,
+            decode_responses=True,
+            # RESP2 replies have the same shapes as Upstash's (flat lists, scores as strings)
+            protocol=2,
+        )
+
+    async def _roundtrip(self, commands: list[list]) -> list:
+        """One reply per command, error replies as ResponseError values."""
+        connection = await self.pool.get_connection()
+        try:
+            async with asyncio.timeout(self.timeout):
+                await connection.send_packed_command(_pack(commands), check_health=False)
+                replies = []
+                for _ in commands:
+                    try:
+                        # No per-read timeout on top of the round-trip's
+                        replies.append(await connection.read_response(timeout=math.inf))
+                    except ResponseError as e:
+                        replies.append(e)
+        except BaseException:
+            # Replies may be left unread, so the connection cannot be reused
+            await connection.disconnect(nowait=True)
+            raise
+        finally:
+            await self.pool.release(connection)
+        return replies
+
+    async def execute(self, url: str, headers: dict, command: list, from_pipeline: bool = False):
+        if not from_pipeline:
+            return _raise_first_error(await self._roundtrip([command]))[0]
+        if not url.endswith("/multi-exec"):
+            return _raise_first_error(await self._roundtrip(command))
+
+        replies = await self._roundtrip([["MULTI"], *command, ["EXEC"]])
+        # A command rejected while queueing aborts the whole transaction
+        return _raise_first_error(_raise_first_error(replies)[-1])
+
+    async def close(self):
+        await self.pool.aclose()
+
+
+class MemoryKeyspace:
+    """
+    Just enough Redis semantics for presence, rate limiting and the leaderboard,
+    in process. Keys expire lazily on access, and expired keys nobody reads again
+    are swept at most once a second. Sorted sets are ordered indexes, so ranks and
+    ranges cost O(log n) as on Redis, and command options the store does not model
+    raise an error rather than being ignored.
+    """
+
+    SWEEP_INTERVAL = 1.0  # seconds
+
+    def __init__(self):
+        self.data: dict[str, object] = {}
+        self.expires: dict[str, float] = {}
+        self.commands = 0
+        self._next_sweep = 0.0
+
+    def _live(self, key: str):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _expire_at(self, key: str, seconds: float):
+        if key in self.data:
+            self.expires[key] = time.time() + seconds
+            return 1
+        return 0
+
+    def _sweep(self, now: float):
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        for key in [k for k, deadline in self.expires.items() if deadline <= now]:
+            self.data.pop(key, None)
+            del self.expires[key]
+
+    def execute(self, command: list):
+        """Run one command. Raises ValueError with the Redis error text."""
+        self.commands += 1
+        now = time.time()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        name, *args = command
+        handler = getattr(self, f"cmd_{str(name).lower()}", None)
+        if handler is None:
+            raise ValueError(f"ERR unknown command '{name}'")
+        return handler(*[str(a) for a in args])
+
+    # --- Keys ---
+
+    def cmd_ping(self, *args):
+        return "PONG"
+
+    def cmd_exists(self, *keys):
+        return sum(1 for k in keys if self._live(k) is not None)
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_expire(self, key, seconds, *flags):
+        self._live(key)
+        return self._expire_at(key, float(seconds))
+
+    def cmd_rename(self, key, new_key):
+        if self._live(key) is None:
+            raise ValueError("ERR no such key")
+        self.data[new_key] = self.data.pop(key)
+        self.expires.pop(new_key, None)
+        if key in self.expires:
+            self.expires[new_key] = self.expires.pop(key)
+        return "OK"
+
+    def cmd_keys(self, pattern):
+        return [k for k in list(self.data) if self._live(k) is not None and fnmatch.fnmatchcase(k, pattern)]
+
+    # --- Strings ---
+
+    def cmd_get(self, key):
+        value = self._live(key)
+        return value if isinstance(value, str) else None
+
+    def cmd_set(self, key, value, *opts):
+        opts = [o.upper() for o in opts]
+        if "NX" in opts and self._live(key) is not None:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if "EX" in opts:
+            self._expire_at(key, float(opts[opts.index("EX") + 1]))
+        return "OK"
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._live(key) or 0) + int(amount)
+        self.data[key] = str(value)
+        return value
+
+    # --- Hashes ---
+
+    def _hash(self, key) -> dict:
+        value = self._live(key)
+        if value is None:
+            value = self.data[key] = {}
+        return value
+
+    def cmd_hset(self, key, *pairs):
+        h = self._hash(key)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in h
+            h[field] = value
+        return added
+
+    def cmd_hget(self, key, field):
+        return (self._live(key) or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        h = self._live(key) or {}
+        return [h.get(f) for f in fields]
+
+    def cmd_hgetall(self, key):
+        flat = []
+        for field, value in (self._live(key) or {}).items():
+            flat += [field, value]
+        return flat
+
+    def cmd_hdel(self, key, *fields):
+        h = self._live(key) or {}
+        removed = sum(1 for f in fields if h.pop(f, None) is not None)
+        if not h:
+            self.cmd_del(key)
+        return removed
+
+    def cmd_hlen(self, key):
+        return len(self._live(key) or {})
+
+    # --- Sets ---
+
+    def _set(self, key) -> set:
+        value = self._live(key)
+        if value is None:
+            value = self.data[key] = set()
+        return value
+
+    def cmd_sadd(self, key, *members):
+        s = self._set(key)
+        before = len(s)
+        s.update(members)
+        return len(s) - before
+
+    def cmd_srem(self, key, *members):
+        s = self._live(key) or set()
+        removed = sum(1 for m in members if m in s)
+        s.difference_update(members)
+        if not s:
+            self.cmd_del(key)
+        return removed
+
+    def cmd_scard(self, key):
+        return len(self._live(key) or ())
+
+    def cmd_smembers(self, key):
+        return sorted(self._live(key) or ())
+
+    # --- Sorted sets ---
+
+    def _zset(self, key) -> _ZSet:
+        value = self._live(key)
+        if value is None:
+            value = self.data[key] = _ZSet()
+        return value
+
+    def cmd_zadd(self, key, *args):
+        flags = set()
+        while args and args[0].upper() in ("NX", "XX", "GT", "LT", "CH", "INCR"):
+            flags.add(args[0].upper())
+            args = args[1:]
+        if not args or len(args) % 2:
+            raise ValueError("ERR syntax error")
+        if {"NX", "XX"} <= flags:
+            raise ValueError("ERR XX and NX options at the same time are not compatible")
+        if len(flags & {"NX", "GT", "LT"}) > 1:
+            raise ValueError("ERR GT, LT, and/or NX options at the same time are not compatible")
+        if "INCR" in flags and len(args) != 2:
+            raise ValueError("ERR INCR option supports a single increment-element pair")
+        pairs = [(float(score), member) for score, member in zip(args[::2], args[1::2])]
+
+        z = self._zset(key)
+        added = changed = 0
+        result = None
+        for score, member in pairs:
+            old = z.scores.get(member)
+            if ("XX" in flags and old is None) or ("NX" in flags and old is not None):
+                continue
+            if "INCR" in flags:
+                score += old or 0.0
+            if old is not None and (("GT" in flags and score <= old) or ("LT" in flags and score >= old)):
+                continue
+            if old is None:
+                added += 1
+            elif score != old:
+                changed += 1
+            z.add(member, score)
+            result = repr(score)
+        if not z:
+            self.cmd_del(key)
+        if "INCR" in flags:
+            return result
+        return added + changed if "CH" in flags else added
+
+    def cmd_zincrby(self, key, increment, member):
+        z = self._zset(key)
+        score = z.scores.get(member, 0.0) + float(increment)
+        z.add(member, score)
+        return repr(score)
+
+    def cmd_zrank(self, key, member):
+        return (self._live(key) or _ZSet()).rank(member)
+
+    def cmd_zrevrank(self, key, member):
+        z = self._live(key) or _ZSet()
+        position = z.rank(member)
+        return None if position is None else len(z) - 1 - position
+
+    def cmd_zcard(self, key):
+        return len(self._live(key) or ())
+
+    def cmd_zrem(self, key, *members):
+        z = self._live(key)
+        if z is None:
+            return 0
+        removed = sum(1 for m in members if z.remove(m))
+        if not z:
+            self.cmd_del(key)
+        return removed
+
+    def cmd_zremrangebyscore(self, key, low, high):
+        z = self._live(key)
+        if z is None:
+            return 0
+        i, j = z.score_slice(low, high)
+        for _, member in z.order[i:j]:
+            del z.scores[member]
+        del z.order[i:j]
+        if not z:
+            self.cmd_del(key)
+        return j - i
+
+    def _reply(self, items, withscores: bool) -> list:
+        if withscores:
+            return [x for s, m in items for x in (m, repr(s))]
+        return [m for _, m in items]
+
+    def cmd_zrangebyscore(self, key, low, high, *opts):
+        if any(o.upper() in ("BYSCORE", "REV") for o in opts):
+            raise ValueError("ERR syntax error")
+        return self.cmd_zrange(key, low, high, "BYSCORE", *opts)
+
+    def cmd_zrange(self, key, start, stop, *opts):
+        opts = [o.upper() for o in opts]
+        limit = _limit(opts)
+        unknown = set(opts) - {"BYSCORE", "REV", "LIMIT", "WITHSCORES"}
+        if limit is not None:
+            unknown -= set(opts[opts.index("LIMIT") + 1:opts.index("LIMIT") + 3])
+        if unknown:
+            # BYLEX and anything else the in-process store does not model
+            raise ValueError(f"ERR unsupported ZRANGE option {sorted(unknown)[0]}")
+        rev = "REV" in opts
+        z = self._live(key) or _ZSet()
+        n = len(z)
+
+        if "BYSCORE" in opts:
+            # With REV the bounds come max first
+            i, j = z.score_slice(stop, start) if rev else z.score_slice(start, stop)
+            items = z.order.islice(i, j, reverse=rev)
+            if limit is not None:
+                offset, count = limit
+                items = itertools.islice(items, offset, None if count < 0 else offset + count)
+        else:
+            if limit is not None:
+                raise ValueError("ERR syntax error, LIMIT is only supported in combination with either BYSCORE or BYLEX")
+            start, stop = int(start), int(stop)
+            if start < 0:
+                start = max(0, start + n)
+            if stop < 0:
+                stop += n
+            stop = min(stop, n - 1)
+            if start > stop:
+                return []
+            # Positions count from the end when reversed
+            i, j = (n - 1 - stop, n - start) if rev else (start, stop + 1)
+            items = z.order.islice(i, j, reverse=rev)
+        return self._reply(items, "WITHSCORES" in opts)
+
+    def cmd_zscore(self, key, member):
+        score = (self._live(key) or _ZSet()).scores.get(member)
+        return None if score is None else repr(score)
+
+    # --- Pub/sub (no subscribers here) ---
+
+    def cmd_publish(self, channel, message):
+        return 0
+
+
+class MemoryTransport:
+    """Commands against a MemoryKeyspace in this process. A batch never yields, so it is atomic."""
+
+    def __init__(self, keyspace: MemoryKeyspace | None = None):
+        self.keyspace = keyspace or MemoryKeyspace()
+
+    def _run(self, command: list):
+        try:
+            return self.keyspace.execute(command)
+        except Exception as e:
+            return e
+
+    async def execute(self, url: str, headers: dict, command: list, from_pipeline: bool = False):
+        if from_pipeline:
+            return _raise_first_error([self._run(cmd) for cmd in command])
+        result = self._run(command)
+        if isinstance(result, Exception):
+            raise UpstashError(str(result))
+        return result
+
+    async def close(self):
+        pass
+
+
+def create_client(backend: str, url: str = "", token: str = "", pool_size: int = 20, timeout: float = 5) -> AsyncRedis:
+    """
+    The command client for a backend: url and token are the Upstash REST
+    credentials for "upstash", the redis:// URL for "resp", unused for "memory".
+    """
+    if backend == "upstash":
+        return _check_transport(AsyncRedis(url=url, token=token))
+    if backend == "resp":
+        transport = RespTransport(url, pool_size, timeout)
+    elif backend == "memory":
+        transport = MemoryTransport()
+    else:
+        raise ValueError(f"Unknown Redis backend: {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+    # The backend name stands in for the REST URL: batches arrive as
+    # "<backend>/pipeline" or "<backend>/multi-exec"
+    client = AsyncRedis(url=backend, token="", rest_encoding=None, allow_telemetry=False, read_your_writes=False)
+    _check_transport(client)
+    client._http = transport
+    return client
+
+
+def _check_transport(client: AsyncRedis) -> AsyncRedis:
+    """
+    Transports replace, and redis_client wraps, the client's private _http and its
+    execute(url, headers, command, from_pipeline), as upstash-redis 1.8 has them
+    (requirements.txt pins 1.8.x). Fail at startup rather than on the first command.
+    """
+    execute = getattr(getattr(client, "_http", None), "execute", None)
+    params = list(inspect.signature(execute).parameters) if execute else []
+    if params[:4] != ["url", "headers", "command", "from_pipeline"]:
+        raise RuntimeError("unsupported upstash-redis version: expected 1.8.x (see requirements.txt)")
+    return client
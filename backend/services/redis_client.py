@@ -1,13 +1,208 @@
 """
 Redis client singleton for BondBox.
-Uses Upstash Redis REST API (HTTP-based) — works everywhere, no TLS socket issues.
+Callers always use the Upstash command API; REDIS_BACKEND picks what is behind it
+(services.redis_backends): Upstash REST over HTTPS (works everywhere, no TLS socket
+issues), native Redis over pooled TCP connections, or an in-process store.
+
+Every command is its own round-trip, so code that issues several commands
+together should queue them on a pipeline() and send them with one exec().
+
+Every round-trip is timed (redis_command_seconds, labelled by command, or
+"pipeline"/"multi" for batches) and failures are counted in redis_errors_total.
+
+Round-trips are also bounded by a deadline (REDIS_DEADLINE_MS, or
+REDIS_BATCH_DEADLINE_MS for batches) and reported to a circuit breaker
+(services.circuit_breaker). While the breaker is open, is_redis_available() is
+False, so presence, rate limiting and the leaderboard cache take the same fallbacks
+as without Redis instead of each waiting out a slow Redis. Anything that calls
+anyway fails at once with CircuitOpenError. Error replies from Redis (e.g. WRONGTYPE)
+are answers, not outages, and do not count against it.
+
+Read-only round-trips are hedged: one still unanswered after the recent p95 read
+latency is sent again, and whichever answer comes first is used.
 """
 
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+
 from upstash_redis.asyncio import Redis as AsyncRedis
-from config import UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN
+from upstash_redis.asyncio.client import AsyncPipeline
+from upstash_redis.errors import UpstashError
+from config import (
+    REDIS_BACKEND,
+    REDIS_BATCH_DEADLINE_MS,
+    REDIS_BREAKER_COOLDOWN,
+    REDIS_BREAKER_PROBES,
+    REDIS_BREAKER_SLOW_MS,
+    REDIS_BREAKER_WINDOW,
+    REDIS_DEADLINE_MS,
+    REDIS_HEDGE_MIN_MS,
+    REDIS_HEDGE_READS,
+    REDIS_POOL_SIZE,
+    REDIS_TIMEOUT,
+    REDIS_URL,
+    UPSTASH_REDIS_REST_TOKEN,
+    UPSTASH_REDIS_REST_URL,
+)
+from services import metrics
+from services.circuit_breaker import CircuitBreaker
+from services.redis_backends import BACKENDS, create_client
 
 # Global Redis connection
 _redis: AsyncRedis | None = None
+_backend = ""
+
+command_seconds = metrics.histogram(
+    "redis_command_seconds",
+    "Redis round-trip time by command (pipeline/multi for batches)",
+    ("command",),
+)
+errors = metrics.counter(
+    "redis_errors_total", "Redis round-trips that raised, by command", ("command",)
+)
+deadlines = metrics.counter(
+    "redis_deadline_exceeded_total", "Redis round-trips abandoned at their deadline, by command", ("command",)
+)
+hedges = metrics.counter(
+    "redis_hedged_reads_total", "Reads sent a second time because the first was slow, by which answer won", ("winner",)
+)
+# command -> (histogram child, error counter child, deadline counter child)
+_series: dict[str, tuple] = {}
+
+# Commands that are safe to send twice
+READ_COMMANDS = frozenset({
+    "EXISTS", "GET", "HGET", "HGETALL", "HLEN", "HMGET", "MGET", "PING", "SCARD", "SISMEMBER",
+    "SMEMBERS", "TTL", "ZCARD", "ZRANGE", "ZRANGEBYSCORE", "ZRANK", "ZREVRANK", "ZSCORE",
+})
+HEDGE_SAMPLES = 200  # recent read latencies behind the hedge delay
+HEDGE_MIN_SAMPLES = 20  # no hedging until this many have been seen
+
+# Set while the breaker's own probe runs, so it gets through an open breaker
+_probing: ContextVar[bool] = ContextVar("redis_probing", default=False)
+
+
+class _GuardedHttp:
+    """
+    Wraps the client's transport, so single commands and pipelines alike are timed,
+    bounded by their deadline, reported to the breaker and, for reads, hedged.
+    """
+
+    def __init__(self, http, hedge: bool):
+        self._http = http
+        self._hedge = hedge
+        self._read_seconds: deque[float] = deque(maxlen=HEDGE_SAMPLES)
+        self._reads = 0
+        # Delay before a read is hedged, None until there are enough samples
+        self.hedge_after: float | None = None
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+    async def execute(self, url: str, headers: dict, command: list, from_pipeline: bool = False):
+        probing = _probing.get()
+        if not breaker.closed and not probing:
+            raise breaker.reject()
+
+        if from_pipeline:
+            name = "multi" if url.endswith("/multi-exec") else "pipeline"
+            deadline = REDIS_BATCH_DEADLINE_MS / 1000
+            read = name == "pipeline" and all(str(cmd[0]).upper() in READ_COMMANDS for cmd in command)
+        else:
+            name = str(command[0]).lower() if command else ""
+            deadline = REDIS_DEADLINE_MS / 1000
+            read = name.upper() in READ_COMMANDS
+        series = _series.get(name)
+        if series is None:
+            series = _series[name] = (command_seconds.labels(name), errors.labels(name), deadlines.labels(name))
+
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(deadline):
+                if read and self.hedge_after is not None and not probing:
+                    result = await self._hedged(url, headers, command, from_pipeline)
+                else:
+                    result = await self._http.execute(url, headers, command, from_pipeline)
+        except UpstashError:
+            # Redis answered, with an error
+            series[1].inc()
+            if not probing:
+                breaker.record(time.perf_counter() - start)
+            raise
+        except TimeoutError:
+            series[1].inc()
+            series[2].inc()
+            error = TimeoutError(f"Redis {name} exceeded its {deadline * 1000:g} ms deadline")
+            if not probing:
+                breaker.record(time.perf_counter() - start, error)
+            raise error from None
+        except Exception as e:
+            series[1].inc()
+            if not probing:
+                breaker.record(time.perf_counter() - start, e)
+            raise
+        finally:
+            series[0].observe(time.perf_counter() - start)
+
+        elapsed = time.perf_counter() - start
+        if not probing:
+            breaker.record(elapsed)
+        if read and self._hedge:
+            self._sample(elapsed)
+        return result
+
+    def _sample(self, seconds: float):
+        """Keep the hedge delay at the recent p95 read latency."""
+        self._read_seconds.append(seconds)
+        self._reads += 1
+        if self._reads % HEDGE_MIN_SAMPLES == 0 and len(self._read_seconds) >= HEDGE_MIN_SAMPLES:
+            ordered = sorted(self._read_seconds)
+            p95 = ordered[int(len(ordered) * 0.95)]
+            self.hedge_after = max(REDIS_HEDGE_MIN_MS / 1000, p95)
+
+    async def _hedged(self, url: str, headers: dict, command: list, from_pipeline: bool):
+        first = asyncio.ensure_future(self._http.execute(url, headers, command, from_pipeline))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            second = asyncio.ensure_future(self._http.execute(url, headers, command, from_pipeline))
+            pending.add(second)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        hedges.labels("hedge" if task is second else "first").inc()
+                        return task.result()
+            # Both failed
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+async def _probe():
+    """The breaker's recovery probe: one PING past the open breaker."""
+    if _redis is None:
+        raise RuntimeError("Redis not initialized")
+    token = _probing.set(True)
+    try:
+        await _redis.ping()
+    finally:
+        _probing.reset(token)
+
+
+breaker = CircuitBreaker(
+    "redis",
+    _probe,
+    window=REDIS_BREAKER_WINDOW,
+    slow_seconds=REDIS_BREAKER_SLOW_MS / 1000,
+    cooldown=REDIS_BREAKER_COOLDOWN,
+    probes=REDIS_BREAKER_PROBES,
+)
 
 
 async def get_redis() -> AsyncRedis:
@@ -18,42 +213,113 @@ async def get_redis() -> AsyncRedis:
     return _redis
 
 
+def pipeline(transaction: bool = False) -> AsyncPipeline:
+    """
+    Start a batch of commands that is sent in a single round-trip.
+    Queue commands on it (they return the pipeline, so calls can be chained), then
+    `await pipe.exec()` for the list of results in command order.
+    transaction=True runs the batch atomically (MULTI/EXEC).
+    """
+    if _redis is None:
+        raise RuntimeError("Redis not initialized. Call init_redis() first.")
+    return _redis.multi() if transaction else _redis.pipeline()
+
+
+def _configured_backend() -> str:
+    if REDIS_BACKEND:
+        return REDIS_BACKEND
+    if UPSTASH_REDIS_REST_URL and UPSTASH_REDIS_REST_TOKEN:
+        return "upstash"
+    return "resp" if REDIS_URL else "memory"
+
+
 async def init_redis() -> AsyncRedis | None:
     """
-    Initialize the Upstash Redis client.
-    Call this during FastAPI startup.
+    Initialize the Redis client for the configured backend.
+    Call this during FastAPI startup. Returns None if Redis is not configured; a
+    Redis that does not answer yet still gets a client, behind an open breaker.
     """
-    global _redis
+    global _redis, _backend
 
-    if not UPSTASH_REDIS_REST_URL or not UPSTASH_REDIS_REST_TOKEN:
+    backend = _configured_backend()
+    if backend not in BACKENDS:
+        print(f"⚠️  Unknown REDIS_BACKEND {backend!r} (expected one of {', '.join(BACKENDS)}). Redis features will be degraded.")
+        return None
+    if backend == "upstash" and (not UPSTASH_REDIS_REST_URL or not UPSTASH_REDIS_REST_TOKEN):
         print("⚠️  Upstash Redis credentials not set. Redis features will be degraded.")
         return None
+    if backend == "resp" and not REDIS_URL:
+        print("⚠️  REDIS_URL not set. Redis features will be degraded.")
+        return None
+
+    try:
+        if backend == "upstash":
+            _redis = create_client(backend, UPSTASH_REDIS_REST_URL, UPSTASH_REDIS_REST_TOKEN)
+        else:
+            _redis = create_client(backend, REDIS_URL, pool_size=REDIS_POOL_SIZE, timeout=REDIS_TIMEOUT)
+    except Exception as e:
+        print(f"⚠️  Redis client could not be created: {e}. Redis features will be degraded.")
+        return None
+    # Nothing to hedge or time out in process
+    _redis._http = _GuardedHttp(_redis._http, hedge=REDIS_HEDGE_READS and backend != "memory")
+    _backend = backend
 
     try:
-        _redis = AsyncRedis(
-            url=UPSTASH_REDIS_REST_URL,
-            token=UPSTASH_REDIS_REST_TOKEN,
-        )
         # Verify connection
         result = await _redis.ping()
-        print(f"✅ Redis connected: {UPSTASH_REDIS_REST_URL}")
-        return _redis
     except Exception as e:
+        # Keep the client: the breaker's probes bring Redis in once it answers
         print(f"⚠️  Redis connection failed: {e}")
-        print("   Features requiring Redis (presence, rate limiting, leaderboard cache) will be degraded.")
-        _redis = None
-        return None
+        print("   Features requiring Redis (presence, rate limiting, leaderboard cache) are degraded until it answers.")
+        breaker.trip(f"no answer at startup ({type(e).__name__})")
+        return _redis
+
+    if backend == "upstash":
+        print(f"✅ Redis connected: {UPSTASH_REDIS_REST_URL}")
+    elif backend == "resp":
+        print(f"✅ Redis connected: {REDIS_URL.rpartition('@')[2]} (native, pool of {REDIS_POOL_SIZE})")
+    elif REDIS_BACKEND:
+        print("✅ Redis: in-process store (state is per worker and lost on restart)")
+    else:
+        # Nothing configured: make the fallback loud, it is wrong for more than one worker
+        print("⚠️  No Redis configured (UPSTASH_REDIS_REST_URL/TOKEN or REDIS_URL); falling back to the in-process store.")
+        print("   Presence, rate limits and rankings are per worker and lost on restart. Set REDIS_BACKEND=memory to accept this.")
+    return _redis
 
 
 async def close_redis():
     """Close the Redis connection. Call during FastAPI shutdown."""
-    global _redis
+    global _redis, _backend
+    await breaker.stop()
     if _redis:
         await _redis.close()
         _redis = None
+        _backend = ""
         print("🔌 Redis disconnected")
 
 
 def is_redis_available() -> bool:
-    """Check if Redis is connected and available."""
-    return _redis is not None
+    """Check if Redis is connected and its circuit breaker is closed."""
+    return _redis is not None and breaker.closed
+
+
+def shared_redis_configured() -> bool:
+    """A Redis shared by every worker is configured (upstash or resp), whether or not it is up."""
+    return _redis is not None and _backend != "memory"
+
+
+def is_redis_shared() -> bool:
+    """Redis is available and shared by every worker (not the in-process memory backend)."""
+    return is_redis_available() and _backend != "memory"
+
+
+def health() -> dict:
+    """Backend, whether it is shared by all workers, breaker state and hedge delay, for /api/health."""
+    hedge_after = getattr(_redis._http, "hedge_after", None) if _redis else None
+    return {
+        "backend": _backend,
+        "available": is_redis_available(),
+        "shared": is_redis_shared(),
+        **breaker.stats(),
+        "hedge_after_ms": round(hedge_after * 1000, 2) if hedge_after is not None else None,
+    }
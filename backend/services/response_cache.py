@@ -0,0 +1,262 @@
+"""
+Response cache for read-heavy GET endpoints.
+
+Cached routes are listed in CACHE_ROUTES with a TTL and the tags their data
+depends on (e.g. room:{room_id}). Write endpoints call invalidate() with the
+tags they touch; every tag has a version, and an entry is only served while
+the versions it was stored under are still current.
+
+Every cached response carries an ETag. A request whose If-None-Match matches
+gets 304 with no body, and Cache-Control: private, no-cache makes browsers
+revalidate instead of refetching. Identical requests that miss at the same time
+share one handler call.
+
+Stores:
+- redis: entries and tag versions in Redis, shared by all workers, one round-trip per lookup
+- memory: per-worker LRU whose invalidations reach only this worker
+
+RESPONSE_CACHE_BACKEND "auto" (the default) uses the redis store whenever a shared
+Redis is available, so a write invalidates the entry for every worker; the memory
+store takes over without one (single worker, in-process Redis backend, or while the
+Redis breaker is open). "memory" forces the per-worker store, which is only correct
+with a single worker.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+from config import (
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_PROFILE_TTL,
+    RESPONSE_CACHE_ROOM_TTL,
+)
+from services import auth, metrics
+from services.redis_client import get_redis, is_redis_shared, pipeline
+
+# route -> (path pattern, TTL seconds, tag templates filled from the path); TTL 0 disables.
+# The room directory (/api/rooms) is left to room_directory's own page cache
+CACHE_ROUTES = {
+    "room": (re.compile(r"^/api/rooms/(?P<room_id>[^/]+)$"), RESPONSE_CACHE_ROOM_TTL, ("room:{room_id}",)),
+    "profile": (
+        re.compile(r"^/api/users/(?!me$)(?P<user_id>[^/]+)$"),
+        RESPONSE_CACHE_PROFILE_TTL,
+        ("user:{user_id}",),
+    ),
+}
+
+CACHE_CONTROL = "private, no-cache"
+KEY_PREFIX = "resp:"
+TAG_PREFIX = "resp:tag:"
+
+requests = metrics.counter(
+    "response_cache_requests_total",
+    "Cacheable GET requests by how they were answered",
+    ("route", "result"),
+)
+errors = metrics.counter(
+    "response_cache_errors_total", "Response cache store operations that raised", ("op",)
+)
+
+
+class _Entry:
+    __slots__ = ("body", "etag", "versions", "expires_at")
+
+    def __init__(self, body: bytes, etag: str, versions: tuple, expires_at: float):
+        self.body = body
+        self.etag = etag
+        self.versions = versions
+        self.expires_at = expires_at
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+class MemoryStore:
+    """Per-worker LRU of entries, with local tag versions."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.tag_versions: dict[str, int] = {}
+
+    async def get(self, key: str, tags: tuple) -> tuple[_Entry | None, tuple]:
+        versions = tuple(self.tag_versions.get(tag, 0) for tag in tags)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, versions
+        if entry.versions != versions or entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            return None, versions
+        self.entries.move_to_end(key)
+        return entry, versions
+
+    async def set(self, key: str, entry: _Entry, ttl: float):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def invalidate(self, tags: tuple):
+        for tag in tags:
+            self.tag_versions[tag] = self.tag_versions.get(tag, 0) + 1
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self.entries)}
+
+
+class RedisStore:
+    """Entries and tag versions in Redis; reads one entry and its tags in one pipeline."""
+
+    async def get(self, key: str, tags: tuple) -> tuple[_Entry | None, tuple]:
+        pipe = pipeline()
+        pipe.get(KEY_PREFIX + key)
+        for tag in tags:
+            pipe.get(TAG_PREFIX + tag)
+        raw, *tag_versions = await pipe.exec()
+        versions = tuple(int(v or 0) for v in tag_versions)
+        if not raw:
+            return None, versions
+        data = json.loads(raw)
+        if tuple(data["versions"]) != versions:
+            return None, versions
+        return _Entry(data["body"].encode(), data["etag"], versions, 0.0), versions
+
+    async def set(self, key: str, entry: _Entry, ttl: float):
+        redis = await get_redis()
+        value = json.dumps({
+            "body": entry.body.decode(),
+            "etag": entry.etag,
+            "versions": list(entry.versions),
+        })
+        await redis.set(KEY_PREFIX + key, value, ex=max(1, int(ttl)))
+
+    async def invalidate(self, tags: tuple):
+        pipe = pipeline()
+        for tag in tags:
+            pipe.incr(TAG_PREFIX + tag)
+        await pipe.exec()
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+_memory = MemoryStore()
+_redis_store = RedisStore()
+
+# cache key -> the in-flight handler call other identical requests wait on
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def _store():
+    if RESPONSE_CACHE_BACKEND != "memory" and is_redis_shared():
+        return _redis_store
+    return _memory
+
+
+def _error(op: str, e: Exception):
+    errors.labels(op).inc()
+    print(f"Response cache {op} error: {e}")
+
+
+async def invalidate(*tags: str):
+    """Expire every cached response that depends on any of these tags."""
+    try:
+        await _store().invalidate(tags)
+    except Exception as e:
+        # Entries still expire with their TTL
+        _error("invalidate", e)
+
+
+def _match(path: str) -> tuple[str, float, tuple] | None:
+    for route, (pattern, ttl, templates) in CACHE_ROUTES.items():
+        m = pattern.match(path)
+        if m and ttl > 0:
+            return route, ttl, tuple(t.format(**m.groupdict()) for t in templates)
+    return None
+
+
+async def _viewer(request: Request) -> str:
+    """
+    Which audience a response is cached for. Routes here return the same data to
+    every signed-in user (RLS is USING (true)), so callers split only into anon and
+    signed-in, and a token has to verify before it counts as signed in.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.startswith("Bearer ") and await auth.verify_token(authorization.split(" ")[1]):
+        return "user"
+    return "anon"
+
+
+def _respond(request: Request, entry: _Entry, cache_status: str) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL, "X-Cache": cache_status}
+    if entry.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """Serves CACHE_ROUTES from the response cache, with ETag revalidation."""
+
+    async def dispatch(self, request: Request, call_next):
+        match = _match(request.url.path) if request.method == "GET" else None
+        if match is None:
+            return await call_next(request)
+
+        route, ttl, tags = match
+        query = "&".join(sorted(request.url.query.split("&"))) if request.url.query else ""
+        key = f"{route}:{await _viewer(request)}:{request.url.path}?{query}"
+        store = _store()
+
+        try:
+            entry, versions = await store.get(key, tags)
+        except Exception as e:
+            _error("read", e)
+            return await call_next(request)
+
+        if entry is not None:
+            result = "not_modified" if entry.etag in request.headers.get("if-none-match", "") else "hit"
+            requests.labels(route, result).inc()
+            return _respond(request, entry, "HIT")
+
+        # Identical request already in flight: wait for its response
+        flight = _inflight.get(key)
+        if flight is not None:
+            entry = await asyncio.shield(flight)
+            if entry is not None:
+                requests.labels(route, "coalesced").inc()
+                return _respond(request, entry, "HIT")
+            return await call_next(request)
+
+        requests.labels(route, "miss").inc()
+        flight = _inflight[key] = asyncio.get_running_loop().create_future()
+        entry = None
+        try:
+            response = await call_next(request)
+            if response.status_code != 200:
+                return response
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            # Stored under the tag versions read before the handler ran, so an
+            # invalidation that lands meanwhile makes this entry stale at once
+            entry = _Entry(body, _etag(body), versions, time.monotonic() + ttl)
+            try:
+                await store.set(key, entry, ttl)
+            except Exception as e:
+                _error("write", e)
+            return _respond(request, entry, "MISS")
+        finally:
+            _inflight.pop(key, None)
+            flight.set_result(entry)
+
+
+def stats() -> dict:
+    return {**_store().stats(), "in_flight": len(_inflight)}
@@ -0,0 +1,160 @@
+"""
+Room directory: pages of active rooms, newest first, with live online counts.
+
+Pages are keyset-paginated on (created_at, id): the cursor is the last row of
+the previous page, so every page is one index range scan no matter how deep.
+Room rows are cached per worker for ROOM_DIRECTORY_TTL seconds. Creating,
+joining or leaving a room bumps a version in Redis, and workers drop their
+cached pages once they see a new version (checked at most once a second).
+Online counts are never cached: they come from presence, one batched lookup
+per page.
+"""
+
+import base64
+import json
+import time
+import uuid
+from datetime import datetime
+
+from config import ROOM_DIRECTORY_TTL
+from services import auth, db, metrics
+from services import presence as presence_service
+from services.redis_client import get_redis, is_redis_available
+
+VERSION_KEY = "rooms:directory:version"
+VERSION_CHECK_INTERVAL = 1.0  # seconds
+MAX_PAGES = 1000  # cached pages per worker (filters x cursors)
+
+ROOM_COLUMNS = (
+    "*, host:profiles!study_rooms_host_id_fkey(id, display_name, avatar_url), "
+    "member_count:room_members(count)"
+)
+
+lookups = metrics.counter(
+    "room_directory_lookups_total", "Room directory pages by cache result", ("result",)
+)
+
+# (authenticated, room_type, subject, is_active, limit, cursor) -> (expires_at, version, page)
+_pages: dict[tuple, tuple[float, int, dict]] = {}
+_version = 0
+_version_checked_at = 0.0
+
+
+def encode_cursor(room: dict) -> str:
+    raw = json.dumps([room["created_at"], room["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """(created_at, id) from a cursor. Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, room_id = json.loads(raw)
+        # Both end up inside a PostgREST filter, so only accept what they should be
+        datetime.fromisoformat(created_at)
+        uuid.UUID(room_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return created_at, room_id
+
+
+async def _current_version() -> int:
+    """The shared directory version, read from Redis at most once a second."""
+    global _version, _version_checked_at
+    now = time.monotonic()
+    if is_redis_available() and now - _version_checked_at >= VERSION_CHECK_INTERVAL:
+        _version_checked_at = now
+        try:
+            redis = await get_redis()
+            _version = int(await redis.get(VERSION_KEY) or 0)
+        except Exception as e:
+            print(f"Room directory version check error: {e}")
+    return _version
+
+
+async def invalidate():
+    """Drop cached pages here and, through the shared version, on every worker."""
+    global _version
+    _pages.clear()
+    if not is_redis_available():
+        return
+    try:
+        redis = await get_redis()
+        _version = await redis.incr(VERSION_KEY)
+    except Exception as e:
+        print(f"Room directory invalidation error: {e}")
+
+
+def _evict():
+    """Drop expired pages; if none have expired, the oldest half."""
+    now = time.monotonic()
+    for key in [k for k, (expires_at, _, _) in _pages.items() if expires_at <= now]:
+        del _pages[key]
+    if len(_pages) >= MAX_PAGES:
+        for key in list(_pages)[: MAX_PAGES // 2]:
+            del _pages[key]
+
+
+async def _load(
+    supabase: db.SupabaseClient,
+    room_type: str | None,
+    subject: str | None,
+    is_active: bool,
+    limit: int,
+    cursor: tuple[str, str] | None,
+) -> dict:
+    query = supabase.table("study_rooms").select(ROOM_COLUMNS).eq("is_active", is_active)
+    if room_type:
+        query = query.eq("room_type", room_type)
+    if subject:
+        query = query.eq("subject", subject)
+    if cursor:
+        created_at, room_id = cursor
+        query = query.or_(
+            f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{room_id})'
+        )
+
+    # One extra row tells us whether there is a next page
+    result = await db.execute(
+        query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+    )
+    rooms = result.data or []
+    next_cursor = encode_cursor(rooms[limit - 1]) if len(rooms) > limit else None
+    return {"rooms": rooms[:limit], "next_cursor": next_cursor}
+
+
+async def get_page(
+    supabase: db.SupabaseClient,
+    room_type: str | None = None,
+    subject: str | None = None,
+    is_active: bool = True,
+    limit: int = 20,
+    cursor: str | None = None,
+) -> dict:
+    """
+    One directory page: {"rooms": [...], "next_cursor": str | None}.
+    Each room carries online_count from presence. Raises ValueError for a bad cursor.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    # Rooms are only visible to signed-in users (RLS), so anon pages are kept apart;
+    # a token has to verify before it gets the signed-in pages
+    signed_in = bool(supabase.token) and await auth.verify_token(supabase.token) is not None
+    key = (signed_in, room_type, subject, is_active, limit, cursor)
+
+    version = await _current_version()
+    entry = _pages.get(key)
+    if entry and entry[0] > time.monotonic() and entry[1] == version:
+        lookups.labels("hit").inc()
+        page = entry[2]
+    else:
+        lookups.labels("miss").inc()
+        page = await _load(supabase, room_type, subject, is_active, limit, position)
+        if len(_pages) >= MAX_PAGES:
+            _evict()
+        _pages[key] = (time.monotonic() + ROOM_DIRECTORY_TTL, version, page)
+
+    counts = await presence_service.get_online_counts([room["id"] for room in page["rooms"]])
+    return {
+        "rooms": [{**room, "online_count": counts.get(room["id"], 0)} for room in page["rooms"]],
+        "next_cursor": page["next_cursor"],
+    }
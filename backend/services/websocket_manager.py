@@ -1,46 +1,328 @@
 """
 WebSocket Connection Manager for BondBox.
 Handles per-room connections for WebRTC signaling, canvas sync, presence, and typing.
+
+Each connection owns a bounded outbound queue drained by its own writer task,
+so a slow or stalled client only ever delays its own messages.
+Messages are encoded once per broadcast and wire format, and the same payload is
+queued for every peer (JSON text, or packed canvas frames for binary-protocol clients).
+Fan-out time is recorded per message type and room size (ws_fanout_seconds).
 """
 
+import asyncio
+import bisect
+import time
+from collections import deque
 from fastapi import WebSocket
-import json
-from typing import Dict
+from typing import Awaitable, Callable, Dict
+
+from config import WS_SEND_QUEUE_SIZE, WS_SEND_TIMEOUT, WS_SLOW_CONSUMER_POLICY
+from services import binary_protocol, codec, metrics
+from services.backplane import Backplane
+
+# Signaling frames jump ahead of everything else queued for a connection
+PRIORITY_TYPES = {"webrtc-offer", "webrtc-answer", "webrtc-ice"}
+# Frames that may be shed when a client falls behind
+DROPPABLE_TYPES = {"canvas-draw", "canvas-batch"}
+
+# Queue label for binary intern-table frames (never dropped, never prioritized)
+INTERN_FRAME = "intern"
+
+# Close code sent to clients that cannot keep up ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code sent to a socket replaced by a reconnect under the same user_id
+REPLACED_CLOSE_CODE = 4000
+
+# Room sizes are bucketed for metric labels (local sockets in the room)
+ROOM_SIZE_BOUNDS = (1, 5, 10, 25, 50)
+_ROOM_SIZE_LABELS = ("1", "2-5", "6-10", "11-25", "26-50", "51+")
+
+fanout_seconds = metrics.histogram(
+    "ws_fanout_seconds",
+    "Time to encode a message and queue it for every target connection",
+    ("type", "room_size"),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+# (msg_type, room_size label) -> histogram child
+_fanout_timings: dict = {}
+
+# Strong references to writer and socket-close tasks; the event loop only keeps weak ones
+_socket_tasks: set[asyncio.Task] = set()
+
+
+def room_size_label(size: int) -> str:
+    return _ROOM_SIZE_LABELS[bisect.bisect_left(ROOM_SIZE_BOUNDS, size)]
+
+
+def _spawn(coro) -> asyncio.Task:
+    """Start a task and hold a reference to it until it finishes."""
+    task = asyncio.create_task(coro)
+    _socket_tasks.add(task)
+    task.add_done_callback(_socket_tasks.discard)
+    return task
+
+
+class Connection:
+    """A single socket in a room, with its own outbound queues and writer task."""
+
+    def __init__(self, websocket: WebSocket, display_name: str, binary: bool = False):
+        self.ws = websocket
+        self.display_name = display_name
+        # Negotiated the binary subprotocol
+        self.binary = binary
+        self.priority: deque = deque()
+        self.queue: deque = deque()
+        self.closed = False
+
+        # Stats
+        self.sent = 0
+        self.dropped = 0
+        self.high_water = 0
+
+        self._wakeup = asyncio.Event()
+        self._task = _spawn(self._writer())
+
+    def enqueue(self, msg_type: str, payload: str | bytes) -> bool:
+        """
+        Queue an already-encoded frame for delivery without waiting on the socket.
+        Returns False if the connection is (or just became) unusable.
+        """
+        if self.closed:
+            return False
+
+        if msg_type in PRIORITY_TYPES:
+            if len(self.priority) >= WS_SEND_QUEUE_SIZE:
+                self._shed_slow_consumer()
+                return False
+            self.priority.append((msg_type, payload))
+        else:
+            if len(self.queue) >= WS_SEND_QUEUE_SIZE and not self._make_room():
+                self._shed_slow_consumer()
+                return False
+            self.queue.append((msg_type, payload))
+
+        depth = len(self.priority) + len(self.queue)
+        if depth > self.high_water:
+            self.high_water = depth
+        self._wakeup.set()
+        return True
+
+    def _make_room(self) -> bool:
+        """Apply the slow-consumer policy. Returns True if a slot was freed."""
+        if WS_SLOW_CONSUMER_POLICY != "drop_oldest":
+            return False
+        for i, (queued_type, _) in enumerate(self.queue):
+            if queued_type in DROPPABLE_TYPES:
+                del self.queue[i]
+                self.dropped += 1
+                return True
+        return False
+
+    def _shed_slow_consumer(self):
+        """Give up on a client that cannot keep up; its receive loop handles cleanup."""
+        print(f"Slow WebSocket consumer disconnected (queued={len(self.queue)}, dropped={self.dropped})")
+        self.close()
+        _spawn(self._close_socket(SLOW_CONSUMER_CLOSE_CODE))
+
+    def replace(self):
+        """Retire a connection superseded by a reconnect, closing its socket in the background."""
+        self.close()
+        _spawn(self._close_socket(REPLACED_CLOSE_CODE))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.ws.close(code=code)
+        except Exception:
+            pass
+
+    async def _writer(self):
+        """Drain the queues in order, signaling first, one frame at a time."""
+        try:
+            while True:
+                if not self.priority and not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                _, payload = self.priority.popleft() if self.priority else self.queue.popleft()
+                if isinstance(payload, bytes):
+                    await asyncio.wait_for(self.ws.send_bytes(payload), WS_SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.ws.send_text(payload), WS_SEND_TIMEOUT)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Send failed or timed out: the socket is dead or stalled
+            self.closed = True
+            self.priority.clear()
+            self.queue.clear()
+            await self._close_socket(SLOW_CONSUMER_CLOSE_CODE)
+
+    def close(self):
+        """Stop the writer task and discard anything still queued."""
+        self.closed = True
+        self.priority.clear()
+        self.queue.clear()
+        self._task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self.queue),
+            "priority_depth": len(self.priority),
+            "high_water": self.high_water,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "closed": self.closed,
+        }
 
 
 class ConnectionManager:
     """Manages WebSocket connections grouped by room_id."""
 
     def __init__(self):
-        # room_id -> {user_id: {"ws": WebSocket, "display_name": str}}
-        self.rooms: Dict[str, Dict[str, dict]] = {}
+        # room_id -> {user_id: Connection}
+        self.rooms: Dict[str, Dict[str, Connection]] = {}
+        # room_id -> intern tables, for rooms with at least one binary client
+        self.codecs: Dict[str, binary_protocol.RoomCodec] = {}
 
-    async def connect(self, room_id: str, user_id: str, display_name: str, websocket: WebSocket):
-        await websocket.accept()
-        if room_id not in self.rooms:
-            self.rooms[room_id] = {}
-        self.rooms[room_id][user_id] = {
-            "ws": websocket,
-            "display_name": display_name,
-        }
+        # Cross-worker fan-out (None when running a single worker)
+        self.backplane: Backplane | None = None
+        # room_id -> {user_id: display_name} for peers connected to other workers
+        self.remote_peers: Dict[str, Dict[str, str]] = {}
+        # Called with (room_id, message) for broadcasts that arrive from other workers
+        self.remote_listeners: list[Callable[[str, dict], None]] = []
+        # Envelope kind -> handler for (room_id, envelope), for kinds other services publish
+        self.envelope_handlers: Dict[str, Callable[[str, dict], Awaitable[None]]] = {}
+        # room_id -> roster version; bumped on every join/leave this worker sees
+        self.presence_versions: Dict[str, int] = {}
+
+    async def attach_backplane(self, backplane: Backplane):
+        """Route broadcasts and user-targeted messages across workers through a backplane."""
+        self.backplane = backplane
+        await backplane.start(self._deliver_remote)
+        for room_id, conns in list(self.rooms.items()):
+            await backplane.subscribe(room_id)
+            backplane.publish(room_id, {"kind": "roster"})
+            for uid, conn in conns.items():
+                backplane.publish(room_id, {"kind": "join", "userId": uid, "displayName": conn.display_name})
+
+    async def connect(
+        self,
+        room_id: str,
+        user_id: str,
+        display_name: str,
+        websocket: WebSocket,
+        subprotocol: str | None = None,
+    ) -> Connection:
+        """Accept a socket into a room and return its Connection (pass it back to disconnect)."""
+        await websocket.accept(subprotocol=subprotocol)
+        first_local = room_id not in self.rooms
+        room = self.rooms.setdefault(room_id, {})
+
+        # A reconnect under the same user_id replaces the stale connection
+        previous = room.get(user_id)
+        if previous:
+            previous.replace()
+        was_present = previous is not None or user_id in self.remote_peers.get(room_id, {})
+        conn = Connection(websocket, display_name, binary=subprotocol == binary_protocol.SUBPROTOCOL)
+        room[user_id] = conn
+
+        if conn.binary:
+            room_codec = self.codecs.setdefault(room_id, binary_protocol.RoomCodec())
+            tables = room_codec.full_table_frame()
+            if tables:
+                conn.enqueue(INTERN_FRAME, tables)
+
+        if self.backplane:
+            # Listen before publishing, so replies (roster, canvas) are not missed;
+            # the connection is already in the room, so it cannot empty meanwhile
+            await self.backplane.subscribe(room_id)
+            if first_local:
+                # First local member: ask other workers who is here
+                self.backplane.publish(room_id, {"kind": "roster"})
+            self.backplane.publish(
+                room_id, {"kind": "join", "userId": user_id, "displayName": display_name}
+            )
+
+        if not was_present:
+            self._presence_delta(room_id, "join", user_id, display_name, exclude=user_id)
+        self.send_presence_snapshot(room_id, user_id)
 
         # Notify others in the room that a new peer joined
         await self.broadcast_to_room(
+            room_id,
+            {"type": "peer-joined", "userId": user_id, "displayName": display_name},
+            exclude=user_id,
+        )
+        return conn
+
+    def disconnect(self, room_id: str, user_id: str, conn: Connection) -> bool:
+        """
+        Remove conn from the room. Returns False (and leaves the room alone) when
+        conn was already replaced by a reconnect under the same user_id, so the
+        stale socket's receive loop cannot tear down the new connection.
+        """
+        conn.close()
+        if room_id not in self.rooms or self.rooms[room_id].get(user_id) is not conn:
+            return False
+        del self.rooms[room_id][user_id]
+        if self.backplane:
+            self.backplane.publish(room_id, {"kind": "leave", "userId": user_id})
+        if user_id not in self.remote_peers.get(room_id, {}):
+            self._presence_delta(room_id, "leave", user_id)
+        if not self.rooms[room_id]:
+            del self.rooms[room_id]
+            self.codecs.pop(room_id, None)
+            self.remote_peers.pop(room_id, None)
+            self.presence_versions.pop(room_id, None)
+            if self.backplane:
+                self.backplane.unsubscribe(room_id)
+        return True
+
+    # --- Presence roster ---
+
+    def _presence_delta(
+        self, room_id: str, op: str, user_id: str, display_name: str | None = None, exclude: str | None = None
+    ):
+        """
+        Bump the room's roster version and tell local members what changed.
+        Versions are per worker (each worker sees every join/leave through the
+        backplane), so deltas go to this worker's sockets only.
+        """
+        if room_id not in self.rooms:
+            return
+        version = self.presence_versions.get(room_id, 0) + 1
+        self.presence_versions[room_id] = version
+        delta = {"type": "presence-delta", "version": version, "op": op, "userId": user_id}
+        if display_name is not None:
+            delta["displayName"] = display_name
+        self._enqueue(room_id, delta, [uid for uid in self.rooms[room_id] if uid != exclude])
+
+    def send_presence_snapshot(self, room_id: str, user_id: str):
+        """Send one member the full roster and its version (on connect, or on request after a gap)."""
+        self._enqueue(
             room_id,
             {
-                "type": "peer-joined",
-                "userId": user_id,
-                "displayName": display_name,
-                "peers": list(self.rooms[room_id].keys()),
+                "type": "presence-snapshot",
+                "version": self.presence_versions.get(room_id, 0),
+                "online": self.get_peers_with_names(room_id),
             },
-            exclude=user_id,
+            [user_id],
         )
 
-    def disconnect(self, room_id: str, user_id: str):
-        if room_id in self.rooms:
-            self.rooms[room_id].pop(user_id, None)
-            if not self.rooms[room_id]:
-                del self.rooms[room_id]
+    async def expire_peers(self, room_id: str, user_ids: list[str]):
+        """
+        Drop members whose heartbeats stopped but who never disconnected cleanly
+        (e.g. their worker died). Members still connected here are kept.
+        """
+        for uid in user_ids:
+            if uid in self.rooms.get(room_id, {}):
+                continue
+            if self.backplane:
+                self.backplane.publish(room_id, {"kind": "leave", "userId": uid})
+            if self.remote_peers.get(room_id, {}).pop(uid, None) is not None:
+                self._presence_delta(room_id, "leave", uid)
 
     async def notify_disconnect(self, room_id: str, user_id: str):
         """Notify remaining peers that someone left."""
@@ -51,46 +333,163 @@ class ConnectionManager:
         )
 
     async def send_to_user(self, room_id: str, user_id: str, message: dict):
-        """Send a message to a specific user in a room."""
+        """Send a message to a specific user in a room, wherever they are connected."""
         if room_id in self.rooms and user_id in self.rooms[room_id]:
-            ws = self.rooms[room_id][user_id]["ws"]
-            try:
-                await ws.send_json(message)
-            except Exception:
-                self.disconnect(room_id, user_id)
+            await self._fanout(room_id, message, [user_id])
+        elif self.backplane:
+            self.backplane.publish(room_id, {"kind": "user", "target": user_id, "message": message})
+
+    async def send_frame_to_user(self, room_id: str, user_id: str, msg_type: str, payload: str):
+        """Send an already-encoded frame to a specific user in a room."""
+        if room_id in self.rooms and user_id in self.rooms[room_id]:
+            conn = self.rooms[room_id][user_id]
+            if not conn.enqueue(msg_type, payload):
+                self.disconnect(room_id, user_id, conn)
 
     async def broadcast_to_room(
-        self, room_id: str, message: dict, exclude: str | None = None
+        self, room_id: str, message: dict, exclude: str | set[str] | None = None
     ):
-        """Broadcast a message to all users in a room, optionally excluding one."""
+        """
+        Broadcast a message to all users in a room, optionally excluding one or more.
+        Only enqueues; each connection's writer task does the actual send.
+        """
+        excluded = {exclude} if isinstance(exclude, str) else (exclude or ())
+        if self.backplane:
+            self.backplane.publish(
+                room_id, {"kind": "broadcast", "message": message, "exclude": list(excluded)}
+            )
         if room_id not in self.rooms:
             return
+        targets = [uid for uid in self.rooms[room_id] if uid not in excluded]
+        await self._fanout(room_id, message, targets)
+
+    async def _fanout(self, room_id: str, message: dict, targets: list[str]):
+        self._enqueue(room_id, message, targets)
+
+    def _enqueue(self, room_id: str, message: dict, targets: list[str]):
+        """
+        Encode a message at most once per wire format and queue it for the targets.
+        Binary clients get packed canvas frames; everything else is JSON text.
+        """
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        start = time.perf_counter()
+        msg_type = message.get("type", "")
+        text = None
+        packed = None
+
+        room_codec = self.codecs.get(room_id)
+        if room_codec and msg_type in binary_protocol.BINARY_TYPES:
+            interns, packed = room_codec.encode(message)
+            if interns:
+                # New table entries reach every binary client before any frame using them
+                for conn in room.values():
+                    if conn.binary:
+                        conn.enqueue(INTERN_FRAME, interns)
+
         dead_connections = []
-        for uid, conn in self.rooms[room_id].items():
-            if uid == exclude:
+        for uid in targets:
+            conn = room.get(uid)
+            if conn is None:
                 continue
-            try:
-                await conn["ws"].send_json(message)
-            except Exception:
-                dead_connections.append(uid)
+            if conn.binary and packed is not None:
+                payload = packed
+            else:
+                if text is None:
+                    text = codec.dumps(message)
+                payload = text
+            if not conn.enqueue(msg_type, payload):
+                dead_connections.append((uid, conn))
+
+        key = (msg_type, room_size_label(len(room)))
+        timing = _fanout_timings.get(key)
+        if timing is None:
+            timing = _fanout_timings[key] = fanout_seconds.labels(*key)
+        timing.observe(time.perf_counter() - start)
 
-        for uid in dead_connections:
-            self.disconnect(room_id, uid)
+        for uid, conn in dead_connections:
+            self.disconnect(room_id, uid, conn)
+
+    async def _deliver_remote(self, room_id: str, envelope: dict):
+        """Apply an envelope published by another worker to this worker's sockets."""
+        kind = envelope.get("kind")
+        if kind == "broadcast":
+            message = envelope["message"]
+            for listener in self.remote_listeners:
+                listener(room_id, message)
+            excluded = set(envelope.get("exclude") or ())
+            targets = [uid for uid in self.rooms.get(room_id, {}) if uid not in excluded]
+            await self._fanout(room_id, message, targets)
+        elif kind == "user":
+            if envelope.get("target") in self.rooms.get(room_id, {}):
+                await self._fanout(room_id, envelope["message"], [envelope["target"]])
+        elif kind == "join":
+            uid, name = envelope["userId"], envelope.get("displayName", "")
+            peers = self.remote_peers.setdefault(room_id, {})
+            known = uid in peers or uid in self.rooms.get(room_id, {})
+            peers[uid] = name
+            if not known:
+                self._presence_delta(room_id, "join", uid, name)
+        elif kind == "leave":
+            uid = envelope["userId"]
+            if self.remote_peers.get(room_id, {}).pop(uid, None) is not None:
+                if uid not in self.rooms.get(room_id, {}):
+                    self._presence_delta(room_id, "leave", uid)
+        elif kind == "roster" and self.backplane:
+            # Another worker just subscribed: announce our local members to it
+            for uid, conn in self.rooms.get(room_id, {}).items():
+                self.backplane.publish(
+                    room_id, {"kind": "join", "userId": uid, "displayName": conn.display_name}
+                )
+        elif kind in self.envelope_handlers:
+            await self.envelope_handlers[kind](room_id, envelope)
 
     def get_peers(self, room_id: str) -> list[str]:
-        """Get list of user IDs in a room."""
-        if room_id in self.rooms:
-            return list(self.rooms[room_id].keys())
-        return []
+        """Get list of user IDs in a room, across all workers."""
+        peers = list(self.rooms.get(room_id, {}).keys())
+        peers += [uid for uid in self.remote_peers.get(room_id, {}) if uid not in peers]
+        return peers
 
     def get_peers_with_names(self, room_id: str) -> list[dict]:
-        """Get list of peers with their display names."""
-        if room_id not in self.rooms:
-            return []
-        return [
-            {"userId": uid, "displayName": conn["display_name"]}
-            for uid, conn in self.rooms[room_id].items()
+        """Get list of peers with their display names, across all workers."""
+        local = self.rooms.get(room_id, {})
+        peers = [
+            {"userId": uid, "displayName": conn.display_name}
+            for uid, conn in local.items()
         ]
+        peers += [
+            {"userId": uid, "displayName": name}
+            for uid, name in self.remote_peers.get(room_id, {}).items()
+            if uid not in local
+        ]
+        return peers
+
+    def get_queue_stats(self, room_id: str | None = None) -> dict:
+        """Per-connection outbound queue stats, grouped by room."""
+        rooms = [room_id] if room_id else list(self.rooms.keys())
+        return {
+            rid: {uid: conn.stats() for uid, conn in self.rooms.get(rid, {}).items()}
+            for rid in rooms
+        }
+
+    def queue_summary(self) -> dict:
+        """Outbound queue totals across this worker's connections, for /api/health."""
+        conns = [s for room in self.get_queue_stats().values() for s in room.values()]
+        return {
+            "connections": len(conns),
+            "queued": sum(s["depth"] + s["priority_depth"] for s in conns),
+            "high_water": max((s["high_water"] for s in conns), default=0),
+            "sent": sum(s["sent"] for s in conns),
+            "dropped": sum(s["dropped"] for s in conns),
+        }
 
 
 manager = ConnectionManager()
+
+metrics.gauge("ws_active_rooms", "Rooms with at least one socket on this worker", fn=lambda: len(manager.rooms))
+metrics.gauge(
+    "ws_connections",
+    "Open room sockets on this worker",
+    fn=lambda: sum(len(conns) for conns in manager.rooms.values()),
+)
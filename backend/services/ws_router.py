@@ -0,0 +1,179 @@
+"""
+Table-driven dispatch for inbound room WebSocket messages.
+
+Each message type is registered once with its handler and a Schema. A Schema is
+compiled at registration into a flat tuple of field checks, so validating a
+message is a loop of dict lookups and isinstance calls that allocates nothing
+when the message is valid. Messages arrive as dicts from either the JSON codec
+or the binary subprotocol decoder, so schemas check the decoded dict rather
+than decoding into typed structs.
+
+Every dispatch records, per message type:
+- ws_messages_total{type,result}: handled, invalid, error (unregistered types count as "unknown")
+- ws_message_bytes{type}: size of the frame the message arrived in
+- ws_handler_seconds{type,room_size}: time in the handler, fan-out included
+Fan-out alone is timed by the connection manager (ws_fanout_seconds).
+"""
+
+import time
+from typing import Awaitable, Callable
+
+from services import metrics
+from services.websocket_manager import ConnectionManager, manager, room_size_label
+
+NUMBER = (int, float)
+
+Handler = Callable[[str, str, str, dict], Awaitable[None]]
+
+messages = metrics.counter(
+    "ws_messages_total", "Inbound WebSocket messages by type and dispatch result", ("type", "result")
+)
+message_bytes = metrics.histogram(
+    "ws_message_bytes",
+    "Size of inbound WebSocket frames by message type",
+    ("type",),
+    buckets=(64, 128, 256, 512, 1024, 4096, 16384, 65536),
+)
+handler_seconds = metrics.histogram(
+    "ws_handler_seconds",
+    "Time spent handling one inbound WebSocket message, fan-out included",
+    ("type", "room_size"),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5),
+)
+_unknown = messages.labels("unknown", "invalid")
+
+
+class required:
+    """A required schema field whose value must also pass check(value)."""
+
+    __slots__ = ("types", "check")
+
+    def __init__(self, *types, check: Callable[[object], bool] | None = None):
+        self.types = types
+        self.check = check
+
+
+class optional(required):
+    """Marks a schema field that may be missing or null (optionally with a check)."""
+
+
+class Schema:
+    """
+    Required and optional fields of a message, e.g.
+        Schema(targetUserId=str, sdp=dict)
+        Schema(drawData=Schema(x=NUMBER, y=NUMBER, color=optional(str)))
+    A field is a type, a tuple of types, a nested Schema (for a dict), optional(...),
+    or required(...); the last two can also take a check on the value, e.g.
+        color=optional(str, check=lambda c: len(c) <= 32)
+    """
+
+    __slots__ = ("checks",)
+
+    def __init__(self, **fields):
+        checks = []
+        for name, spec in fields.items():
+            is_required = not isinstance(spec, optional)
+            check = None
+            if isinstance(spec, required):
+                check = spec.check
+                spec = spec.types[0] if len(spec.types) == 1 else spec.types
+            nested = spec if isinstance(spec, Schema) else None
+            types = dict if nested is not None else spec
+            checks.append((name, types, is_required, nested, check))
+        # (field, types, required, nested schema, value check)
+        self.checks = tuple(checks)
+
+    def validate(self, message: dict) -> str | None:
+        """The first field that does not match, or None if the message is valid."""
+        for name, types, is_required, nested, check in self.checks:
+            value = message.get(name)
+            if value is None:
+                if is_required:
+                    return name
+                continue
+            if not isinstance(value, types):
+                return name
+            if check is not None and not check(value):
+                return name
+            if nested is not None:
+                error = nested.validate(value)
+                if error is not None:
+                    return f"{name}.{error}"
+        return None
+
+
+EMPTY = Schema()
+
+
+class Route:
+    """A registered message type: its handler, schema and metric children."""
+
+    __slots__ = ("msg_type", "handler", "schema", "handled", "invalid", "errors", "bytes", "_timings")
+
+    def __init__(self, msg_type: str, handler: Handler, schema: Schema):
+        self.msg_type = msg_type
+        self.handler = handler
+        self.schema = schema
+        self.handled = messages.labels(msg_type, "handled")
+        self.invalid = messages.labels(msg_type, "invalid")
+        self.errors = messages.labels(msg_type, "error")
+        self.bytes = message_bytes.labels(msg_type)
+        # room_size label -> histogram child
+        self._timings: dict = {}
+
+    def timing(self, room_size: int):
+        label = room_size_label(room_size)
+        child = self._timings.get(label)
+        if child is None:
+            child = self._timings[label] = handler_seconds.labels(self.msg_type, label)
+        return child
+
+
+class MessageRouter:
+    """msg_type -> Route, for the room WebSocket endpoint."""
+
+    def __init__(self, connections: ConnectionManager):
+        self.connections = connections
+        self.routes: dict[str, Route] = {}
+
+    def route(self, *msg_types: str, schema: Schema = EMPTY):
+        """Register the decorated handler for one or more message types."""
+
+        def register(handler: Handler) -> Handler:
+            for msg_type in msg_types:
+                if msg_type in self.routes:
+                    raise ValueError(f"WebSocket message type already registered: {msg_type}")
+                self.routes[msg_type] = Route(msg_type, handler, schema)
+            return handler
+
+        return register
+
+    async def dispatch(self, room_id: str, user_id: str, display_name: str, message: dict, size: int = 0):
+        """
+        Validate a message and run its handler. Unknown and invalid messages are
+        counted and dropped; handler exceptions are counted and re-raised.
+        size is the frame length (0 for messages released later by the inbound limiter).
+        """
+        route = self.routes.get(message.get("type"))
+        if route is None:
+            _unknown.inc()
+            return
+        if route.schema.validate(message) is not None:
+            route.invalid.inc()
+            return
+
+        if size:
+            route.bytes.observe(size)
+        timing = route.timing(len(self.connections.rooms.get(room_id, ())))
+        start = time.perf_counter()
+        try:
+            await route.handler(room_id, user_id, display_name, message)
+        except Exception:
+            route.errors.inc()
+            raise
+        finally:
+            timing.observe(time.perf_counter() - start)
+        route.handled.inc()
+
+
+message_router = MessageRouter(manager)
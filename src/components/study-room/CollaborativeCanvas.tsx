@@ -11,6 +11,7 @@ import type { DrawEvent } from '../../hooks/useCanvasSync';
 interface CollaborativeCanvasProps {
     sendDraw: (data: DrawEvent) => void;
     sendClear: () => void;
+    requestSnapshot?: () => void;
     onDrawRef: React.MutableRefObject<((data: DrawEvent) => void) | null>;
     onClearRef: React.MutableRefObject<(() => void) | null>;
     onClose: () => void;
@@ -24,6 +25,7 @@ const COLORS = [
 export default function CollaborativeCanvas({
     sendDraw,
     sendClear,
+    requestSnapshot,
     onDrawRef,
     onClearRef,
     onClose,
@@ -101,7 +103,9 @@ export default function CollaborativeCanvas({
                 ctx.clearRect(0, 0, canvas.width, canvas.height);
             }
         };
-    }, [drawLine, onDrawRef, onClearRef]);
+        // Catch up on strokes drawn before the canvas was opened
+        requestSnapshot?.();
+    }, [drawLine, onDrawRef, onClearRef, requestSnapshot]);
 
     // Get canvas position from mouse/touch event
     const getCanvasPos = (e: React.MouseEvent | React.TouchEvent) => {
@@ -359,6 +359,7 @@ export default function RoomPage() {
                             <CollaborativeCanvas
                                 sendDraw={canvas.sendDraw}
                                 sendClear={canvas.sendClear}
+                                requestSnapshot={canvas.requestSnapshot}
                                 onDrawRef={canvas.onDrawRef}
                                 onClearRef={canvas.onClearRef}
                                 onClose={() => {
@@ -4,6 +4,8 @@
  */
 
 import { useCallback, useEffect, useRef, useState } from 'react';
+import { BINARY_SUBPROTOCOL, BinaryCanvasCodec } from '../lib/binaryProtocol';
+import { supabase } from '../lib/supabase';
 
 export interface DrawEvent {
     x: number;
@@ -15,32 +17,79 @@ export interface DrawEvent {
     tool: 'pen' | 'eraser';
 }
 
+/** A compacted stroke from a canvas-snapshot: flat [x0, y0, x1, y1, ...] points. */
+interface SnapshotStroke {
+    color: string;
+    size: number;
+    tool: 'pen' | 'eraser';
+    points: number[];
+}
+
 const WS_BASE = import.meta.env.VITE_WS_URL || 'ws://localhost:8000';
 
 export function useCanvasSync(roomId: string, userId: string, displayName: string) {
     const wsRef = useRef<WebSocket | null>(null);
+    const binaryCodecRef = useRef<BinaryCanvasCodec | null>(null);
     const [isConnected, setIsConnected] = useState(false);
     const onDrawRef = useRef<((data: DrawEvent) => void) | null>(null);
     const onClearRef = useRef<(() => void) | null>(null);
 
-    const connect = useCallback(() => {
+    const connect = useCallback(async () => {
         if (wsRef.current?.readyState === WebSocket.OPEN) return;
 
+        // Browsers cannot set headers on a WebSocket, so the access token rides in the query
+        const { data: { session } } = await supabase.auth.getSession();
+        const token = session?.access_token ?? '';
+
+        // Offer the packed binary canvas protocol; servers without it fall back to JSON
         const ws = new WebSocket(
-            `${WS_BASE}/ws/room/${roomId}?user_id=${userId}&display_name=${encodeURIComponent(displayName)}`
+            `${WS_BASE}/ws/room/${roomId}?user_id=${userId}&display_name=${encodeURIComponent(displayName)}&token=${encodeURIComponent(token)}`,
+            [BINARY_SUBPROTOCOL]
         );
+        ws.binaryType = 'arraybuffer';
+        const binaryCodec = new BinaryCanvasCodec();
+        binaryCodecRef.current = binaryCodec;
 
         ws.onopen = () => setIsConnected(true);
         ws.onclose = () => setIsConnected(false);
 
         ws.onmessage = (event) => {
+            if (event.data instanceof ArrayBuffer) {
+                for (const segment of binaryCodec.decode(event.data)) {
+                    onDrawRef.current?.(segment.drawData);
+                }
+                return;
+            }
+
             const message = JSON.parse(event.data);
             if (message.type === 'canvas-draw' && message.drawData) {
                 onDrawRef.current?.(message.drawData);
+            } else if (message.type === 'canvas-batch' && message.segments) {
+                // Server-coalesced segments, in the order they were drawn
+                for (const segment of message.segments) {
+                    onDrawRef.current?.(segment.drawData);
+                }
+            } else if (message.type === 'canvas-snapshot' && message.strokes) {
+                // Full canvas for late joiners: replay each stroke as segments
+                onClearRef.current?.();
+                for (const stroke of message.strokes as SnapshotStroke[]) {
+                    const { points } = stroke;
+                    for (let i = 2; i + 1 < points.length; i += 2) {
+                        onDrawRef.current?.({
+                            prevX: points[i - 2],
+                            prevY: points[i - 1],
+                            x: points[i],
+                            y: points[i + 1],
+                            color: stroke.color,
+                            size: stroke.size,
+                            tool: stroke.tool,
+                        });
+                    }
+                }
             } else if (message.type === 'canvas-clear') {
                 onClearRef.current?.();
             }
-            // Other message types (presence-update, typing-start, etc.)
+            // Other message types (presence-delta, typing-start, etc.)
             // are handled by their respective hooks via wsRef
         };
 
@@ -48,9 +97,17 @@ export function useCanvasSync(roomId: string, userId: string, displayName: strin
     }, [roomId, userId, displayName]);
 
     const sendDraw = useCallback((drawData: DrawEvent) => {
-        if (wsRef.current?.readyState === WebSocket.OPEN) {
-            wsRef.current.send(JSON.stringify({ type: 'canvas-draw', drawData }));
+        const ws = wsRef.current;
+        if (ws?.readyState !== WebSocket.OPEN) return;
+
+        if (ws.protocol === BINARY_SUBPROTOCOL && binaryCodecRef.current) {
+            const frames = binaryCodecRef.current.encodeDraw(drawData);
+            if (frames) {
+                for (const frame of frames) ws.send(frame);
+                return;
+            }
         }
+        ws.send(JSON.stringify({ type: 'canvas-draw', drawData }));
     }, []);
 
     const sendClear = useCallback(() => {
@@ -59,9 +116,17 @@ export function useCanvasSync(roomId: string, userId: string, displayName: strin
         }
     }, []);
 
+    // Ask the server for the current canvas (e.g. when the canvas is opened mid-session)
+    const requestSnapshot = useCallback(() => {
+        if (wsRef.current?.readyState === WebSocket.OPEN) {
+            wsRef.current.send(JSON.stringify({ type: 'canvas-sync' }));
+        }
+    }, []);
+
     const disconnect = useCallback(() => {
         wsRef.current?.close();
         wsRef.current = null;
+        binaryCodecRef.current = null;
         setIsConnected(false);
     }, []);
 
@@ -76,6 +141,7 @@ export function useCanvasSync(roomId: string, userId: string, displayName: strin
         disconnect,
         sendDraw,
         sendClear,
+        requestSnapshot,
         onDrawRef,
         onClearRef,
     };
@@ -6,13 +6,22 @@ interface UsePresenceOptions {
     wsRef: React.MutableRefObject<WebSocket | null>;
 }
 
+interface PresenceMember {
+    userId: string;
+    displayName: string;
+}
+
 /**
  * Hook that sends heartbeat pings over the existing room WebSocket
- * and tracks online users from presence-update messages.
+ * and tracks online users: a presence-snapshot on connect, then presence-delta
+ * (join/leave) events. Each carries the room's roster version; a skipped
+ * version means a delta was missed, so the hook asks for a fresh snapshot.
  */
 export function usePresence({ wsRef }: UsePresenceOptions) {
     const [onlineUsers, setOnlineUsers] = useState<string[]>([]);
     const heartbeatInterval = useRef<ReturnType<typeof setInterval> | null>(null);
+    const rosterRef = useRef<Map<string, string>>(new Map());
+    const versionRef = useRef(-1);
 
     // Start heartbeat when connected
     useEffect(() => {
@@ -38,11 +47,31 @@ export function usePresence({ wsRef }: UsePresenceOptions) {
         const ws = wsRef.current;
         if (!ws) return;
 
+        const publish = () => setOnlineUsers(Array.from(rosterRef.current.keys()));
+
         const handleMessage = (event: MessageEvent) => {
+            if (typeof event.data !== 'string') return;
             try {
                 const data = JSON.parse(event.data);
-                if (data.type === 'presence-update' && data.online) {
-                    setOnlineUsers(data.online);
+                if (data.type === 'presence-snapshot') {
+                    const members: PresenceMember[] = data.online || [];
+                    rosterRef.current = new Map(members.map((m) => [m.userId, m.displayName]));
+                    versionRef.current = data.version;
+                    publish();
+                } else if (data.type === 'presence-delta') {
+                    if (data.version <= versionRef.current) return;
+                    if (versionRef.current < 0 || data.version !== versionRef.current + 1) {
+                        // Missed a delta (or no snapshot yet): resync
+                        ws.send(JSON.stringify({ type: 'presence-sync' }));
+                        return;
+                    }
+                    versionRef.current = data.version;
+                    if (data.op === 'join') {
+                        rosterRef.current.set(data.userId, data.displayName || '');
+                    } else {
+                        rosterRef.current.delete(data.userId);
+                    }
+                    publish();
                 }
             } catch {
                 // Ignore parse errors
@@ -50,6 +79,10 @@ export function usePresence({ wsRef }: UsePresenceOptions) {
         };
 
         ws.addEventListener('message', handleMessage);
+        // Attached after the connect-time snapshot went by: ask for another
+        if (ws.readyState === WebSocket.OPEN && versionRef.current < 0) {
+            ws.send(JSON.stringify({ type: 'presence-sync' }));
+        }
         return () => ws.removeEventListener('message', handleMessage);
     }, [wsRef]);
 
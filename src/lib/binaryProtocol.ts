@@ -0,0 +1,123 @@
+/**
+ * Compact binary WebSocket subprotocol for canvas frames (bondbox.bin.v1).
+ * Mirrors backend/services/binary_protocol.py.
+ *
+ * Frame layout (little-endian, first byte is the opcode):
+ *   OP_INTERN  u8 op, then repeated entries: u8 table, u16 index, u8 length, utf-8 bytes
+ *   OP_DRAW    u8 op, u16 count, then count segments:
+ *              u16 user, i16 x, i16 y, i16 prevX, i16 prevY, u8 color, u8 size, u8 tool
+ */
+
+import type { DrawEvent } from '../hooks/useCanvasSync';
+
+export const BINARY_SUBPROTOCOL = 'bondbox.bin.v1';
+
+const OP_INTERN = 1;
+const OP_DRAW = 2;
+const TABLE_USER = 0;
+const TABLE_COLOR = 1;
+const TOOLS: DrawEvent['tool'][] = ['pen', 'eraser'];
+const COORD_SCALE = 2;
+const COORD_LIMIT = 32767;
+const DRAW_HEADER_SIZE = 3;
+const SEGMENT_SIZE = 13;
+
+const encoder = new TextEncoder();
+const decoder = new TextDecoder();
+
+const toCoord = (value: number) =>
+    Math.max(-COORD_LIMIT, Math.min(COORD_LIMIT, Math.round(value * COORD_SCALE)));
+
+export interface BinarySegment {
+    userId: string;
+    drawData: DrawEvent;
+}
+
+/** Per-connection intern tables: the server's (inbound) and our own colors (outbound). */
+export class BinaryCanvasCodec {
+    private users: string[] = [];
+    private colors: string[] = [];
+    private outColors = new Map<string, number>();
+
+    /** Decode a server frame. Intern frames update the tables and yield no segments. */
+    decode(buffer: ArrayBuffer): BinarySegment[] {
+        const view = new DataView(buffer);
+        const bytes = new Uint8Array(buffer);
+        const op = view.getUint8(0);
+
+        if (op === OP_INTERN) {
+            let offset = 1;
+            while (offset < buffer.byteLength) {
+                const table = view.getUint8(offset);
+                const index = view.getUint16(offset + 1, true);
+                const length = view.getUint8(offset + 3);
+                offset += 4;
+                const value = decoder.decode(bytes.subarray(offset, offset + length));
+                offset += length;
+                if (table === TABLE_USER) this.users[index] = value;
+                else if (table === TABLE_COLOR) this.colors[index] = value;
+            }
+            return [];
+        }
+
+        if (op !== OP_DRAW) return [];
+
+        const count = view.getUint16(1, true);
+        const segments: BinarySegment[] = [];
+        for (let i = 0; i < count; i++) {
+            const o = DRAW_HEADER_SIZE + i * SEGMENT_SIZE;
+            segments.push({
+                userId: this.users[view.getUint16(o, true)] ?? '',
+                drawData: {
+                    x: view.getInt16(o + 2, true) / COORD_SCALE,
+                    y: view.getInt16(o + 4, true) / COORD_SCALE,
+                    prevX: view.getInt16(o + 6, true) / COORD_SCALE,
+                    prevY: view.getInt16(o + 8, true) / COORD_SCALE,
+                    color: this.colors[view.getUint8(o + 10)] ?? '#ffffff',
+                    size: view.getUint8(o + 11),
+                    tool: TOOLS[view.getUint8(o + 12)] ?? 'pen',
+                },
+            });
+        }
+        return segments;
+    }
+
+    /**
+     * Encode one draw segment; a new color is announced in an intern frame first.
+     * Returns null when the color table is full and the segment should go as JSON.
+     */
+    encodeDraw(draw: DrawEvent): ArrayBuffer[] | null {
+        const frames: ArrayBuffer[] = [];
+
+        let colorIndex = this.outColors.get(draw.color);
+        if (colorIndex === undefined) {
+            if (this.outColors.size > 255) return null;
+            colorIndex = this.outColors.size;
+            this.outColors.set(draw.color, colorIndex);
+            const raw = encoder.encode(draw.color).subarray(0, 255);
+            const intern = new DataView(new ArrayBuffer(5 + raw.length));
+            intern.setUint8(0, OP_INTERN);
+            intern.setUint8(1, TABLE_COLOR);
+            intern.setUint16(2, colorIndex, true);
+            intern.setUint8(4, raw.length);
+            new Uint8Array(intern.buffer).set(raw, 5);
+            frames.push(intern.buffer);
+        }
+
+        const view = new DataView(new ArrayBuffer(DRAW_HEADER_SIZE + SEGMENT_SIZE));
+        view.setUint8(0, OP_DRAW);
+        view.setUint16(1, 1, true);
+        const o = DRAW_HEADER_SIZE;
+        view.setUint16(o, 0, true); // sender is implied by the connection
+        view.setInt16(o + 2, toCoord(draw.x), true);
+        view.setInt16(o + 4, toCoord(draw.y), true);
+        view.setInt16(o + 6, toCoord(draw.prevX), true);
+        view.setInt16(o + 8, toCoord(draw.prevY), true);
+        view.setUint8(o + 10, colorIndex);
+        view.setUint8(o + 11, Math.max(0, Math.min(255, Math.round(draw.size))));
+        view.setUint8(o + 12, Math.max(0, TOOLS.indexOf(draw.tool)));
+        frames.push(view.buffer);
+
+        return frames;
+    }
+}
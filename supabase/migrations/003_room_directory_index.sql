@@ -0,0 +1,6 @@
+-- Room directory keyset pagination (GET /api/rooms)
+-- Run this in Supabase SQL Editor
+
+-- Newest-first pages seek on (created_at, id) within active/inactive rooms
+CREATE INDEX IF NOT EXISTS idx_study_rooms_directory
+  ON public.study_rooms(is_active, created_at DESC, id DESC);